@@ -0,0 +1,75 @@
+import os
+import hmac
+import threading
+
+# Bearer token for scripts and scheduled jobs that write without a dashboard login, set with the PROFITPULSE_ADMIN_TOKEN
+# environment variable. Left empty, only Firebase ID tokens of admins are accepted.
+ADMIN_TOKEN = os.environ.get('PROFITPULSE_ADMIN_TOKEN', '')
+
+# Service account file the Firebase Admin SDK verifies ID tokens and reads the users collection with, set with the
+# PROFITPULSE_FIREBASE_CREDENTIALS environment variable. Left empty, the SDK uses the application default credentials.
+FIREBASE_CREDENTIALS = os.environ.get('PROFITPULSE_FIREBASE_CREDENTIALS', '')
+
+# Raised when a request may not write, with the HTTP status to answer it with
+class AdminAuthError(Exception):
+    def __init__(self, message, status=401):
+        super().__init__(message)
+        self.status = status
+
+# Firebase app of the process, the Admin SDK is only imported and initialized once the first write is checked
+firebase_app = None
+firebase_lock = threading.Lock()
+
+def firebase():
+    global firebase_app
+    with firebase_lock:
+        if firebase_app is None:
+            try:
+                import firebase_admin
+                from firebase_admin import credentials
+            except ImportError:
+                raise AdminAuthError("Admin authentication is not configured, install firebase-admin or set PROFITPULSE_ADMIN_TOKEN", 503)
+
+            firebase_app = firebase_admin.initialize_app(credentials.Certificate(FIREBASE_CREDENTIALS) if FIREBASE_CREDENTIALS else None)
+    return firebase_app
+
+# Verifies the Firebase ID token the dashboard sends and returns the user's uid when they are an admin. Like the
+# dashboard's ProtectedRoute, a user is an admin when their users/<uid> document has isAdmin set, an admin custom claim
+# on the token is accepted as well so the Firestore read can be skipped.
+def verify_firebase_admin(id_token):
+    app = firebase()
+    from firebase_admin import auth, firestore
+
+    try:
+        claims = auth.verify_id_token(id_token, app=app)
+    except auth.CertificateFetchError as certificateFetchError:
+        raise AdminAuthError(f"Could not fetch the Firebase certificates: {certificateFetchError}", 503)
+    except (ValueError, auth.InvalidIdTokenError) as invalidIdTokenError:
+        raise AdminAuthError(f"Invalid ID token: {invalidIdTokenError}", 401)
+
+    uid = claims["uid"]
+    if claims.get("admin") or claims.get("isAdmin"):
+        return uid
+
+    user = firestore.client(app).collection("users").document(uid).get()
+    if not (user.exists and (user.to_dict() or {}).get("isAdmin")):
+        raise AdminAuthError("Admin access is required", 403)
+    return uid
+
+# Checks the Authorization header of a write to the shared prediction history. The bearer token is either the admin
+# token or a Firebase ID token of an admin, the ID token check is injectable so the endpoints can be tested offline.
+class AdminAuth:
+    def __init__(self, admin_token=ADMIN_TOKEN, verify_id_token=verify_firebase_admin):
+        self.admin_token = admin_token
+        self.verify_id_token = verify_id_token
+
+    # Returns who made the request, raises AdminAuthError when they may not write
+    def verify(self, authorization):
+        scheme, _, token = (authorization or '').partition(' ')
+        token = token.strip()
+        if scheme.lower() != 'bearer' or not token:
+            raise AdminAuthError("A bearer token is required", 401)
+
+        if self.admin_token and hmac.compare_digest(token.encode(), self.admin_token.encode()):
+            return "admin_token"
+        return self.verify_id_token(token)
@@ -0,0 +1,205 @@
+import os
+import json
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import numpy as np
+import stock_api
+import preprocessing
+import timing
+import training_log
+from batch import init_worker, clean_symbols
+from model_registry import DEFAULT_REGISTRY_DIR
+from numpy_inference import NumpyModel
+from features import DEFAULT_FEATURES
+
+# Directory for the stored backtest results, can be moved with the PROFITPULSE_BACKTEST_DIR environment variable
+DEFAULT_BACKTEST_DIR = os.environ.get('PROFITPULSE_BACKTEST_DIR', os.path.abspath(os.path.join(os.path.dirname(__file__), 'backtests')))
+
+# Windows predicted between two retrains, None trains once on the windows before the test set like ProcessData
+DEFAULT_RETRAIN_EVERY = None
+
+# Profile the backtest trains with, every fold trains both models so the fast profile keeps hundreds of tickers feasible
+DEFAULT_BACKTEST_PROFILE = 'fast'
+
+# Models reported by the backtest, the ensemble is the predictions_average served by /api/predict
+BACKTEST_MODELS = ("lstm", "transformer", "ensemble")
+
+# Error and directional hit rate for every horizon, 1 to futurecandles hours ahead, over all the predicted windows.
+# The direction is the sign of the move from the reference price, the last target seen by the window. Moves of
+# exactly zero count as hits when the prediction is flat as well.
+def horizon_metrics(actual, predicted, reference):
+    errors = predicted - actual
+    actual_direction = np.sign(actual - reference[:, np.newaxis])
+    predicted_direction = np.sign(predicted - reference[:, np.newaxis])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentage_errors = np.abs(errors) / np.abs(actual)
+
+    return {
+        "mae": np.abs(errors).mean(axis=0).tolist(),
+        "rmse": np.sqrt((errors ** 2).mean(axis=0)).tolist(),
+        "mape": np.nanmean(np.where(np.isfinite(percentage_errors), percentage_errors, np.nan), axis=0).tolist(),
+        "hit_rate": (actual_direction == predicted_direction).mean(axis=0).tolist(),
+    }
+
+# Start and end window of every walk forward fold. The test set starts where ProcessData splits, each fold predicts
+# retrain_every windows with models trained on every window before it.
+def walk_forward_folds(samples, retrain_every=None, test_size=0.2):
+    first_test = preprocessing.SplitIndex(samples, test_size)
+    step = retrain_every or samples - first_test
+    return [(start, min(start + step, samples)) for start in range(first_test, samples, step)]
+
+# End of the training windows of the fold starting at window start. The targets of a training window must all be known
+# when the fold's first window is predicted, which is the row before start + backcandles, so the last training window
+# is the one whose last target is that row.
+def fold_training_end(start, futurecandles):
+    return start - futurecandles + 1
+
+# Walk forward backtest of the LSTM, Transformer and their average for a single ticker. Each fold fits the scalers and
+# trains both models only on bars that were known when its first window was predicted, then predicts all of the fold's
+# windows in one batched NumPy pass.
+class Backtest:
+    def __init__(self, ticker, retrain_every=DEFAULT_RETRAIN_EVERY, profile=DEFAULT_BACKTEST_PROFILE, backcandles=21, futurecandles=7, test_size=0.2):
+        self.ticker = ticker.upper()
+        self.retrain_every = retrain_every
+        self.profile = profile
+        self.backcandles = backcandles
+        self.futurecandles = futurecandles
+        self.test_size = test_size
+        self.features = list(DEFAULT_FEATURES)
+        self.results = None
+        self.summary = None
+
+    # Trains both models on the windows of the fold's training set and predicts the fold's windows. Returns the UTC
+    # timestamp and reference price of every predicted window with the un-scaled targets and predictions.
+    def run_fold(self, data, start, end):
+        from predict_model import model_classes
+
+        # The scalers are fitted on the rows known when the fold's first window is predicted
+        known_rows = start + self.backcandles
+        train_end = fold_training_end(start, self.futurecandles)
+
+        fitted = preprocessing.ProcessedStock(data.iloc[:known_rows].copy(), features=self.features)
+        fitted.process_stock_data(fitted.data)
+        X, y, index = preprocessing.ProcessDataWithScalers(data.copy(), fitted.feature_scaler, fitted.target_scaler, self.backcandles, self.futurecandles, features=self.features)
+
+        predictions = {}
+        for name, model_class in zip(("lstm", "transformer"), model_classes()):
+            model = model_class(X[:train_end], X[start:end], y[:train_end], y[start:end], self.backcandles, self.profile)
+            model.run_model()
+            with timing.span(f"backtest.{name}.predict"):
+                predictions[name] = NumpyModel.from_keras(model.model).predict(X[start:end])
+
+        # Un-scale with the fold's own scaler, the target scaler only has a single column
+        unscale = lambda values: fitted.target_scaler.inverse_transform(values.reshape(-1, 1)).reshape(values.shape)
+
+        # The reference price of window i is the last target it has seen, on row i + backcandles - 1
+        reference_rows = slice(start + self.backcandles - 1, end + self.backcandles - 1)
+        reference = data['Adj Close'].to_numpy(dtype=np.float64)[reference_rows]
+
+        timestamps = index[reference_rows]
+        if timestamps.tz is not None:
+            timestamps = timestamps.tz_convert('UTC').tz_localize(None)
+
+        return timestamps.values.astype('datetime64[ns]'), reference, unscale(y[start:end]), unscale(predictions["lstm"]), unscale(predictions["transformer"])
+
+    # Runs every fold and computes the per horizon metrics. Returns the summary, which is also kept on the object with
+    # the per window results so they can be saved.
+    def run(self):
+        with timing.collect() as timings:
+            data = stock_api.DownloadData(self.ticker)
+            if data is None or data.empty:
+                raise ValueError(f"No data has been found for {self.ticker}")
+            data = data.dropna()
+
+            samples = data.shape[0] - self.backcandles - self.futurecandles
+            folds = walk_forward_folds(samples, self.retrain_every, self.test_size)
+            if not folds or fold_training_end(folds[0][0], self.futurecandles) <= 0:
+                raise ValueError(f"Need more than {self.backcandles + self.futurecandles} rows to backtest, got {data.shape[0]}")
+
+            fold_results = []
+            for number, (start, end) in enumerate(folds):
+                training_log.logger.info(f"Backtest {self.ticker} fold {number + 1} of {len(folds)}, windows {start} to {end}")
+                fold_results.append(self.run_fold(data, start, end))
+
+        timestamps, reference, actual, lstm, transformer = (np.concatenate(parts) for parts in zip(*fold_results))
+        self.results = {
+            "timestamps": timestamps.astype(np.int64),
+            "reference": reference.astype(np.float32),
+            "actual": actual.astype(np.float32),
+            "lstm": lstm.astype(np.float32),
+            "transformer": transformer.astype(np.float32),
+        }
+
+        predictions = {"lstm": lstm, "transformer": transformer, "ensemble": (lstm + transformer) / 2}
+        self.summary = {
+            "ticker": self.ticker,
+            "windows": int(actual.shape[0]),
+            "folds": len(folds),
+            "retrain_every": self.retrain_every,
+            "profile": self.profile,
+            "features": self.features,
+            "backcandles": self.backcandles,
+            "futurecandles": self.futurecandles,
+            "start": str(timestamps[0]),
+            "end": str(timestamps[-1]),
+            "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "metrics": {name: horizon_metrics(actual, predictions[name], reference) for name in BACKTEST_MODELS},
+            "timings": timings.to_dict(),
+        }
+        return self.summary
+
+    # Stores the per window results as float32 arrays with the summary in a single compressed .npz file per ticker,
+    # written through a uniquely named temporary file and renamed so the dashboard never reads a partial result and two
+    # backtests of the same ticker never write into the same temporary file
+    def save(self, directory=DEFAULT_BACKTEST_DIR):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.ticker}.npz")
+        stock_api.write_npz(path, compressed=True, summary=np.array(json.dumps(self.summary)), **self.results)
+        return path
+
+# Reads the stored summary of the ticker's last backtest, returns None if it has never been backtested
+def LoadSummary(ticker, directory=DEFAULT_BACKTEST_DIR):
+    try:
+        with np.load(os.path.join(directory, f"{ticker.upper()}.npz"), allow_pickle=False) as results:
+            return json.loads(str(results["summary"]))
+    except FileNotFoundError:
+        return None
+
+# Backtests a single ticker within a worker and stores the results, returning {ticker: summary} or {ticker: {"Error": ...}}
+def backtest_ticker(ticker, retrain_every=DEFAULT_RETRAIN_EVERY, profile=DEFAULT_BACKTEST_PROFILE, directory=DEFAULT_BACKTEST_DIR):
+    try:
+        backtest = Backtest(ticker, retrain_every, profile)
+        backtest.run()
+        backtest.save(directory)
+        return {backtest.ticker: backtest.summary}
+    except Exception as exception:
+        print(f"Error during backtest for {ticker}: {exception}")
+        return {ticker.upper(): {"Error": str(exception)}}
+
+# Backtests many tickers over a pool of worker processes sized to the machine's cores, yielding each ticker's summary as
+# it completes in the same {ticker: ...} format as PredictBatch
+def BacktestBatch(symbols, retrain_every=DEFAULT_RETRAIN_EVERY, profile=DEFAULT_BACKTEST_PROFILE, directory=DEFAULT_BACKTEST_DIR, max_workers=None):
+    symbols = clean_symbols(symbols)
+    cores = os.cpu_count() or 1
+    max_workers = min(max_workers or cores, max(1, len(symbols)))
+
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'), initializer=init_worker,
+                             initargs=(DEFAULT_REGISTRY_DIR, max(1, cores // max_workers), 1)) as executor:
+        futures = [executor.submit(backtest_ticker, symbol, retrain_every, profile, directory) for symbol in symbols]
+        for future in as_completed(futures):
+            yield future.result()
+
+# Prints one JSON line per ticker, for example: python backtest.py AAPL MSFT --retrain-every 500
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Walk forward backtest of the ProfitPulse models")
+    parser.add_argument('symbols', nargs='+')
+    parser.add_argument('--retrain-every', type=int, default=DEFAULT_RETRAIN_EVERY)
+    parser.add_argument('--profile', default=DEFAULT_BACKTEST_PROFILE)
+    parser.add_argument('--workers', type=int, default=None)
+    arguments = parser.parse_args()
+
+    for summary in BacktestBatch(arguments.symbols, arguments.retrain_every, arguments.profile, max_workers=arguments.workers):
+        print(json.dumps(summary), flush=True)
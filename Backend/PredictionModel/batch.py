@@ -0,0 +1,97 @@
+import os
+import sys
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from model_registry import DEFAULT_REGISTRY_DIR, not_trained_error
+import timing
+
+# Registry of the worker process, kept between tasks so the worker's hot models stay loaded
+worker_registry = None
+
+# Limits the TensorFlow thread pools of a worker so the workers together do not oversubscribe the cores. This runs
+# before TensorFlow is imported within the worker, which is the only point the thread counts can still be changed. Workers
+# serving with the NumPy engine only import TensorFlow if a ticker has to be trained, which reads the same variables.
+def init_worker(registry_root, intra_op_threads, inter_op_threads):
+    global worker_registry
+    os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(intra_op_threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = str(inter_op_threads)
+
+    from numpy_inference import INFERENCE_ENGINE
+    if INFERENCE_ENGINE != 'numpy':
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+    from model_registry import ModelRegistry
+    worker_registry = ModelRegistry(registry_root)
+
+# Predicts a single ticker within a worker from the registry, a ticker that has no model yet yields an error
+def predict_ticker(ticker):
+    import predict_model
+
+    prediction_model = predict_model.PredictionModel(ticker)
+    if not prediction_model.predict_from_registry(worker_registry):
+        prediction_model.stock_predictions[ticker] = {"Error": not_trained_error(ticker)}
+    return prediction_model.stock_predictions
+
+# Upper cases the symbols and drops duplicates while keeping their order
+def clean_symbols(symbols):
+    cleaned = []
+    for symbol in symbols:
+        symbol = symbol.strip().upper()
+        if symbol and symbol not in cleaned:
+            cleaned.append(symbol)
+    return cleaned
+
+# Fans predictions for many tickers out over a pool of worker processes sized to the machine's cores. The pool is
+# started on the first batch and reused afterwards so workers only pay the TensorFlow start up cost once.
+class BatchPredictor:
+    def __init__(self, registry_root=DEFAULT_REGISTRY_DIR, max_workers=None, inter_op_threads=1):
+        self.registry_root = registry_root
+        self.cores = os.cpu_count() or 1
+        self.max_workers = max_workers or self.cores
+        self.inter_op_threads = inter_op_threads
+        self.executor = None
+
+    def start(self):
+        if self.executor is None:
+            intra_op_threads = max(1, self.cores // self.max_workers)
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=init_worker, initargs=(self.registry_root, intra_op_threads, self.inter_op_threads))
+
+    # Yields {ticker: predictions} as each ticker completes, in the same format as PredictionModel.prediction_to_json.
+    # A ticker that fails yields {ticker: {"Error": ...}} so one bad symbol does not stop the batch.
+    def predict(self, symbols):
+        self.start()
+        futures = {self.executor.submit(predict_ticker, symbol): symbol for symbol in clean_symbols(symbols)}
+
+        for future in as_completed(futures):
+            symbol = futures[future]
+            try:
+                predictions = future.result()
+                timing.metrics.observe_timings(predictions[symbol].get("timings"))
+                yield predictions
+            except Exception as exception:
+                print(f"Error during batch prediction for {symbol}: {exception}")
+                yield {symbol: {"Error": str(exception)}}
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+# Predicts a batch of tickers with a pool that only lives for this batch, yielding each result as it completes
+def PredictBatch(symbols, registry_root=DEFAULT_REGISTRY_DIR, max_workers=None):
+    symbols = clean_symbols(symbols)
+    predictor = BatchPredictor(registry_root, max_workers=min(max_workers or os.cpu_count() or 1, max(1, len(symbols))))
+    try:
+        yield from predictor.predict(symbols)
+    finally:
+        predictor.shutdown()
+
+# Prints one JSON line per ticker, for example: python batch.py AAPL MSFT GOOG
+if __name__ == '__main__':
+    for predictions in PredictBatch(sys.argv[1:]):
+        print(json.dumps(predictions), flush=True)
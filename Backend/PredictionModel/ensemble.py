@@ -0,0 +1,85 @@
+import os
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import timing
+import training_log
+
+# Model classes that can be ensemble members, as the module and class they are imported from on first use. Every class
+# takes (X_train, X_test, y_train, y_test, backcandles, profile) and exposes run_model(), model and avg_metrics.
+MEMBER_CLASSES = {
+    "lstm": ("lstm_model", "LSTMmodel"),
+    "transformer": ("transformer_model", "TransformerModel"),
+}
+
+# Adds a model class that ensembles can name as a member
+def register_member(name, module, class_name):
+    MEMBER_CLASSES[name] = (module, class_name)
+
+def member_class(name):
+    module, class_name = MEMBER_CLASSES[name]
+    return getattr(importlib.import_module(module), class_name)
+
+# Parses "lstm:0.6,transformer:0.4" into [(name, weight)] with the weights normalized to sum to 1. A member without a
+# weight gets 1 before normalizing, so "lstm,transformer" is an equal average.
+def parse_members(spec):
+    members = []
+    for part in spec.split(','):
+        name, _, weight = part.strip().partition(':')
+        if not name:
+            continue
+        if name not in MEMBER_CLASSES:
+            raise ValueError(f"Unknown ensemble member {name}, expected one of {', '.join(MEMBER_CLASSES)}")
+        weight = float(weight) if weight else 1.0
+        if weight < 0:
+            raise ValueError(f"Ensemble member {name} has a negative weight {weight}")
+        members.append((name, weight))
+
+    total = sum(weight for _, weight in members)
+    if not members or total <= 0:
+        raise ValueError(f"Ensemble {spec} has no members with a positive weight")
+    return [(name, weight / total) for name, weight in members]
+
+# Members the models are trained with and their weights within predictions_average, can be changed with the
+# PROFITPULSE_ENSEMBLE environment variable. The registry serves the lstm and transformer members, so both must be in it
+# for train_and_register, any other member only adds to the predictions of the training run.
+DEFAULT_ENSEMBLE = parse_members(os.environ.get('PROFITPULSE_ENSEMBLE', 'lstm:0.5,transformer:0.5'))
+
+# Weights of the named members from the ensemble, normalized over just those members. Members missing from weights get
+# an equal share, which keeps the plain average for models registered before the weights were stored.
+def member_weights(names, weights=None):
+    weights = dict(weights or {})
+    shares = {name: weights.get(name, 1.0 if not weights else 0.0) for name in names}
+    total = sum(shares.values())
+    if total <= 0:
+        return {name: 1.0 / len(names) for name in names}
+    return {name: share / total for name, share in shares.items()}
+
+# Weighted average of the members' predictions
+def weighted_average(predictions, weights):
+    return sum(weights[name] * np.asarray(values, dtype=np.float64) for name, values in predictions.items())
+
+# Builds, trains and predicts the test windows with a single member
+def train_member(name, X_train, X_test, y_train, y_test, backcandles, profile=None):
+    model = member_class(name)(X_train, X_test, y_train, y_test, backcandles, profile)
+    model.run_model()
+    with timing.span(f"{name}.predict"):
+        predictions = model.model.predict(X_test, verbose=0)
+    return model, predictions
+
+# Trains every member at the same time on its own thread and returns {name: (model, test predictions)}. The members only
+# read the same windows, so they share the arrays without copying them, and TensorFlow releases the GIL while it runs so
+# their ops overlap. The thread counts of TensorFlow are set per process, not per member, so the members compete for the
+# same intra and inter op pools. The gain is in the small ops and the Python side of fit that one member alone leaves
+# the cores idle during, not a split of the cores. Each thread times and logs into the run of the thread that started them.
+def train_members(members, X_train, X_test, y_train, y_test, backcandles, profile=None, max_workers=None):
+    timings = timing.current()
+    run_log = training_log.current()
+
+    def run(name):
+        with timing.attach(timings), training_log.capture(run_log):
+            return train_member(name, X_train, X_test, y_train, y_test, backcandles, profile)
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(members), thread_name_prefix="ensemble") as executor:
+        futures = {name: executor.submit(run, name) for name, _ in members}
+    return {name: future.result() for name, future in futures.items()}
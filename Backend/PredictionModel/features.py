@@ -0,0 +1,214 @@
+import os
+import json
+import threading
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import lfilter
+from stock_api import DEFAULT_DATA_DIR, write_npz
+
+# Features the models are trained on, a comma separated list of bar fields (Open, High, Low, Close, Adj Close, Volume)
+# and indicators: return, ema_<period>, rsi_<period>, atr_<period> and volume_z_<period>. Can be changed with the
+# PROFITPULSE_FEATURES environment variable, the default is the original Open, High and Low.
+DEFAULT_FEATURES = [feature.strip() for feature in os.environ.get('PROFITPULSE_FEATURES', 'Open,High,Low').split(',') if feature.strip()]
+
+# Bar fields that are used as features as they are
+RAW_FIELDS = ('Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume')
+
+# Indicators and the number of their period, the indicators are computed from Close, High, Low and Volume
+INDICATORS = ('return', 'ema', 'rsi', 'atr', 'volume_z')
+
+# Splits a feature name into its indicator and period, ema_12 becomes ('ema', 12) and raw fields become ('raw', None)
+def parse_feature(feature):
+    if feature in RAW_FIELDS:
+        return 'raw', None
+    if feature == 'return':
+        return 'return', None
+
+    indicator, _, period = feature.rpartition('_')
+    if indicator not in INDICATORS or not period.isdigit() or int(period) < 1:
+        raise ValueError(f"Unknown feature {feature}, expected one of {', '.join(RAW_FIELDS)} or return, ema_N, rsi_N, atr_N, volume_z_N")
+    return indicator, int(period)
+
+# Exponential moving average y[n] = alpha * x[n] + (1 - alpha) * y[n - 1], run as a linear filter so the recursion is a
+# single vectorized call. It continues from previous, the last average, or starts at the first value.
+def ema_kernel(values, alpha, previous=None):
+    if values.shape[0] == 0:
+        return values, previous
+    if previous is None:
+        previous = values[0]
+    averages, _ = lfilter([alpha], [1.0, alpha - 1.0], values, zi=[(1.0 - alpha) * previous])
+    return averages, float(averages[-1])
+
+# Change of every value from the one before it, continuing from previous, the last value of the earlier bars
+def diff_kernel(values, previous=None):
+    return np.diff(values, prepend=values[0] if previous is None else previous)
+
+# z-score of every value within the trailing window, which holds fewer values until period bars have been seen.
+# history holds the last period - 1 values of the earlier bars and is returned updated.
+def rolling_z_kernel(values, period, history=None):
+    history = np.asarray(history if history is not None else [], dtype=np.float64)
+    combined = np.concatenate([history, values])
+    windows = sliding_window_view(np.concatenate([np.full(period - 1 - history.shape[0], np.nan), combined]), period)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nanmean(windows, axis=1)
+        std = np.nanstd(windows, axis=1)
+        z_scores = np.where(std > 0, (values - mean) / std, 0.0)
+
+    return z_scores, combined[combined.shape[0] - (period - 1):].tolist()
+
+# Computes the features over a run of bars. Every indicator keeps the rolling state it needs, the last close, the
+# running averages and the trailing volumes, so appending bars only processes the new bars instead of the history.
+class FeatureEngine:
+    def __init__(self, features=None):
+        self.features = list(features or DEFAULT_FEATURES)
+        self.parsed = [parse_feature(feature) for feature in self.features]
+
+    # Returns the (bars, features) values of the bars and the state after the last bar. Passing the state returned for
+    # the bars right before continues exactly where those left off.
+    def compute(self, data, state=None):
+        state = dict(state or {})
+        if data.shape[0] == 0:
+            return np.zeros((0, len(self.features))), state
+
+        previous_close = state.get("close")
+        columns = []
+
+        close = data['Close'].to_numpy(dtype=np.float64) if any(kind in ('return', 'ema', 'rsi', 'atr') for kind, _ in self.parsed) else None
+
+        for feature, (kind, period) in zip(self.features, self.parsed):
+            if kind == 'raw':
+                columns.append(data[feature].to_numpy(dtype=np.float64))
+
+            elif kind == 'return':
+                base = np.concatenate([[close[0] if previous_close is None else previous_close], close[:-1]])
+                columns.append(np.log(close / base))
+
+            elif kind == 'ema':
+                averages, state[feature] = ema_kernel(close, 2.0 / (period + 1), state.get(feature))
+                columns.append(averages)
+
+            elif kind == 'rsi':
+                # Wilder's smoothing of the gains and losses, which is an average with alpha 1 / period
+                change = diff_kernel(close, previous_close)
+                gains, state[feature + ':gain'] = ema_kernel(np.maximum(change, 0.0), 1.0 / period, state.get(feature + ':gain'))
+                losses, state[feature + ':loss'] = ema_kernel(np.maximum(-change, 0.0), 1.0 / period, state.get(feature + ':loss'))
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    columns.append(np.where(gains + losses > 0, 100.0 * gains / (gains + losses), 50.0))
+
+            elif kind == 'atr':
+                high = data['High'].to_numpy(dtype=np.float64)
+                low = data['Low'].to_numpy(dtype=np.float64)
+                previous = np.concatenate([[np.nan if previous_close is None else previous_close], close[:-1]])
+                true_range = np.fmax(high - low, np.fmax(np.abs(high - previous), np.abs(low - previous)))
+                averages, state[feature] = ema_kernel(true_range, 1.0 / period, state.get(feature))
+                columns.append(averages)
+
+            elif kind == 'volume_z':
+                z_scores, state[feature] = rolling_z_kernel(data['Volume'].to_numpy(dtype=np.float64), period, state.get(feature))
+                columns.append(z_scores)
+
+        if close is not None and close.shape[0]:
+            state["close"] = float(close[-1])
+
+        values = np.column_stack(columns) if columns else np.zeros((data.shape[0], 0))
+        return values, state
+
+# Per ticker cache of the feature matrices, stored as .npz files next to the bar cache. Every bar but the last is
+# settled, the last one may still be forming and is replaced by the next download, so the cache keeps the indicator
+# state after the last settled bar and only recomputes the bars from there on.
+class FeatureCache:
+    def __init__(self, directory=DEFAULT_DATA_DIR):
+        self.directory = directory
+        self.frames = {}
+        self.lock = threading.Lock()
+        self.stats = {"full": 0, "incremental": 0, "hits": 0, "computed_rows": 0}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, ticker):
+        return os.path.join(self.directory, f"{ticker.upper()}.features.npz")
+
+    def read(self, ticker):
+        try:
+            with np.load(self.path(ticker), allow_pickle=False) as cached:
+                index = pd.to_datetime(cached["index"], utc=True)
+                timezone = str(cached["timezone"])
+                index = index.tz_convert(timezone) if timezone else index.tz_localize(None)
+                return {
+                    "features": cached["columns"].tolist(),
+                    "frame": pd.DataFrame(cached["values"], index=index, columns=cached["columns"].tolist()),
+                    "state": json.loads(str(cached["state"])),
+                }
+        except FileNotFoundError:
+            return None
+
+    def write(self, ticker, entry):
+        index = entry["frame"].index
+        timezone = str(index.tz) if index.tz is not None else ""
+        if index.tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+
+        write_npz(self.path(ticker), index=index.values.astype('datetime64[ns]').astype(np.int64), timezone=np.array(timezone),
+                  columns=np.array(entry["features"], dtype=str), values=entry["frame"].to_numpy(dtype=np.float64), state=np.array(json.dumps(entry["state"])))
+
+    # Returns the features of every bar in data, which must have had its null rows dropped, as a DataFrame indexed like
+    # data. Only the bars after the last settled one are computed when the cached features still line up with data, and
+    # the cache is only written when that changed the features.
+    def get(self, ticker, data, engine):
+        ticker = ticker.upper()
+        with self.lock:
+            entry = self.frames.get(ticker) or self.read(ticker)
+
+            start, settled = 0, None
+            if entry is not None and entry["features"] == engine.features and entry["frame"].shape[0] > 1:
+                settled = entry["frame"].iloc[:-1]
+                settled = settled[settled.index >= data.index[0]]
+                # The settled rows must be exactly the first rows of data, anything else means the history changed. Data
+                # must also go past them, the state is the one after the last settled bar and cannot be rewound to
+                # settle an earlier bar when data ends on it.
+                if settled.shape[0] and settled.shape[0] < data.shape[0] and settled.index.equals(data.index[:settled.shape[0]]):
+                    start = settled.shape[0]
+
+            if start:
+                state, kept = entry["state"], settled.to_numpy()
+            else:
+                state, kept = None, np.zeros((0, len(engine.features)))
+
+            # The last bar is computed separately so the state after the bar before it can be kept as the settled state
+            new_bars = data.iloc[start:]
+            settled_values, settled_state = engine.compute(new_bars.iloc[:-1], state)
+            last_values, _ = engine.compute(new_bars.iloc[-1:], settled_state)
+            self.stats["computed_rows"] += new_bars.shape[0]
+
+            frame = pd.DataFrame(np.vstack([kept, settled_values, last_values]), index=data.index, columns=engine.features)
+
+            # The same bars as the cached features with the forming bar unchanged, there is nothing new to store
+            if start and frame.index.equals(entry["frame"].index) and np.array_equal(last_values, entry["frame"].to_numpy()[-1:], equal_nan=True):
+                self.stats["hits"] += 1
+                self.frames[ticker] = entry
+                return frame.copy()
+
+            self.stats["incremental" if start else "full"] += 1
+            entry = {"features": engine.features, "frame": frame, "state": settled_state}
+            self.frames[ticker] = entry
+            self.write(ticker, entry)
+            return frame.copy()
+
+    def cache_stats(self):
+        return dict(self.stats, tickers=len(self.frames))
+
+# Shared cache used by FeatureFrame
+feature_cache = FeatureCache()
+
+# Features of every bar in data as a DataFrame with one column per feature. Plain bar fields are selected as they are,
+# indicators are served from the ticker's feature cache when the ticker is known and computed in full otherwise.
+def FeatureFrame(data, features=None, ticker=None):
+    engine = FeatureEngine(features)
+    if all(kind == 'raw' for kind, _ in engine.parsed):
+        return data[engine.features]
+    if ticker is not None and data.shape[0]:
+        return feature_cache.get(ticker, data, engine)
+
+    values, _ = engine.compute(data)
+    return pd.DataFrame(values, index=data.index, columns=engine.features)
@@ -0,0 +1,274 @@
+import os
+import json
+import argparse
+import numpy as np
+import stock_api
+import preprocessing
+import timing
+import training_log
+from batch import clean_symbols
+from features import DEFAULT_FEATURES
+from training_profiles import VALIDATION_SPLIT, get_profile, scaled_learning_rate, profile_metrics
+
+# Architectures a global model can be trained with
+GLOBAL_ARCHITECTURES = ("lstm", "transformer")
+
+# Width of the learned ticker embedding that is appended to every bar of a window, can be changed with the
+# PROFITPULSE_TICKER_EMBEDDING environment variable
+DEFAULT_EMBEDDING_DIM = int(os.environ.get('PROFITPULSE_TICKER_EMBEDDING', 8))
+
+# History keys of the fit and the avg_metrics names they are stored under, the same names the per ticker models report
+HISTORY_METRICS = {
+    "loss": "avg_train_loss", "val_loss": "avg_val_loss",
+    "mean_absolute_error": "avg_train_mae", "val_mean_absolute_error": "avg_val_mae",
+    "root_mean_squared_error": "avg_train_rmse", "val_root_mean_squared_error": "avg_val_rmse",
+    "r2_score": "avg_train_r2", "val_r2_score": "avg_val_r2",
+}
+
+# Streams the windows of many tickers without building them up front. The scaled rows of every ticker are kept once in a
+# single base array and each batch gathers its windows from it, so memory grows with the bars rather than with
+# backcandles times the windows. A window is identified by the base row it starts at and the id of its ticker.
+class InterleavedWindows:
+    def __init__(self, processed, backcandles=21, futurecandles=7, feature_count=3, test_size=0.2, validation_split=VALIDATION_SPLIT):
+        self.backcandles = backcandles
+        self.futurecandles = futurecandles
+        self.feature_count = feature_count
+        self.base = np.concatenate([np.asarray(rows, dtype=np.float32) for rows in processed])
+
+        # The same splits ProcessData and make_datasets make for a single ticker: the trailing test windows are held
+        # out and the trailing windows of the rest validate
+        self.train, self.validation, self.test = [], [], []
+        offset = 0
+        for rows in processed:
+            samples = rows.shape[0] - backcandles - futurecandles
+            if samples <= 0:
+                raise ValueError(f"Need more than {backcandles + futurecandles} rows to build windows, got {rows.shape[0]}")
+            test_start = preprocessing.SplitIndex(samples, test_size)
+            validation_start = test_start - int(test_start * validation_split)
+
+            starts = offset + np.arange(samples)
+            self.train.append(starts[:validation_start])
+            self.validation.append(starts[validation_start:test_start])
+            self.test.append(starts[test_start:])
+            offset += rows.shape[0]
+
+    # Gathers the windows starting at the given base rows, X matches BuildWindows and y the targets after each window
+    def gather(self, starts):
+        rows = starts[:, np.newaxis] + np.arange(self.backcandles)
+        targets = starts[:, np.newaxis] + self.backcandles + np.arange(self.futurecandles)
+        return self.base[rows, :self.feature_count], self.base[targets, self.feature_count]
+
+    # Orders the windows of every ticker so each ticker is spread evenly over the epoch. With a random generator the
+    # windows of every ticker are shuffled and each ticker gets a random phase, so every batch mixes the tickers in
+    # proportion to how many windows they have.
+    def interleave(self, groups, rng=None):
+        starts, ids, keys = [], [], []
+        for ticker_id, group in enumerate(groups):
+            if group.shape[0] == 0:
+                continue
+            phase = rng.random() if rng is not None else 0.5
+            starts.append(rng.permutation(group) if rng is not None else group)
+            ids.append(np.full(group.shape[0], ticker_id, dtype=np.int32))
+            keys.append((np.arange(group.shape[0]) + phase) / group.shape[0])
+
+        order = np.argsort(np.concatenate(keys), kind='stable')
+        return np.concatenate(starts)[order], np.concatenate(ids)[order]
+
+    # Yields ((X, ticker ids), y) batches of the groups, reshuffled on every call when a random generator is given
+    def batches(self, groups, batch_size, rng=None):
+        starts, ids = self.interleave(groups, rng)
+        for batch in range(0, starts.shape[0], batch_size):
+            X, y = self.gather(starts[batch:batch + batch_size])
+            yield (X, ids[batch:batch + batch_size]), y
+
+    # Training and validation pipelines fed by the batch generator, tf.data calls the generator again on every epoch
+    def datasets(self, batch_size, seed=None):
+        import tensorflow as tf
+
+        rng = np.random.default_rng(seed)
+        signature = ((tf.TensorSpec((None, self.backcandles, self.feature_count), tf.float32), tf.TensorSpec((None,), tf.int32)),
+                     tf.TensorSpec((None, self.futurecandles), tf.float32))
+
+        # The batch counts are declared so Keras knows where every epoch ends instead of running the generator dry
+        def pipeline(groups, shuffle_rng):
+            dataset = tf.data.Dataset.from_generator(lambda: self.batches(groups, batch_size, shuffle_rng), output_signature=signature)
+            batches = -(-sum(group.shape[0] for group in groups) // batch_size)
+            return dataset.apply(tf.data.experimental.assert_cardinality(batches)).prefetch(tf.data.AUTOTUNE)
+
+        return pipeline(self.train, rng), pipeline(self.validation, None)
+
+    # The last test window of every ticker, the window train_models predicts the next hours from
+    def latest(self):
+        starts = np.array([group[-1] for group in self.test])
+        X, _ = self.gather(starts)
+        return X, np.arange(starts.shape[0], dtype=np.int32)
+
+    def windows(self):
+        return sum(group.shape[0] for group in self.train + self.validation + self.test)
+
+# Builds a network shared by every ticker. The ticker id is looked up in a learned embedding that is repeated over the
+# window and appended to each bar's features, then the bars run through the same layers as the per ticker model.
+def build_global_network(architecture, backcandles, feature_count, ticker_count, embedding_dim=DEFAULT_EMBEDDING_DIM, profile=None):
+    from keras import layers, models, metrics, optimizers, losses
+    from lstm_model import lstm_layers
+    from transformer_model import transformer_outputs
+
+    window_input = layers.Input(shape=(backcandles, feature_count), name="window")
+    ticker_input = layers.Input(shape=(), dtype="int32", name="ticker_id")
+
+    embedding = layers.Embedding(ticker_count, embedding_dim)(ticker_input)
+    x = layers.Concatenate()([window_input, layers.RepeatVector(backcandles)(embedding)])
+
+    if architecture == "lstm":
+        for layer in lstm_layers():
+            x = layer(x)
+        outputs = x
+    elif architecture == "transformer":
+        outputs = transformer_outputs(x)
+    else:
+        raise ValueError(f"Unknown architecture {architecture}, expected one of {', '.join(GLOBAL_ARCHITECTURES)}")
+
+    model = models.Model(inputs=[window_input, ticker_input], outputs=outputs)
+    model.compile(optimizer=optimizers.Adam(learning_rate=scaled_learning_rate(profile)), loss=losses.MeanSquaredError(),
+                  metrics=[metrics.MeanAbsoluteError(), metrics.RootMeanSquaredError(), metrics.R2Score()])
+    return model
+
+# A single LSTM or Transformer trained on the windows of many tickers at once. Every ticker keeps its own scalers from
+# ProcessedStock, so the shared network sees each ticker normalized to the same range and tells them apart by its id.
+class GlobalModel:
+    def __init__(self, tickers, architecture="lstm", profile=None, backcandles=21, futurecandles=7, features=None, embedding_dim=DEFAULT_EMBEDDING_DIM):
+        self.tickers = clean_symbols(tickers)
+        self.architecture = architecture
+        self.backcandles = backcandles
+        self.futurecandles = futurecandles
+        self.features = list(features or DEFAULT_FEATURES)
+        self.embedding_dim = embedding_dim
+        self.profile_name, self.profile = get_profile(profile)
+        self.scalers = {}
+        self.errors = {}
+        self.windows = None
+        self.model = None
+        self.history = None
+        self.avg_metrics = {}
+
+    # Downloads and scales every ticker with its own scalers, tickers that fail are reported in errors and left out
+    def prepare(self):
+        processed = []
+        for ticker in self.tickers:
+            try:
+                data = stock_api.DownloadData(ticker)
+                if data is None or data.empty:
+                    raise ValueError(f"No data has been found for {ticker}")
+
+                scaled = preprocessing.ProcessedStock(data, features=self.features, ticker=ticker)
+                with timing.span("preprocess.scale"):
+                    rows = scaled.process_stock_data(data)
+                if rows is None or rows.shape[0] <= self.backcandles + self.futurecandles:
+                    raise ValueError(f"Need more than {self.backcandles + self.futurecandles} rows to build windows for {ticker}")
+
+                self.scalers[ticker] = (scaled.feature_scaler, scaled.target_scaler)
+                processed.append(rows)
+            except Exception as exception:
+                print(f"Error preparing {ticker} for the global model: {exception}")
+                self.errors[ticker] = str(exception)
+
+        self.tickers = [ticker for ticker in self.tickers if ticker in self.scalers]
+        if not self.tickers:
+            raise ValueError("None of the tickers could be prepared for the global model")
+
+        self.windows = InterleavedWindows(processed, self.backcandles, self.futurecandles, len(self.features))
+
+    def train(self, seed=None):
+        self.model = build_global_network(self.architecture, self.backcandles, len(self.features), len(self.tickers), self.embedding_dim, self.profile)
+        train_dataset, validation_dataset = self.windows.datasets(self.profile["batch_size"], seed)
+
+        from training_callbacks import fit_callbacks
+        self.history = self.model.fit(train_dataset, validation_data=validation_dataset, epochs=self.profile["epochs"][self.architecture], verbose=0,
+                                      callbacks=fit_callbacks(f"global_{self.architecture}", self.profile))
+
+        epochs_run = len(self.history.history["loss"])
+        self.avg_metrics = {name: sum(self.history.history[key]) / epochs_run for key, name in HISTORY_METRICS.items()}
+        self.avg_metrics.update(profile_metrics(self.profile_name, self.profile, self.architecture, epochs_run))
+        self.avg_metrics.update(global_model=True, tickers=len(self.tickers))
+
+    # Predicts the scaled next hours of every ticker in one batched call, returning {ticker: scaled predictions}
+    def predict_latest(self):
+        X, ticker_ids = self.windows.latest()
+        predictions = self.model.predict((X, ticker_ids), batch_size=X.shape[0], verbose=0)
+        return dict(zip(self.tickers, predictions))
+
+    # Prepares the tickers unless the windows were shared from another global model, then trains and predicts
+    def run(self, seed=None):
+        if self.windows is None:
+            with timing.span(f"global_{self.architecture}.prepare"):
+                self.prepare()
+        training_log.logger.info(f"Global {self.architecture} training on {self.windows.windows()} windows of {len(self.tickers)} tickers")
+        with timing.span(f"global_{self.architecture}.fit"):
+            self.train(seed)
+        with timing.span(f"global_{self.architecture}.predict"):
+            return self.predict_latest()
+
+# Stores the trained global LSTM and Transformer as a new version of the registry's global model, with the scalers and
+# the id of every ticker, so predictions of the tickers without a model of their own are served by it
+def register_global(registry, lstm_model, transformer_model):
+    from model_registry import GLOBAL_KEY
+
+    metadata = {
+        "global_model": True,
+        "tickers": lstm_model.tickers,
+        "backcandles": lstm_model.backcandles,
+        "futurecandles": lstm_model.futurecandles,
+        "features": lstm_model.features,
+        "embedding_dim": lstm_model.embedding_dim,
+        "profile": lstm_model.profile_name,
+        "lstm_avg_metrics": lstm_model.avg_metrics,
+        "transformer_avg_metrics": transformer_model.avg_metrics,
+    }
+    feature_scalers = {ticker: scalers[0] for ticker, scalers in lstm_model.scalers.items()}
+    target_scalers = {ticker: scalers[1] for ticker, scalers in lstm_model.scalers.items()}
+    with timing.span("registry.save"):
+        return registry.save(GLOBAL_KEY, lstm_model.model, transformer_model.model, feature_scalers, target_scalers, metadata)
+
+# Trains a global LSTM and a global Transformer over the tickers and returns {ticker: predictions} for every ticker, in
+# the format PredictionModel stores, with {ticker: {"Error": ...}} for the tickers that could not be prepared. With a
+# registry the models are registered as the global model.
+def PredictGlobal(symbols, profile=None, features=None, seed=None, registry=None):
+    from predict_model import PredictionModel
+
+    with timing.collect() as timings:
+        lstm_model = GlobalModel(symbols, "lstm", profile, features=features)
+        lstm_predictions = lstm_model.run(seed)
+
+        # Both networks train on the same scaled windows, which are only downloaded and scaled once
+        transformer_model = GlobalModel(lstm_model.tickers, "transformer", profile, features=features)
+        transformer_model.scalers, transformer_model.windows = lstm_model.scalers, lstm_model.windows
+        transformer_predictions = transformer_model.run(seed)
+
+        version = register_global(registry, lstm_model, transformer_model) if registry is not None else None
+
+    stock_predictions = {ticker: {"Error": error} for ticker, error in lstm_model.errors.items()}
+    for ticker in lstm_model.tickers:
+        prediction_model = PredictionModel(ticker)
+        prediction_model.store_predictions(lstm_predictions[ticker], transformer_predictions[ticker], lstm_model.scalers[ticker][1],
+                                           lstm_model.avg_metrics, transformer_model.avg_metrics)
+        stock_predictions[ticker] = prediction_model.stock_predictions[ticker]
+        stock_predictions[ticker]["timings"] = timings.to_dict()
+        if version is not None:
+            stock_predictions[ticker].update(model_version=version, global_model=True)
+    return stock_predictions
+
+# Prints one JSON line per ticker and registers the models as the global model, for example:
+# python global_model.py AAPL MSFT NVDA --profile fast. With --no-register the models are only compared.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train one LSTM and one Transformer shared by every ticker")
+    parser.add_argument('symbols', nargs='+')
+    parser.add_argument('--profile', default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--no-register', action='store_true')
+    arguments = parser.parse_args()
+
+    from model_registry import ModelRegistry
+    registry = None if arguments.no_register else ModelRegistry()
+
+    for ticker, predictions in PredictGlobal(arguments.symbols, arguments.profile, seed=arguments.seed, registry=registry).items():
+        print(json.dumps({ticker: predictions}), flush=True)
@@ -0,0 +1,145 @@
+import os
+import json
+import threading
+import numpy as np
+import pandas as pd
+
+# Directory for the columnar history, can be moved with the PROFITPULSE_HISTORY_DIR environment variable when hosting
+DEFAULT_HISTORY_DIR = os.environ.get('PROFITPULSE_HISTORY_DIR', os.path.abspath(os.path.join(os.path.dirname(__file__), 'history')))
+
+# Fields stored for every ticker, each in its own float32 column file
+FIELDS = ('Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume')
+
+# Files within each ticker directory
+TIMESTAMPS_FILE = 'timestamps.i64'
+META_FILE = 'meta.json'
+
+# Column file of a field, spaces are replaced so "Adj Close" becomes Adj_Close.f32
+def column_file(field):
+    return field.replace(' ', '_') + '.f32'
+
+# Append only columnar store with one raw float32 file per field per ticker and an int64 file of UTC nanosecond
+# timestamps. Readers memory map the files so slicing a 5 year minute history only pages in the rows that are used.
+# The row count in meta.json is only moved once every column has been written, so readers never see a partial row.
+class HistoryStore:
+    def __init__(self, directory=DEFAULT_HISTORY_DIR, fields=FIELDS):
+        self.directory = directory
+        self.fields = fields
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def ticker_dir(self, ticker):
+        return os.path.join(self.directory, ticker.upper())
+
+    def ticker_lock(self, ticker):
+        with self.locks_lock:
+            return self.locks.setdefault(ticker.upper(), threading.Lock())
+
+    # Row count, fields and timezone of the ticker, or None if it has never been stored
+    def meta(self, ticker):
+        try:
+            with open(os.path.join(self.ticker_dir(ticker), META_FILE)) as meta_file:
+                return json.load(meta_file)
+        except FileNotFoundError:
+            return None
+
+    def write_meta(self, ticker, meta):
+        meta_path = os.path.join(self.ticker_dir(ticker), META_FILE)
+        with open(meta_path + '.tmp', 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def rows(self, ticker):
+        meta = self.meta(ticker)
+        return meta["rows"] if meta else 0
+
+    # Appends the bars newer than the last stored one. Rows missing any stored field are dropped, the same rows
+    # process_stock_data drops. Returns the number of rows appended.
+    def append(self, ticker, data):
+        ticker = ticker.upper()
+        with self.ticker_lock(ticker):
+            meta = self.meta(ticker)
+            fields = meta["fields"] if meta else [field for field in self.fields if field in data.columns]
+            data = data[fields].dropna()
+
+            index = data.index
+            timezone = str(index.tz) if index.tz is not None else ""
+            if meta is not None and meta["timezone"] != timezone:
+                raise ValueError(f"Bars for {ticker} are in {timezone or 'naive time'}, the store holds {meta['timezone'] or 'naive time'}")
+            if index.tz is not None:
+                index = index.tz_convert('UTC').tz_localize(None)
+            timestamps = index.values.astype('datetime64[ns]').astype(np.int64)
+
+            rows = meta["rows"] if meta else 0
+            if rows:
+                last_timestamp = self.timestamps(ticker)[rows - 1]
+                newer = timestamps > last_timestamp
+                data, timestamps = data[newer], timestamps[newer]
+            if timestamps.shape[0] == 0:
+                return 0
+
+            order = np.argsort(timestamps, kind='stable')
+            ticker_dir = self.ticker_dir(ticker)
+            os.makedirs(ticker_dir, exist_ok=True)
+
+            # Anything past the committed row count is left over from an interrupted append and is overwritten
+            self.write_column(os.path.join(ticker_dir, TIMESTAMPS_FILE), timestamps[order], rows, np.int64)
+            for field in fields:
+                self.write_column(os.path.join(ticker_dir, column_file(field)), data[field].to_numpy(dtype=np.float32)[order], rows, np.float32)
+
+            self.write_meta(ticker, {"rows": rows + timestamps.shape[0], "fields": fields, "timezone": timezone})
+            return int(timestamps.shape[0])
+
+    def write_column(self, path, values, rows, dtype):
+        with open(path, 'ab') as column:
+            column.truncate(rows * np.dtype(dtype).itemsize)
+        with open(path, 'r+b') as column:
+            column.seek(rows * np.dtype(dtype).itemsize)
+            column.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+
+    def mmap(self, ticker, filename, dtype):
+        rows = self.rows(ticker)
+        if rows == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(os.path.join(self.ticker_dir(ticker), filename), dtype=dtype, mode='r', shape=(rows,))
+
+    # Read only memory maps of the UTC nanosecond timestamps and of a field, covering the committed rows
+    def timestamps(self, ticker):
+        return self.mmap(ticker, TIMESTAMPS_FILE, np.int64)
+
+    def column(self, ticker, field):
+        return self.mmap(ticker, column_file(field), np.float32)
+
+    # Index of the first row at or after the timestamp, found by binary search over the memory mapped timestamps
+    def row_at(self, ticker, timestamp):
+        timestamp = pd.Timestamp(timestamp)
+        if timestamp.tz is not None:
+            timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+        return int(np.searchsorted(self.timestamps(ticker), timestamp.value, side='left'))
+
+    # Timestamps of the rows as a DatetimeIndex in the timezone the bars were stored with
+    def index(self, ticker, start=0, stop=None):
+        index = pd.to_datetime(np.asarray(self.timestamps(ticker)[start:stop]), utc=True)
+        timezone = (self.meta(ticker) or {}).get("timezone", "")
+        return index.tz_convert(timezone) if timezone else index.tz_localize(None)
+
+    # Copies a slice of the rows into a DataFrame, for callers that still need pandas
+    def frame(self, ticker, start=0, stop=None, fields=None):
+        fields = fields or (self.meta(ticker) or {}).get("fields", [])
+        return pd.DataFrame({field: np.asarray(self.column(ticker, field)[start:stop]) for field in fields}, index=self.index(ticker, start, stop))
+
+    def tickers(self):
+        return sorted(name for name in os.listdir(self.directory) if os.path.exists(os.path.join(self.directory, name, META_FILE)))
+
+# Shared store used by the history preprocessing
+history_store = HistoryStore()
+
+# Appends the bars the bar cache holds for each ticker to the shared store, for example: python history_store.py AAPL MSFT
+if __name__ == '__main__':
+    import sys
+    import stock_api
+
+    for ticker in sys.argv[1:]:
+        appended = history_store.append(ticker, stock_api.bar_cache.get(ticker))
+        print(f"{ticker.upper()}: appended {appended} rows, {history_store.rows(ticker)} stored")
@@ -0,0 +1,140 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import numpy as np
+import timing
+
+# Most windows run in one forward pass, how long the dispatcher waits after the first queued window for more to arrive,
+# and how many windows may wait before requests are turned away. Can be tuned with the PROFITPULSE_INFERENCE_MAX_BATCH,
+# PROFITPULSE_INFERENCE_MAX_WAIT_MS and PROFITPULSE_INFERENCE_MAX_QUEUE environment variables. A wait of 0 only batches
+# the windows that are already queued when the dispatcher picks up the first one.
+DEFAULT_MAX_BATCH = int(os.environ.get('PROFITPULSE_INFERENCE_MAX_BATCH', 32))
+DEFAULT_MAX_WAIT = float(os.environ.get('PROFITPULSE_INFERENCE_MAX_WAIT_MS', 3)) / 1000
+DEFAULT_MAX_QUEUE = int(os.environ.get('PROFITPULSE_INFERENCE_MAX_QUEUE', 256))
+
+# Seconds a request waits for its batch before giving up
+RESULT_TIMEOUT = 30
+
+# Histogram buckets of the batch sizes and of the time windows spend queued, the waits are a few milliseconds
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+QUEUE_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.002, 0.003, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+# Raised when max_queue windows are already waiting, so the caller can answer with back-pressure
+class InferenceQueueFull(Exception):
+    pass
+
+# A single window waiting for its forward pass, the window alone or a tuple of the model's inputs
+class InferenceRequest:
+    def __init__(self, model, inputs, name):
+        self.model = model
+        self.inputs = inputs
+        self.name = name
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+# Stacks the inputs of the requests into one batch, input by input for models with several
+def batch_inputs(requests):
+    if isinstance(requests[0].inputs, tuple):
+        return tuple(np.concatenate(parts) for parts in zip(*(request.inputs for request in requests)))
+    return np.concatenate([request.inputs for request in requests])
+
+# Dispatcher in front of the global model's forward passes. Concurrent requests queue their latest windows, a single
+# dispatcher thread collects them until max_batch windows are waiting or max_wait has passed since the first one, groups
+# them by model and runs each group as one batched forward pass, then hands every request its own row of the output.
+# Only a model shared by many tickers gains from this: the prediction cache already lets concurrent requests of one
+# ticker share a single computation, so the windows of a ticker's own models would always run alone.
+class InferenceDispatcher:
+    def __init__(self, max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT, max_queue=DEFAULT_MAX_QUEUE):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+        self.stats = {"requests": 0, "batches": 0, "forward_passes": 0, "rejected": 0, "errors": 0, "largest_batch": 0}
+
+    # The dispatcher thread is started on the first request
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.dispatch_loop, name="inference-dispatcher", daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    # Queues a single window shaped (1, backcandles, features) for the model and returns a Future of its output row. A
+    # model with several inputs, like the global model's window and ticker id, is given a tuple of them with one row
+    # each. Raises InferenceQueueFull when max_queue windows are already waiting.
+    def submit(self, model, inputs, name="model"):
+        self.start()
+        inputs = tuple(np.asarray(part) for part in inputs) if isinstance(inputs, tuple) else np.asarray(inputs, dtype=np.float32)
+        request = InferenceRequest(model, inputs, name)
+        try:
+            self.queue.put_nowait(request)
+        except queue.Full:
+            with self.lock:
+                self.stats["rejected"] += 1
+            raise InferenceQueueFull(f"Inference queue is full with {self.max_queue} waiting windows, try again shortly")
+
+        with self.lock:
+            self.stats["requests"] += 1
+        timing.metrics.set_gauge_max("profitpulse_inference_queue_depth", self.queue.qsize())
+        return request.future
+
+    # Collects the next batch, the first window blocks and the rest are taken until the batch is full or the wait is over
+    def collect(self):
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        deadline = batch[0].enqueued + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - time.perf_counter()
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def dispatch_loop(self):
+        while not self.stopped.is_set():
+            batch = self.collect()
+            if batch:
+                self.run_batch(batch)
+
+    # Groups the batch by model, runs one forward pass per model and scatters the rows back to the requests
+    def run_batch(self, batch):
+        dispatched = time.perf_counter()
+        groups = {}
+        for request in batch:
+            groups.setdefault(id(request.model), []).append(request)
+            timing.metrics.observe("profitpulse_inference_queue_seconds", "model", request.name, dispatched - request.enqueued, QUEUE_WAIT_BUCKETS)
+
+        for requests in groups.values():
+            try:
+                outputs = requests[0].model(batch_inputs(requests), training=False).numpy()
+            except Exception as exception:
+                print(f"Error during batched inference of {len(requests)} windows: {exception}")
+                with self.lock:
+                    self.stats["errors"] += 1
+                for request in requests:
+                    request.future.set_exception(exception)
+                continue
+
+            timing.metrics.observe("profitpulse_inference_batch_size", "model", requests[0].name, len(requests), BATCH_SIZE_BUCKETS)
+            for row, request in enumerate(requests):
+                request.future.set_result(outputs[row])
+
+        with self.lock:
+            self.stats["batches"] += 1
+            self.stats["forward_passes"] += len(groups)
+            self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+
+    def status(self):
+        with self.lock:
+            return dict(self.stats, queued=self.queue.qsize(), max_batch=self.max_batch, max_wait_ms=self.max_wait * 1000, max_queue=self.max_queue)
@@ -0,0 +1,215 @@
+import os
+import uuid
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+import timing
+from training_log import TrainingLog, capture
+
+# Job states reported by the status endpoint
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Raised when the queue already holds max_pending jobs so the caller can answer with back-pressure
+class QueueFull(Exception):
+    pass
+
+# Runs a single job within a worker process. Train jobs always retrain and register new models, fine_tune jobs warm start
+# the registered models on the newest bars, predict jobs serve from the registry and fail when the ticker has never been
+# trained, backtest jobs run a walk forward backtest and store its results. The training progress is appended to events.
+def run_job(kind, ticker, profile, registry_root, job_id, progress, events):
+    import predict_model
+    from model_registry import ModelRegistry, not_trained_error
+
+    def report_progress(stage, fraction):
+        progress[job_id] = {"stage": stage, "fraction": fraction}
+
+    if kind == 'backtest':
+        import backtest
+
+        report_progress("backtesting", 0.0)
+        with capture(TrainingLog(events)):
+            summary = backtest.backtest_ticker(ticker, profile=profile or backtest.DEFAULT_BACKTEST_PROFILE)[ticker.upper()]
+        if "Error" in summary:
+            raise RuntimeError(summary["Error"])
+
+        report_progress("done", 1.0)
+        return {ticker: summary}
+
+    registry = ModelRegistry(registry_root)
+    prediction_model = predict_model.PredictionModel(ticker, progress=report_progress, profile=profile)
+
+    with capture(TrainingLog(events)):
+        if kind == 'train':
+            prediction_model.train_and_register(registry)
+        elif kind == 'fine_tune':
+            prediction_model.fine_tune_and_register(registry)
+        elif not prediction_model.predict_from_registry(registry):
+            raise RuntimeError(not_trained_error(ticker))
+
+    predictions = prediction_model.stock_predictions[ticker]
+    if "Error" in predictions:
+        raise RuntimeError(predictions["Error"])
+
+    report_progress("done", 1.0)
+    return prediction_model.stock_predictions
+
+# A submitted job and everything the status and result endpoints report about it
+class Job:
+    def __init__(self, kind, ticker, profile=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.ticker = ticker
+        self.profile = profile
+        self.key = (kind, ticker, profile)
+        self.status = QUEUED
+        self.submitted_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.future = None
+
+    def to_dict(self, progress=None):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "symbol": self.ticker,
+            "profile": self.profile,
+            "status": self.status,
+            "progress": progress or {},
+            "submitted_at": self.submitted_at.strftime('%Y-%m-%d %H:%M:%S'),
+            "started_at": self.started_at.strftime('%Y-%m-%d %H:%M:%S') if self.started_at else None,
+            "finished_at": self.finished_at.strftime('%Y-%m-%d %H:%M:%S') if self.finished_at else None,
+            "error": self.error,
+        }
+
+# Bounded pool of training workers. Training is CPU bound so the default backend runs jobs in separate processes,
+# the thread backend runs them in process which is useful for local runs and tests. Identical jobs that are still
+# waiting or running are deduplicated and the number of unfinished jobs is capped by max_pending.
+class JobQueue:
+    def __init__(self, registry_root, max_workers=None, max_pending=16, max_finished=256, backend='process'):
+        self.registry_root = registry_root
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self.backend = backend
+        self.jobs = OrderedDict()
+        self.active = {}
+        # Re-entrant because a job that finishes before submit returns runs its done callback on the submitting thread
+        self.lock = threading.RLock()
+        self.executor = None
+        self.manager = None
+        self.progress = None
+        self.events = {}
+
+    # The pool and the shared progress dictionary are only started on the first submit so importing the app stays cheap
+    def start(self):
+        if self.executor is not None:
+            return
+
+        if self.backend == 'process':
+            context = multiprocessing.get_context('spawn')
+            self.manager = context.Manager()
+            self.progress = self.manager.dict()
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        else:
+            self.progress = {}
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='training-job')
+
+    # Queues a job and returns it with whether it was newly created, an identical unfinished job is returned instead
+    # of queueing a duplicate
+    def submit(self, kind, ticker, profile=None):
+        ticker = ticker.upper()
+        with self.lock:
+            self.start()
+
+            existing = self.active.get((kind, ticker, profile))
+            if existing is not None:
+                return existing, False
+
+            if len(self.active) >= self.max_pending:
+                raise QueueFull(f"Job queue is full with {len(self.active)} unfinished jobs")
+
+            job = Job(kind, ticker, profile)
+            self.jobs[job.id] = job
+            self.active[job.key] = job
+            self.progress[job.id] = {"stage": QUEUED, "fraction": 0.0}
+            self.events[job.id] = self.manager.list() if self.manager is not None else []
+
+            job.future = self.executor.submit(run_job, kind, ticker, profile, self.registry_root, job.id, self.progress, self.events[job.id])
+            job.future.add_done_callback(lambda future, job=job: self.finish(job, future))
+
+        return job, True
+
+    def finish(self, job, future):
+        with self.lock:
+            job.finished_at = datetime.now()
+            try:
+                job.result = future.result()
+                job.status = DONE
+                timing.metrics.observe_timings(job.result[job.ticker].get("timings"))
+            except Exception as exception:
+                print(f"Error in {job.kind} job for {job.ticker}: {exception}")
+                job.error = str(exception)
+                job.status = FAILED
+
+            self.active.pop(job.key, None)
+            self.evict_finished()
+
+    # Drops the oldest finished jobs once more than max_finished are kept
+    def evict_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in (DONE, FAILED)]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            self.jobs.pop(job_id, None)
+            self.progress.pop(job_id, None)
+            self.events.pop(job_id, None)
+
+    # Returns the job with its status refreshed from the shared progress, or None if it is unknown
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+
+            if job.status == QUEUED and job.future is not None and job.future.running():
+                job.status = RUNNING
+                job.started_at = datetime.now()
+
+            progress = self.progress.get(job_id) if self.progress is not None else None
+            if job.status == QUEUED and progress and progress.get("stage") != QUEUED:
+                job.status = RUNNING
+                job.started_at = datetime.now()
+
+            return job
+
+    def status(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        return job.to_dict(self.progress.get(job_id))
+
+    # Returns the progress events of the job from the start index on, or None if the job is unknown
+    def job_events(self, job_id, start=0):
+        events = self.events.get(job_id)
+        if events is None:
+            return None
+        return list(events[start:])
+
+    # Text of the job's training log, returned as the console output of its result
+    def console_output(self, job_id):
+        return TrainingLog(self.job_events(job_id) or []).text()
+
+    def queue_depth(self):
+        with self.lock:
+            return len(self.active)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.manager is not None:
+            self.manager.shutdown()
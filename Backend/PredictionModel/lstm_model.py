@@ -1,10 +1,31 @@
 import os
 os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
 from keras import layers, models, metrics, Input, optimizers, losses, regularizers
+import timing
+from training_callbacks import fit_callbacks
+from training_profiles import get_profile, scaled_learning_rate, make_datasets, profile_metrics
+
+# Layers of the LSTM network after its input, shared with the global model which feeds them the windows of every ticker
+def lstm_layers():
+    return [
+        # Add layers that have 160 and 128 neutrons respectively, and have a dropout rate of 10%, and
+        # batch normalize after the relu activation.
+        layers.MaxPooling1D(pool_size=2),
+        layers.LSTM(units=128, return_sequences=True),
+        layers.LSTM(units=64, return_sequences=True),
+        layers.Dropout(0.2),
+        layers.LSTM(units=32, return_sequences=False),
+
+        # Using a 64 layer that uses relu for activation, then normalizes the data to allow the model to create a
+        # dense layer that outputs 7 values which are the predictions
+        layers.Dense(units=32),
+        layers.BatchNormalization(),
+        layers.Dense(units=7),
+    ]
 
 # LSTM model class that will handle the preparing, building, training, and running the model. 
 class LSTMmodel:
-    def __init__(self, X_train, X_test, y_train, y_test, backcandles):
+    def __init__(self, X_train, X_test, y_train, y_test, backcandles, profile=None):
         self.X_train = X_train
         self.X_test = X_test
         self.y_train = y_train
@@ -33,31 +54,17 @@ class LSTMmodel:
         self.avg_train_r2 = None
         self.avg_val_r2 = None
         self.avg_metrics = {}
+        self.profile_name, self.profile = get_profile(profile)
 
     # Builds the model based off of all the features and predicts 7 hours ahead. 
     def build_model(self):
         try:
-            features = ['Open', 'High', 'Low']
-
-
             self.model = models.Sequential()
+            self.model.add(Input(shape=(self.backcandles, self.X_train.shape[-1])))
+            for layer in lstm_layers():
+                self.model.add(layer)
 
-            # Add layers that have 160 and 128 neutrons respectively, and have a dropout rate of 10%, and
-            # batch normalize after the relu activation. 
-            self.model.add(Input(shape=(self.backcandles, len(features))))
-            self.model.add(layers.MaxPooling1D(pool_size=2))
-            self.model.add(layers.LSTM(units=128, return_sequences=True))
-            self.model.add(layers.LSTM(units=64, return_sequences=True))
-            self.model.add(layers.Dropout(0.2))
-            self.model.add(layers.LSTM(units=32, return_sequences=False))
-
-            # Using a 64 layer that uses relu for activation, then normalizes the data to allow the model to create a
-            # dense layer that outputs 7 values which are the predictions
-            self.model.add(layers.Dense(units=32))
-            self.model.add(layers.BatchNormalization())
-            self.model.add(layers.Dense(units=7))
-
-            optimizer = optimizers.Adam(learning_rate = 0.0001)
+            optimizer = optimizers.Adam(learning_rate = scaled_learning_rate(self.profile))
 
             # After training, the model compiles using mean squared error as the loss value and uses Adam optimizer 
             self.model.compile( optimizer= optimizer, loss=losses.MeanSquaredError() , metrics=[metrics.MeanAbsoluteError(), metrics.RootMeanSquaredError(), metrics.R2Score()])
@@ -80,30 +87,11 @@ class LSTMmodel:
     def train_model(self):
         try:
 
-            self.history = self.model.fit(self.X_train, self.y_train, batch_size=3, epochs=25, validation_split=0.2, verbose=2)
-            self.train_loss = self.history.history['loss']
-            self.val_loss = self.history.history['val_loss']
-            self.train_mae = self.history.history['mean_absolute_error']
-            self.val_mae = self.history.history['val_mean_absolute_error']
-            self.train_rmse = self.history.history['root_mean_squared_error']
-            self.val_rmse = self.history.history['val_root_mean_squared_error']
-            self.train_r2 = self.history.history['r2_score']
-            self.val_r2 = self.history.history['val_r2_score']
-
-            # Calculate averages for each metric
-            self.avg_train_loss = sum(self.train_loss) / len(self.train_loss)
-            self.avg_val_loss = sum(self.val_loss) / len(self.val_loss)
-            self.avg_train_mae = sum(self.train_mae) / len(self.train_mae)
-            self.avg_val_mae = sum(self.val_mae) / len(self.val_mae)
-            self.avg_train_rmse = sum(self.train_rmse) / len(self.train_rmse)
-            self.avg_val_rmse = sum(self.val_rmse) / len(self.val_rmse)
-            self.avg_train_r2 = sum(self.train_r2) / len(self.train_r2)
-            self.avg_val_r2 = sum(self.val_r2) / len(self.val_r2)
-
-            self.avg_metrics = {"avg_train_loss": self.avg_train_loss, "avg_val_loss": self.avg_val_loss,
-                "avg_train_mae": self.avg_train_mae, "avg_val_mae": self.avg_val_mae,
-                "avg_train_rmse": self.avg_train_rmse, "avg_val_rmse": self.avg_val_rmse,
-                "avg_train_r2": self.avg_train_r2, "avg_val_r2": self.avg_val_r2}
+            # The windows are fed through a prefetched tf.data pipeline with the profile's batch size, early stopping and
+            # learning rate reduction on val_loss
+            train_dataset, validation_dataset = make_datasets(self.X_train, self.y_train, self.profile["batch_size"])
+            self.history = self.model.fit(train_dataset, validation_data=validation_dataset, epochs=self.profile["epochs"]["lstm"], verbose=0, callbacks=fit_callbacks("lstm", self.profile))
+            self.record_metrics()
         
         # Exceptions
         except ValueError as valueError:
@@ -117,9 +105,59 @@ class LSTMmodel:
         except Exception as exception:
             print(f"Unexpected error in training lstm model: {exception}")
 
+    # Stores every metric of the fit history and their averages over the epochs that ran
+    def record_metrics(self):
+        self.train_loss = self.history.history['loss']
+        self.val_loss = self.history.history['val_loss']
+        self.train_mae = self.history.history['mean_absolute_error']
+        self.val_mae = self.history.history['val_mean_absolute_error']
+        self.train_rmse = self.history.history['root_mean_squared_error']
+        self.val_rmse = self.history.history['val_root_mean_squared_error']
+        self.train_r2 = self.history.history['r2_score']
+        self.val_r2 = self.history.history['val_r2_score']
+
+        # Calculate averages for each metric
+        self.avg_train_loss = sum(self.train_loss) / len(self.train_loss)
+        self.avg_val_loss = sum(self.val_loss) / len(self.val_loss)
+        self.avg_train_mae = sum(self.train_mae) / len(self.train_mae)
+        self.avg_val_mae = sum(self.val_mae) / len(self.val_mae)
+        self.avg_train_rmse = sum(self.train_rmse) / len(self.train_rmse)
+        self.avg_val_rmse = sum(self.val_rmse) / len(self.val_rmse)
+        self.avg_train_r2 = sum(self.train_r2) / len(self.train_r2)
+        self.avg_val_r2 = sum(self.val_r2) / len(self.val_r2)
+
+        self.avg_metrics = {"avg_train_loss": self.avg_train_loss, "avg_val_loss": self.avg_val_loss,
+            "avg_train_mae": self.avg_train_mae, "avg_val_mae": self.avg_val_mae,
+            "avg_train_rmse": self.avg_train_rmse, "avg_val_rmse": self.avg_val_rmse,
+            "avg_train_r2": self.avg_train_r2, "avg_val_r2": self.avg_val_r2}
+
+        # The averages above are over the epochs that actually ran, which early stopping can cut short
+        self.avg_metrics.update(profile_metrics(self.profile_name, self.profile, "lstm", len(self.train_loss)))
+
+    # Fine tunes the already trained model on X_train, which holds the windows with new bars plus replayed older windows,
+    # validating on X_val. It starts from the trained weights with a reduced learning rate and runs a few epochs.
+    def fine_tune_model(self, X_val, y_val, epochs, learning_rate):
+        try:
+            self.model.compile(optimizer = optimizers.Adam(learning_rate = learning_rate), loss = losses.MeanSquaredError(), metrics = [metrics.MeanAbsoluteError(), metrics.RootMeanSquaredError(), metrics.R2Score()])
+            self.history = self.model.fit(self.X_train, self.y_train, validation_data = (X_val, y_val), batch_size = self.profile["batch_size"], epochs = epochs, verbose = 0, callbacks = fit_callbacks("lstm", self.profile))
+            self.record_metrics()
+            self.avg_metrics["max_epochs"] = epochs
+            self.avg_metrics["learning_rate"] = learning_rate
+            self.avg_metrics["fine_tuned"] = True
+
+        # Exceptions
+        except ValueError as valueError:
+            print(f"Value error in fine tuning lstm model: {valueError}")
+        except RuntimeError as runtimeError:
+            print(f"Runtime error in fine tuning lstm model: {runtimeError}")
+        except Exception as exception:
+            print(f"Unexpected error in fine tuning lstm model: {exception}")
+
     def run_model(self):
         try:
-            self.build_model()
-            self.train_model()
+            with timing.span("lstm.build"):
+                self.build_model()
+            with timing.span("lstm.fit"):
+                self.train_model()
         except Exception as exception:
             print(f"Exception occurred in run lstm model: {exception}")
\ No newline at end of file
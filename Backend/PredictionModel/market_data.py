@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import threading
+import urllib.parse
+import urllib.request
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+# Alpha Vantage endpoint and the key shared by every user. There is no default key, without
+# PROFITPULSE_ALPHA_VANTAGE_KEY the market data proxy is disabled.
+ALPHA_VANTAGE_URL = os.environ.get('PROFITPULSE_ALPHA_VANTAGE_URL', 'https://www.alphavantage.co/query')
+ALPHA_VANTAGE_KEY = os.environ.get('PROFITPULSE_ALPHA_VANTAGE_KEY', '')
+MARKET_DATA_DISABLED = "Market data is disabled, set PROFITPULSE_ALPHA_VANTAGE_KEY to enable it"
+
+# Alpha Vantage query and the key holding the series for each kind of series the charts show
+SERIES = {
+    "intraday": ({"function": "TIME_SERIES_INTRADAY", "interval": "30min"}, "Time Series (30min)"),
+    "daily": ({"function": "TIME_SERIES_DAILY"}, "Time Series (Daily)"),
+}
+
+# Seconds a fetched series is served before it is downloaded again
+SERIES_TTL = {"intraday": 15 * 60, "daily": 60 * 60}
+
+# The half hour slots the prediction charts line up with
+INTRADAY_SLOTS = ["10:30:00", "11:30:00", "12:30:00", "13:30:00", "14:30:00", "15:30:00", "16:30:00"]
+
+# Default upstream source, returns {timestamp: {"4. close": ...}} for the symbol's series
+def alpha_vantage_source(series, symbol):
+    if not ALPHA_VANTAGE_KEY:
+        raise ValueError(MARKET_DATA_DISABLED)
+
+    query, series_key = SERIES[series]
+    url = f"{ALPHA_VANTAGE_URL}?{urllib.parse.urlencode(dict(query, symbol=symbol, apikey=ALPHA_VANTAGE_KEY))}"
+    with urllib.request.urlopen(url, timeout=30) as response:
+        payload = json.load(response)
+
+    # Rate limited and unknown symbols still answer 200, with a note instead of the series
+    if series_key not in payload:
+        raise ValueError(f"Alpha Vantage response invalid for {symbol}: {payload.get('Note') or payload.get('Information') or payload.get('Error Message')}")
+    return payload[series_key]
+
+# Offline stand-in source that reads <SYMBOL>_<series>.json files holding a saved Alpha Vantage response, used for
+# testing the proxy without network access or spending the rate limit
+class JsonFileSource:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __call__(self, series, symbol):
+        with open(os.path.join(self.directory, f"{symbol.upper()}_{series}.json")) as series_file:
+            payload = json.load(series_file)
+        return payload.get(SERIES[series][1], payload)
+
+# Most recent weekday before today in New York, the day the charts compare predictions against, the same day
+# getLastMarketDay picks in the browser
+def last_market_day(current_time=None):
+    if current_time is None:
+        from zoneinfo import ZoneInfo
+        current_time = datetime.now(ZoneInfo("America/New_York"))
+
+    day = current_time.date() - timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day.isoformat()
+
+# Closes of the series at the given slots of a single day, oldest first
+def intraday_window(series_data, day, slots=INTRADAY_SLOTS):
+    bars = []
+    for timestamp in sorted(series_data):
+        date, slot = timestamp.split(" ")
+        if date == day and slot in slots:
+            bars.append({"time": timestamp, "close": float(series_data[timestamp]["4. close"])})
+    return bars
+
+# Closes of the last days of the daily series, newest first like the weekly chart expects
+def daily_window(series_data, days=7):
+    return [{"date": date, "close": float(series_data[date]["4. close"])} for date in sorted(series_data, reverse=True)[:days]]
+
+# Shared server side cache of the upstream series. Every user's chart is served from one download per symbol and
+# series, concurrent misses for the same series wait on a single upstream request, and the series that were read
+# recently are refreshed in the background before they expire so chart requests rarely wait on the upstream.
+class MarketDataCache:
+    def __init__(self, source=alpha_vantage_source, ttl=SERIES_TTL, hot_seconds=30 * 60, clock=time.monotonic):
+        self.source = source
+        self.ttl = ttl
+        self.hot_seconds = hot_seconds
+        self.clock = clock
+        self.entries = {}
+        self.last_read = {}
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.refresher = None
+        self.stopped = threading.Event()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "refreshes": 0, "upstream_errors": 0, "stale_served": 0}
+
+    # Returns the series and the time it was fetched, downloading it once for every concurrent caller when it is
+    # missing or expired. When the upstream fails an expired copy is served rather than nothing.
+    def get(self, series, symbol):
+        key = (series, symbol.upper())
+        with self.lock:
+            self.last_read[key] = self.clock()
+            entry = self.entries.get(key)
+            if entry is not None and self.clock() - entry[0] < self.ttl[series]:
+                self.stats["hits"] += 1
+                return entry[1], entry[2]
+
+        try:
+            return self.fetch(key, count_as="misses")
+        except Exception:
+            with self.lock:
+                if entry is None:
+                    # Symbols the upstream does not know are not kept hot, so they are not retried in the background
+                    self.last_read.pop(key, None)
+                    raise
+                self.stats["stale_served"] += 1
+                return entry[1], entry[2]
+
+    # Downloads the series, single flighted per key
+    def fetch(self, key, count_as):
+        with self.lock:
+            flight = self.inflight.get(key)
+            if flight is not None:
+                self.stats["coalesced"] += 1
+                leader = False
+            else:
+                flight = Future()
+                self.inflight[key] = flight
+                self.stats[count_as] += 1
+                leader = True
+
+        if not leader:
+            return flight.result()
+
+        try:
+            series_data = self.source(*key)
+        except Exception as exception:
+            print(f"Error fetching {key[0]} series for {key[1]}: {exception}")
+            with self.lock:
+                self.inflight.pop(key, None)
+                self.stats["upstream_errors"] += 1
+            flight.set_exception(exception)
+            raise
+
+        fetched_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self.lock:
+            self.inflight.pop(key, None)
+            self.entries[key] = (self.clock(), series_data, fetched_at)
+        flight.set_result((series_data, fetched_at))
+        return series_data, fetched_at
+
+    # Refreshes the series read within hot_seconds that expire within the next interval, and forgets the ones nobody
+    # has read since, returning how many were refreshed
+    def refresh_hot(self, interval):
+        now = self.clock()
+        with self.lock:
+            for key in [key for key, read_at in self.last_read.items() if now - read_at > self.hot_seconds]:
+                self.last_read.pop(key, None)
+                self.entries.pop(key, None)
+            due = [key for key in self.last_read if key not in self.entries or now - self.entries[key][0] >= self.ttl[key[0]] - interval]
+
+        refreshed = 0
+        for key in due:
+            try:
+                self.fetch(key, count_as="refreshes")
+                refreshed += 1
+            except Exception:
+                pass
+        return refreshed
+
+    # Starts the background refresh of hot series every interval seconds
+    def start(self, interval=60):
+        with self.lock:
+            if self.refresher is not None:
+                return
+
+            def refresh_loop():
+                while not self.stopped.wait(interval):
+                    self.refresh_hot(interval)
+
+            self.refresher = threading.Thread(target=refresh_loop, name="market-data-refresh", daemon=True)
+            self.refresher.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def cache_stats(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), hot=len(self.last_read), inflight=len(self.inflight))
@@ -0,0 +1,240 @@
+import os
+import json
+import pickle
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import numpy_inference
+
+# Registry directory, can be moved with the PROFITPULSE_MODEL_DIR environment variable when hosting
+DEFAULT_REGISTRY_DIR = os.environ.get('PROFITPULSE_MODEL_DIR', os.path.abspath(os.path.join(os.path.dirname(__file__), 'saved_models')))
+
+# Files stored within each version directory
+LSTM_FILE = 'lstm.keras'
+TRANSFORMER_FILE = 'transformer.keras'
+NUMPY_FILE = 'weights.npz'
+SCALERS_FILE = 'scalers.pkl'
+METADATA_FILE = 'metadata.json'
+LATEST_FILE = 'LATEST'
+
+# Registry key of the global model shared by every ticker it was trained on, which serves the tickers that have no model
+# of their own. Ticker symbols never start with an underscore, so it cannot collide with one.
+GLOBAL_KEY = '_GLOBAL'
+
+# Error of the predictions of a ticker that has no registered model. Serving never trains a model itself, the ticker
+# has to be trained first through the explicit training action.
+def not_trained_error(ticker):
+    return f"No trained model for {ticker.upper()}, train it first with POST /api/train?symbol={ticker.upper()}"
+
+# Trained models for a single ticker version that are loaded and ready for a forward pass. The global model keeps the
+# scalers of every ticker it was trained on in dicts keyed by ticker.
+class RegisteredModel:
+    def __init__(self, ticker, version, lstm_model, transformer_model, feature_scaler, target_scaler, metadata):
+        self.ticker = ticker
+        self.version = version
+        self.lstm_model = lstm_model
+        self.transformer_model = transformer_model
+        self.feature_scaler = feature_scaler
+        self.target_scaler = target_scaler
+        self.metadata = metadata
+
+# Versioned on disk registry that stores the keras weights, the fitted scalers, the average metrics and the training
+# watermark for every ticker. The most recently used models are kept in memory so predictions only need a forward pass.
+# The layout on disk is <root>/<TICKER>/v0001/... with a LATEST file pointing at the newest version.
+class ModelRegistry:
+    def __init__(self, root=DEFAULT_REGISTRY_DIR, max_loaded=8, keep_versions=3):
+        self.root = root
+        self.max_loaded = max_loaded
+        self.keep_versions = keep_versions
+        self.loaded = OrderedDict()
+        self.lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def ticker_dir(self, ticker):
+        return os.path.join(self.root, ticker.upper())
+
+    def version_dir(self, ticker, version):
+        return os.path.join(self.ticker_dir(ticker), f"v{version:04d}")
+
+    # Returns every stored version for the ticker in ascending order
+    def list_versions(self, ticker):
+        ticker_dir = self.ticker_dir(ticker)
+        if not os.path.isdir(ticker_dir):
+            return []
+
+        versions = []
+        for name in os.listdir(ticker_dir):
+            if name.startswith('v') and name[1:].isdigit():
+                versions.append(int(name[1:]))
+        return sorted(versions)
+
+    # Reads the LATEST pointer, returns None if the ticker has never been trained
+    def latest_version(self, ticker):
+        latest_path = os.path.join(self.ticker_dir(ticker), LATEST_FILE)
+        try:
+            with open(latest_path) as latest_file:
+                return int(latest_file.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def has_model(self, ticker):
+        return self.latest_version(ticker) is not None
+
+    # Key and version of the models that serve the ticker: its own newest version, or else the newest global model
+    # when that was trained on the ticker. Returns (None, None) when neither exists.
+    def serving_model(self, ticker):
+        version = self.latest_version(ticker)
+        if version is not None:
+            return ticker.upper(), version
+
+        metadata = self.load_metadata(GLOBAL_KEY)
+        if metadata is not None and ticker.upper() in metadata.get("tickers", []):
+            return GLOBAL_KEY, metadata["version"]
+        return None, None
+
+    # Writes a new version to a temporary directory first and renames it so readers never see a partial version,
+    # then moves the LATEST pointer and prunes the oldest versions
+    def save(self, ticker, lstm_model, transformer_model, feature_scaler, target_scaler, metadata):
+        ticker = ticker.upper()
+        ticker_dir = self.ticker_dir(ticker)
+        os.makedirs(ticker_dir, exist_ok=True)
+
+        with self.lock:
+            versions = self.list_versions(ticker)
+            version = versions[-1] + 1 if versions else 1
+            final_dir = self.version_dir(ticker, version)
+            temp_dir = final_dir + '.tmp'
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            os.makedirs(temp_dir)
+
+            try:
+                lstm_model.save(os.path.join(temp_dir, LSTM_FILE))
+                transformer_model.save(os.path.join(temp_dir, TRANSFORMER_FILE))
+
+                # Models the NumPy engine cannot run, like the global model with its ticker embedding, are only stored
+                # as Keras models and load falls back to Keras for them
+                try:
+                    numpy_inference.export_models(os.path.join(temp_dir, NUMPY_FILE), lstm_model, transformer_model)
+                except numpy_inference.UnsupportedLayer as unsupportedLayer:
+                    print(f"Storing {ticker} version {version} without NumPy weights: {unsupportedLayer}")
+
+                with open(os.path.join(temp_dir, SCALERS_FILE), 'wb') as scalers_file:
+                    pickle.dump({"feature_scaler": feature_scaler, "target_scaler": target_scaler}, scalers_file)
+
+                metadata = dict(metadata)
+                metadata["ticker"] = ticker
+                metadata["version"] = version
+                metadata.setdefault("trained_at", datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                with open(os.path.join(temp_dir, METADATA_FILE), 'w') as metadata_file:
+                    json.dump(metadata, metadata_file, indent=2)
+
+                os.replace(temp_dir, final_dir)
+            except Exception:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                raise
+
+            latest_temp = os.path.join(ticker_dir, LATEST_FILE + '.tmp')
+            with open(latest_temp, 'w') as latest_file:
+                latest_file.write(str(version))
+            os.replace(latest_temp, os.path.join(ticker_dir, LATEST_FILE))
+
+            self.prune(ticker)
+
+        return version
+
+    # Deletes all but the newest keep_versions versions of the ticker
+    def prune(self, ticker):
+        versions = self.list_versions(ticker)
+        for version in versions[:-self.keep_versions]:
+            shutil.rmtree(self.version_dir(ticker, version), ignore_errors=True)
+            self.loaded.pop((ticker.upper(), version), None)
+
+    def load_metadata(self, ticker, version=None):
+        if version is None:
+            version = self.latest_version(ticker)
+        if version is None:
+            return None
+
+        try:
+            with open(os.path.join(self.version_dir(ticker, version), METADATA_FILE)) as metadata_file:
+                return json.load(metadata_file)
+        except FileNotFoundError:
+            return None
+
+    # Loads a fresh copy of the newest models for the ticker that is not shared with the in memory LRU, so it can be
+    # trained further while the cached copy keeps serving predictions. Returns None if the ticker has no stored version.
+    def load_for_training(self, ticker):
+        ticker = ticker.upper()
+        version = self.latest_version(ticker)
+        if version is None:
+            return None
+
+        try:
+            from keras import models
+
+            version_dir = self.version_dir(ticker, version)
+            lstm_model = models.load_model(os.path.join(version_dir, LSTM_FILE), compile=False)
+            transformer_model = models.load_model(os.path.join(version_dir, TRANSFORMER_FILE), compile=False)
+
+            with open(os.path.join(version_dir, SCALERS_FILE), 'rb') as scalers_file:
+                scalers = pickle.load(scalers_file)
+
+        except Exception as exception:
+            print(f"Error loading model for training {ticker} version {version}: {exception}")
+            return None
+
+        return RegisteredModel(ticker, version, lstm_model, transformer_model, scalers["feature_scaler"], scalers["target_scaler"], self.load_metadata(ticker, version))
+
+    # Loads the models for the ticker, serving them from the in memory LRU when they are hot. With the numpy engine the
+    # exported weights are loaded without TensorFlow, versions saved before the export existed fall back to Keras.
+    # Returns None if the ticker has no stored version.
+    def load(self, ticker, version=None, engine=None):
+        ticker = ticker.upper()
+        engine = engine or numpy_inference.INFERENCE_ENGINE
+        if version is None:
+            version = self.latest_version(ticker)
+        if version is None:
+            return None
+
+        key = (ticker, version, engine)
+        with self.lock:
+            if key in self.loaded:
+                self.loaded.move_to_end(key)
+                return self.loaded[key]
+
+        try:
+            version_dir = self.version_dir(ticker, version)
+            numpy_path = os.path.join(version_dir, NUMPY_FILE)
+
+            if engine == 'numpy' and os.path.exists(numpy_path):
+                lstm_model, transformer_model = numpy_inference.load_models(numpy_path)
+            else:
+                # Keras is imported here so the registry can be used without loading TensorFlow until a model is needed
+                from keras import models
+
+                # Compiling is only needed for training, so the models are loaded for inference only
+                lstm_model = models.load_model(os.path.join(version_dir, LSTM_FILE), compile=False)
+                transformer_model = models.load_model(os.path.join(version_dir, TRANSFORMER_FILE), compile=False)
+
+            with open(os.path.join(version_dir, SCALERS_FILE), 'rb') as scalers_file:
+                scalers = pickle.load(scalers_file)
+
+            metadata = self.load_metadata(ticker, version)
+
+        except FileNotFoundError as fileNotFoundError:
+            print(f"Missing file loading model for {ticker} version {version}: {fileNotFoundError}")
+            return None
+        except Exception as exception:
+            print(f"Error loading model for {ticker} version {version}: {exception}")
+            return None
+
+        registered_model = RegisteredModel(ticker, version, lstm_model, transformer_model, scalers["feature_scaler"], scalers["target_scaler"], metadata)
+
+        with self.lock:
+            self.loaded[key] = registered_model
+            self.loaded.move_to_end(key)
+            while len(self.loaded) > self.max_loaded:
+                self.loaded.popitem(last=False)
+
+        return registered_model
@@ -0,0 +1,183 @@
+import os
+import numpy as np
+
+# Engine predict_from_registry serves with, "numpy" runs the exported weights without TensorFlow and "keras" loads the
+# saved Keras models. Can be changed with the PROFITPULSE_INFERENCE environment variable.
+INFERENCE_ENGINE = os.environ.get('PROFITPULSE_INFERENCE', 'numpy')
+
+# Layers that only change training, they pass the inputs straight through at inference
+PASSTHROUGH_LAYERS = ('InputLayer', 'Dropout')
+
+# Raised when a model holds a layer or setting the NumPy engine cannot reproduce exactly
+class UnsupportedLayer(ValueError):
+    pass
+
+# Written with tanh so large negative inputs do not overflow np.exp
+def sigmoid(x):
+    return 0.5 * (1.0 + np.tanh(0.5 * x))
+
+def softmax(x, axis=-1):
+    x = np.exp(x - x.max(axis=axis, keepdims=True))
+    return x / x.sum(axis=axis, keepdims=True)
+
+# Reads the kind, the weights and the settings of a single Keras layer. Only the activations the ProfitPulse models use
+# are supported, anything else raises UnsupportedLayer so the export never silently produces different predictions.
+def export_layer(layer):
+    kind = layer.__class__.__name__
+    config = layer.get_config()
+
+    if kind == 'Dense':
+        if config['activation'] != 'linear':
+            raise UnsupportedLayer(f"Dense activation {config['activation']} is not supported")
+        kernel, bias = layer.get_weights()
+        return kind, {"kernel": kernel, "bias": bias}
+
+    if kind == 'LSTM':
+        if config['activation'] != 'tanh' or config['recurrent_activation'] != 'sigmoid' or config['go_backwards']:
+            raise UnsupportedLayer("Only forward LSTM layers with tanh and sigmoid activations are supported")
+        kernel, recurrent_kernel, bias = layer.get_weights()
+        return kind, {"kernel": kernel, "recurrent_kernel": recurrent_kernel, "bias": bias, "return_sequences": np.array(config['return_sequences'])}
+
+    if kind == 'BatchNormalization':
+        if config['axis'] not in (-1, [-1]) or not config['center'] or not config['scale']:
+            raise UnsupportedLayer("Only BatchNormalization over the last axis with center and scale is supported")
+        gamma, beta, moving_mean, moving_variance = layer.get_weights()
+        return kind, {"gamma": gamma, "beta": beta, "moving_mean": moving_mean, "moving_variance": moving_variance, "epsilon": np.array(config['epsilon'], dtype=np.float32)}
+
+    if kind == 'MaxPooling1D':
+        if config['padding'] != 'valid' or config['data_format'] != 'channels_last':
+            raise UnsupportedLayer("Only valid channels last MaxPooling1D is supported")
+        return kind, {"pool_size": np.array(config['pool_size'][0]), "strides": np.array(config['strides'][0])}
+
+    if kind == 'GlobalAveragePooling1D':
+        if config['data_format'] != 'channels_last' or config['keepdims']:
+            raise UnsupportedLayer("Only channels last GlobalAveragePooling1D is supported")
+        return kind, {"axis": np.array(1)}
+
+    if kind == 'MultiHeadAttention':
+        weights = {}
+        for name, dense in (("query", layer.query_dense), ("key", layer.key_dense), ("value", layer.value_dense), ("output", layer.output_dense)):
+            weights[f"{name}_kernel"] = dense.kernel.numpy()
+            weights[f"{name}_bias"] = dense.bias.numpy()
+        return kind, weights
+
+    if kind in PASSTHROUGH_LAYERS:
+        return kind, None
+
+    raise UnsupportedLayer(f"Layer {kind} is not supported")
+
+# Forward pass of a single layer over a batch
+def run_layer(kind, weights, x):
+    if kind == 'Dense':
+        return x @ weights["kernel"] + weights["bias"]
+
+    if kind == 'LSTM':
+        kernel, recurrent_kernel = weights["kernel"], weights["recurrent_kernel"]
+        units = recurrent_kernel.shape[0]
+        h = np.zeros((x.shape[0], units), dtype=x.dtype)
+        c = np.zeros((x.shape[0], units), dtype=x.dtype)
+
+        # The input projection of every timestep is a single matrix product, only the recurrence runs per step.
+        # Keras orders the gates as input, forget, cell and output.
+        projected = x @ kernel + weights["bias"]
+        outputs = []
+        for step in range(x.shape[1]):
+            z = projected[:, step] + h @ recurrent_kernel
+            i = sigmoid(z[:, :units])
+            f = sigmoid(z[:, units:2 * units])
+            c = f * c + i * np.tanh(z[:, 2 * units:3 * units])
+            h = sigmoid(z[:, 3 * units:]) * np.tanh(c)
+            outputs.append(h)
+        return np.stack(outputs, axis=1) if weights["return_sequences"] else h
+
+    if kind == 'BatchNormalization':
+        scale = weights["gamma"] / np.sqrt(weights["moving_variance"] + weights["epsilon"])
+        return (x - weights["moving_mean"]) * scale + weights["beta"]
+
+    if kind == 'MaxPooling1D':
+        pool_size, strides = int(weights["pool_size"]), int(weights["strides"])
+        steps = (x.shape[1] - pool_size) // strides + 1
+        return np.stack([x[:, step * strides:step * strides + pool_size].max(axis=1) for step in range(steps)], axis=1)
+
+    if kind == 'GlobalAveragePooling1D':
+        return x.mean(axis=int(weights["axis"]))
+
+    if kind == 'MultiHeadAttention':
+        # Self attention, the kernels are (features, heads, key_dim) and the output kernel (heads, key_dim, features)
+        query = np.einsum('btd,dhk->bthk', x, weights["query_kernel"]) + weights["query_bias"]
+        key = np.einsum('btd,dhk->bthk', x, weights["key_kernel"]) + weights["key_bias"]
+        value = np.einsum('btd,dhk->bthk', x, weights["value_kernel"]) + weights["value_bias"]
+
+        scores = np.einsum('bqhk,bshk->bhqs', query / np.sqrt(query.shape[-1]).astype(x.dtype), key)
+        attention = np.einsum('bhqs,bshk->bqhk', softmax(scores), value)
+        return np.einsum('bqhk,hkd->bqd', attention, weights["output_kernel"]) + weights["output_bias"]
+
+    return x
+
+# Keras model converted to a list of layers that runs in plain NumPy. Both ProfitPulse models are a straight chain of
+# layers, the transformer's attention only attends over its own inputs, so the layers run one after the other.
+class NumpyModel:
+    def __init__(self, layers):
+        self.layers = layers
+
+    @classmethod
+    def from_keras(cls, model):
+        layers = []
+        for layer in model.layers:
+            kind, weights = export_layer(layer)
+            if weights is not None:
+                layers.append((kind, weights))
+        return cls(layers)
+
+    # Predicts a batch of windows shaped (samples, backcandles, features), or a single window without the samples axis
+    def predict(self, X):
+        x = np.asarray(X, dtype=np.float32)
+        single = x.ndim == 2
+        if single:
+            x = x[np.newaxis]
+
+        for kind, weights in self.layers:
+            x = run_layer(kind, weights, x)
+
+        return x[0] if single else x
+
+    # Mirrors calling the Keras model so the registry can hand out either engine
+    def __call__(self, X, training=False):
+        return NumpyPrediction(self.predict(X))
+
+    # Flattens the layers into named arrays for np.savez, <model>/<index>/<kind>/<weight>
+    def to_arrays(self, prefix):
+        arrays = {}
+        for index, (kind, weights) in enumerate(self.layers):
+            for name, value in weights.items():
+                arrays[f"{prefix}/{index:02d}/{kind}/{name}"] = np.asarray(value)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        layers = {}
+        for key in arrays:
+            model, index, kind, name = key.split('/')
+            if model == prefix:
+                layers.setdefault(int(index), (kind, {}))[1][name] = arrays[key]
+        return cls([layers[index] for index in sorted(layers)])
+
+# Result of calling a NumpyModel, with the numpy() accessor of a TensorFlow tensor
+class NumpyPrediction:
+    def __init__(self, values):
+        self.values = values
+
+    def numpy(self):
+        return self.values
+
+# Writes both models to a single compressed .npz file
+def export_models(path, lstm_model, transformer_model):
+    arrays = NumpyModel.from_keras(lstm_model).to_arrays("lstm")
+    arrays.update(NumpyModel.from_keras(transformer_model).to_arrays("transformer"))
+    np.savez_compressed(path, **arrays)
+
+# Reads both models from an .npz file written by export_models
+def load_models(path):
+    with np.load(path, allow_pickle=False) as arrays:
+        arrays = {key: arrays[key] for key in arrays.files}
+    return NumpyModel.from_arrays(arrays, "lstm"), NumpyModel.from_arrays(arrays, "transformer")
@@ -1,121 +1,338 @@
+import os
 import stock_api
 import preprocessing
-from lstm_model import LSTMmodel
-from transformer_model import TransformerModel
 import json
-from datetime import datetime, timedelta, time
-import pandas as pd
-
-# From the current time, it will find the next time within the specific time range from 9:30 - 16:30
-def find_next_time(current_time, specific_times):
-    specific_times = [datetime.strptime(t, "%H:%M").time() for t in specific_times]
-    current_time_only = current_time.time()
-
-    for t in specific_times:
-        if current_time_only < t:
-            return datetime.combine(current_time.date(), t)
-
-    # If no time is found, wrap around to the first time on the next day
-    return datetime.combine(current_time.date() + timedelta(days=1), specific_times[0])
-
-# Get the trading hours from the current time and exclude weekends and off hours
-def generate_trading_hours():
-    specific_times = ["09:30", "10:30", "11:30", "12:30", "13:30", "14:30", "15:30", "16:30"]
-    start_time = time(9, 30)
-    end_time = time(16, 30)
-
-    current_time = datetime.now()
-    trading_hours = []
-
-    # Skip weekends
-    while current_time.weekday() >= 5:
-        current_time += timedelta(days=1)
-
-    # Generate the next 7 trading hours
-    while len(trading_hours) < 7:
-        if start_time <= current_time.time() <= end_time:
-            next_time = find_next_time(current_time, specific_times)
-            trading_hours.append(next_time.strftime('%Y-%m-%d %H:%M:%S'))
-            current_time = next_time
-        else:
-            # Move to the next trading day
-            if current_time.time() > end_time:
-                current_time = datetime.combine(current_time.date() + timedelta(days=1), start_time)
-            else:
-                current_time = datetime.combine(current_time.date(), start_time)
-
-    return trading_hours
+import numpy as np
+from trading_hours import generate_trading_hours
+from training_profiles import FINE_TUNING, get_profile, scaled_learning_rate
+import timing
+import training_log
+import ensemble
+from features import DEFAULT_FEATURES
+from inference_server import InferenceQueueFull, RESULT_TIMEOUT
 
+# Tickers with at least this many bars within the columnar history store are trained on that stored history through the
+# chunked, memory mapped preprocessing instead of the downloaded frame. Can be changed with the
+# PROFITPULSE_HISTORY_TRAINING_ROWS environment variable.
+HISTORY_TRAINING_ROWS = int(os.environ.get('PROFITPULSE_HISTORY_TRAINING_ROWS', 100000))
+
+# Imports the Keras model classes on first use rather than when this module is imported. Serving still loads TensorFlow
+# through the training modules this one imports, like ensemble and training_profiles.
+def model_classes():
+    from lstm_model import LSTMmodel
+    from transformer_model import TransformerModel
+    return LSTMmodel, TransformerModel
 
 class PredictionModel:
-    def __init__(self, ticker):
+    def __init__(self, ticker, progress=None, profile=None, members=None):
         self.ticker = ticker
         self.stock_predictions = {}
+        self.progress = progress
+        self.profile = profile
+        self.features = list(DEFAULT_FEATURES)
+        self.members = list(members or ensemble.DEFAULT_ENSEMBLE)
+
+    # Reports the current stage and the fraction of the work that is done to the progress callback, if one was given
+    def report_progress(self, stage, fraction):
+        training_log.log_stage(stage, fraction)
+        if self.progress is not None:
+            self.progress(stage, fraction)
+
+    # Un-scales the last scaled predictions of each model, averages them and stores them with the next trading hours
+    def store_predictions(self, lstm_future_candles_scaled, transformer_future_candles_scaled, target_scaler, lstm_avg_metrics, transformer_avg_metrics, weights=None,
+                          current_time=None):
+        self.store_ensemble_predictions({"lstm": lstm_future_candles_scaled, "transformer": transformer_future_candles_scaled}, target_scaler,
+                                        {"lstm": lstm_avg_metrics, "transformer": transformer_avg_metrics}, weights, current_time)
+
+    # Un-scales the last scaled predictions of every ensemble member, stores each member's predictions and metrics as
+    # <name>_predictions and <name>_avg_metrics and their weighted average as predictions_average. The predictions are
+    # for the trading hours after current_time, which defaults to now.
+    def store_ensemble_predictions(self, future_candles_scaled, target_scaler, avg_metrics, weights=None, current_time=None):
+        weights = ensemble.member_weights(future_candles_scaled, weights)
+
+        # Un-scale the future target predictions
+        with timing.span("inverse_scaling"):
+            member_predictions = {name: target_scaler.inverse_transform(np.asarray(scaled).reshape(-1, 1)).flatten().tolist()
+                                  for name, scaled in future_candles_scaled.items()}
+
+        # Generate timestamps for the next 7 trading hours
+        trading_hours = generate_trading_hours(current_time)
+        date = trading_hours[0][:10]
+
+        predictions_average = ensemble.weighted_average(member_predictions, weights).tolist()
+        daily_average = sum(predictions_average) / len(predictions_average)
+
+        self.stock_predictions[self.ticker] = {"time": trading_hours}
+        for name, predictions in member_predictions.items():
+            self.stock_predictions[self.ticker][f"{name}_predictions"] = predictions
+            self.stock_predictions[self.ticker][f"{name}_avg_metrics"] = avg_metrics[name]
+        self.stock_predictions[self.ticker].update({
+            "predictions_average": predictions_average,
+            "daily_average": daily_average,
+            "date": date,
+            "ensemble_weights": weights,
+        })
+
+    # Downloads the data, trains every ensemble member at the same time and predicts, returning the trained models by
+    # member name and the scalers so they can be stored within the model registry
+    def train_models(self):
+        # Traverse through each ticker and run the functions
+        self.report_progress("downloading", 0.0)
+        data = stock_api.DownloadData(self.ticker)
+
+        # Get the scaled data and get the target scaler to un-scale later
+        self.report_progress("preprocessing", 0.05)
+        processed = self.process_history(data)
+        if processed is None:
+            processed = preprocessing.ProcessData(data, features=self.features, ticker=self.ticker)
+        X_train, X_test, y_train, y_test, backcandles, target_scaler, feature_scaler = processed
+
+        self.report_progress(f"training {', '.join(name for name, _ in self.members)}", 0.1)
+        trained = ensemble.train_members(self.members, X_train, X_test, y_train, y_test, backcandles, self.profile)
+        self.report_progress("predicting", 0.95)
+
+        # Extract the next 7 future targets from the predictions
+        self.store_ensemble_predictions({name: predictions[-1] for name, (_, predictions) in trained.items()}, target_scaler,
+                                        {name: model.avg_metrics for name, (model, _) in trained.items()}, dict(self.members))
+
+        return data, {name: model for name, (model, _) in trained.items()}, feature_scaler, target_scaler, backcandles
+
+    # Preprocesses a long history kept within the columnar store chunk by chunk, after appending the downloaded bars so
+    # the newest bars are part of it. Returns None for tickers with a shorter stored history, which use ProcessData.
+    def process_history(self, data):
+        from history_store import history_store
+
+        if history_store.rows(self.ticker) < HISTORY_TRAINING_ROWS:
+            return None
+
+        history_store.append(self.ticker, data)
+        training_log.logger.info(f"Training {self.ticker} on {history_store.rows(self.ticker)} stored bars")
+        return preprocessing.ProcessHistory(history_store, self.ticker, features=self.features)
+
+    # Attaches the stage timings collected during the run to the predictions of the ticker
+    def attach_timings(self, timings):
+        self.stock_predictions.setdefault(self.ticker, {})["timings"] = timings.to_dict()
 
     def build_train_predict_model(self):
-        try:
+        with timing.collect() as timings:
+            try:
+                self.train_models()
 
+            except Exception as exception:
+                print(f"Error during building prediction model: {exception}")
+                self.stock_predictions[self.ticker] =  {"Error" : str(exception)}
 
-            # Traverse through each ticker and run the functions
-            data = stock_api.DownloadData(self.ticker)
+        self.attach_timings(timings)
 
-            # Get the scaled data and get the target scaler to un-scale later
-            X_train, X_test, y_train, y_test, backcandles, target_scaler = preprocessing.ProcessData(data)
-                
-            # Give the LSTMmodel object the required parameters to train and run model
-            lstm_model = LSTMmodel(X_train, X_test, y_train, y_test, backcandles)
-            lstm_model.run_model()
-            lstm_predictions = lstm_model.model.predict(X_test)
+    # Retrains both models from scratch and stores them as a new version within the registry. This is the explicit
+    # retraining action, predict_from_registry only runs a forward pass on the stored models.
+    def train_and_register(self, registry):
+        with timing.collect() as timings:
+            try:
+                missing = [name for name in ("lstm", "transformer") if name not in dict(self.members)]
+                if missing:
+                    raise ValueError(f"The registry serves the lstm and transformer members, the ensemble is missing {', '.join(missing)}")
 
-            transformer_model = TransformerModel(X_train, X_test, y_train, y_test, backcandles)
-            transformer_model.run_model()
-            transformer_predictions = transformer_model.model.predict(X_test)
+                data, models, feature_scaler, target_scaler, backcandles = self.train_models()
+                lstm_model, transformer_model = models["lstm"], models["transformer"]
 
-            # Extract the next 7 future targets from the predictions
-            lstm_future_candles_scaled = lstm_predictions[-1]
-            transformer_future_candles_scaled = transformer_predictions[-1]
-        
-            # Un-scale the future target predictions
-            lstm_future_candles_unscaled = target_scaler.inverse_transform(lstm_future_candles_scaled.reshape(-1, 1)).flatten()
-            transformer_future_candles_unscaled = target_scaler.inverse_transform(transformer_future_candles_scaled.reshape(-1, 1)).flatten()
-
-            # Generate timestamps for the next 7 trading hours
-            trading_hours = generate_trading_hours()
-            date = trading_hours[0][:10]
-
-            lstm_predictions = lstm_future_candles_unscaled.tolist()
-            transformer_predictions = transformer_future_candles_unscaled.tolist()
-
-            predictions_average = []
-            for lstm_pred, transformer_pred in zip(lstm_predictions, transformer_predictions):
-                avg_pred = (lstm_pred + transformer_pred) / 2
-                predictions_average.append(avg_pred)
-
-            sum = 0
-            for average in predictions_average:
-                sum += average
-            daily_average = sum / 7
-
-            self.stock_predictions[self.ticker] = {
-                "time": trading_hours,
-                "lstm_predictions" : lstm_predictions,
-                "lstm_avg_metrics" : lstm_model.avg_metrics,
-                "transformer_predictions" : transformer_predictions,
-                "transformer_avg_metrics" : transformer_model.avg_metrics,
-                "predictions_average": predictions_average,
-                "daily_average": daily_average,
-                "date": date,
-            }
+                metadata = {
+                    "backcandles": backcandles,
+                    "futurecandles": 7,
+                    "watermark": str(data.dropna().index[-1]),
+                    "features": self.features,
+                    "lstm_avg_metrics": lstm_model.avg_metrics,
+                    "transformer_avg_metrics": transformer_model.avg_metrics,
+                    # Best validation loss of this full training run, fine tuning compares against it to detect drift
+                    "reference_val_loss": {"lstm": min(lstm_model.val_loss), "transformer": min(transformer_model.val_loss)},
+                    "ensemble_weights": ensemble.member_weights(("lstm", "transformer"), dict(self.members)),
+                }
+                with timing.span("registry.save"):
+                    version = registry.save(self.ticker, lstm_model.model, transformer_model.model, feature_scaler, target_scaler, metadata)
+                self.stock_predictions[self.ticker]["model_version"] = version
 
-        except Exception as exception:
-            print(f"Error during building prediction model: {exception}")
-            self.stock_predictions[self.ticker] =  {"Error" : str(exception)}
+            except Exception as exception:
+                print(f"Error during training and registering prediction model: {exception}")
+                self.stock_predictions[self.ticker] =  {"Error" : str(exception)}
+
+        self.attach_timings(timings)
+
+    # Warm starts both registered models and fine tunes them on the windows holding bars newer than the training
+    # watermark, mixed with a replayed sample of older windows, then stores them as a new version. When the ticker has
+    # never been trained or the validation loss drifts past the threshold, it falls back to a full retrain. When no bars
+    # arrived since the watermark, it serves the registered models as they are.
+    def fine_tune_and_register(self, registry, settings=FINE_TUNING):
+        fallback = False
+        with timing.collect() as timings:
+            try:
+                self.report_progress("loading models", 0.0)
+                with timing.span("registry.load"):
+                    trained = registry.load_for_training(self.ticker)
+
+                if trained is None:
+                    training_log.logger.info(f"No registered model for {self.ticker}, running a full training")
+                    fallback = True
+                else:
+                    fallback = self.fine_tune(registry, trained, settings)
+
+            except Exception as exception:
+                print(f"Error during fine tuning prediction model: {exception}")
+                self.stock_predictions[self.ticker] =  {"Error" : str(exception)}
+
+        if fallback:
+            self.train_and_register(registry)
+        elif self.ticker in self.stock_predictions:
+            self.attach_timings(timings)
+
+    # Fine tunes the trained models, returning True when the ticker needs a full retrain instead
+    def fine_tune(self, registry, trained, settings):
+        metadata = trained.metadata
+        backcandles = metadata["backcandles"]
+        futurecandles = metadata["futurecandles"]
+        # Models registered before the feature set was configurable were trained on Open, High and Low
+        features = metadata.get("features", preprocessing.FEATURE_FIELDS)
+
+        self.report_progress("downloading", 0.05)
+        data = stock_api.DownloadData(self.ticker)
+
+        self.report_progress("preprocessing", 0.1)
+        X, y, index = preprocessing.ProcessDataWithScalers(data, trained.feature_scaler, trained.target_scaler, backcandles, futurecandles, features=features, ticker=self.ticker)
+        new_start = preprocessing.NewWindowStart(index, metadata["watermark"], backcandles, futurecandles)
+        new_windows = X.shape[0] - new_start
+
+        if new_windows <= 0:
+            training_log.logger.info(f"No new bars for {self.ticker} since {metadata['watermark']}, serving the registered models")
+            self.predict_from_registry(registry)
+            return False
+
+        # The newest windows validate the fine tuned models, the rest of the new windows are trained on with the replay
+        validation_windows = max(1, int(new_windows * settings["validation_split"]))
+        validation_start = X.shape[0] - validation_windows
+        train_new = np.arange(new_start, validation_start) if validation_start > new_start else np.arange(new_start, X.shape[0])
+
+        replay_count = min(new_start, max(settings["min_replay"], int(new_windows * settings["replay_ratio"])))
+        replay = np.sort(np.random.default_rng().choice(new_start, size=replay_count, replace=False)) if replay_count else np.arange(0)
+        train_index = np.concatenate([replay, train_new])
+
+        X_train, y_train = X[train_index], y[train_index]
+        X_val, y_val = X[validation_start:], y[validation_start:]
+        training_log.logger.info(f"Fine tuning {self.ticker} on {train_new.shape[0]} new and {replay_count} replayed windows")
+
+        profile_name, profile = get_profile(self.profile)
+        learning_rate = scaled_learning_rate(profile) * settings["learning_rate_factor"]
+        LSTMmodel, TransformerModel = model_classes()
+        fine_tuned = {}
+        for fraction, (name, model_class, model) in zip((0.15, 0.5), (("lstm", LSTMmodel, trained.lstm_model), ("transformer", TransformerModel, trained.transformer_model))):
+            self.report_progress(f"fine tuning {name}", fraction)
+            fine_tuned[name] = model_class(X_train, X_val, y_train, y_val, backcandles, profile_name)
+            fine_tuned[name].model = model
+            with timing.span(f"{name}.fine_tune"):
+                fine_tuned[name].fine_tune_model(X_val, y_val, settings["epochs"], learning_rate)
+
+            # Drift is judged on the final validation loss against the best one of the last full training run
+            reference_val_loss = metadata.get("reference_val_loss", {}).get(name, metadata[f"{name}_avg_metrics"]["avg_val_loss"])
+            if fine_tuned[name].val_loss is None or fine_tuned[name].val_loss[-1] > settings["drift_threshold"] * reference_val_loss:
+                training_log.logger.info(f"{name} validation loss drifted past {settings['drift_threshold']}x the reference of {reference_val_loss:.4f}, running a full training")
+                return True
+
+        self.report_progress("predicting", 0.9)
+        latest_window = X[-1:]
+        with timing.span("lstm.predict"):
+            lstm_future_candles_scaled = fine_tuned["lstm"].model(latest_window, training=False).numpy()[0]
+        with timing.span("transformer.predict"):
+            transformer_future_candles_scaled = fine_tuned["transformer"].model(latest_window, training=False).numpy()[0]
+
+        self.store_predictions(lstm_future_candles_scaled, transformer_future_candles_scaled, trained.target_scaler, fine_tuned["lstm"].avg_metrics, fine_tuned["transformer"].avg_metrics,
+                               metadata.get("ensemble_weights"))
+
+        # The reference validation loss is carried over so drift is always judged against the last full training run
+        metadata = {key: value for key, value in metadata.items() if key != "trained_at"}
+        metadata.update(watermark=str(index[-1]), fine_tuned_from=trained.version,
+                        lstm_avg_metrics=fine_tuned["lstm"].avg_metrics, transformer_avg_metrics=fine_tuned["transformer"].avg_metrics)
+        with timing.span("registry.save"):
+            version = registry.save(self.ticker, fine_tuned["lstm"].model, fine_tuned["transformer"].model, trained.feature_scaler, trained.target_scaler, metadata)
+        self.stock_predictions[self.ticker]["model_version"] = version
+        return False
+
+    # Serves predictions from the newest registered models, only downloading the latest data and running a single
+    # forward pass through each model. A ticker without models of its own is served by the global model when that was
+    # trained on it. Returns False if neither exists yet.
+    # With a dispatcher the global model's windows are queued for its next batched forward pass, shared with the
+    # concurrent requests of other tickers, instead of running alone
+    def predict_from_registry(self, registry, dispatcher=None):
+        from model_registry import GLOBAL_KEY
+
+        with timing.collect() as timings:
+            try:
+                with timing.span("registry.load"):
+                    key, version = registry.serving_model(self.ticker)
+                    registered_model = registry.load(key, version) if key is not None else None
+                if registered_model is None:
+                    return False
+
+                metadata = registered_model.metadata
+                feature_scaler, target_scaler = registered_model.feature_scaler, registered_model.target_scaler
+                if key == GLOBAL_KEY:
+                    feature_scaler, target_scaler = feature_scaler[self.ticker.upper()], target_scaler[self.ticker.upper()]
+
+                data = stock_api.DownloadData(self.ticker)
+                window = preprocessing.LatestWindow(data, feature_scaler, metadata["backcandles"], metadata["futurecandles"],
+                                                    metadata.get("features", preprocessing.FEATURE_FIELDS), self.ticker)
+
+                # The global model tells the tickers apart by the id it was trained with
+                if key == GLOBAL_KEY:
+                    inputs = (window, np.array([metadata["tickers"].index(self.ticker.upper())], dtype=np.int32))
+                if key == GLOBAL_KEY and dispatcher is not None:
+                    with timing.span("batched.predict"):
+                        lstm_future = dispatcher.submit(registered_model.lstm_model, inputs, "global_lstm")
+                        transformer_future = dispatcher.submit(registered_model.transformer_model, inputs, "global_transformer")
+                        lstm_future_candles_scaled = lstm_future.result(timeout=RESULT_TIMEOUT)
+                        transformer_future_candles_scaled = transformer_future.result(timeout=RESULT_TIMEOUT)
+                elif key == GLOBAL_KEY:
+                    with timing.span("global.predict"):
+                        lstm_future_candles_scaled = registered_model.lstm_model(inputs, training=False).numpy()[0]
+                        transformer_future_candles_scaled = registered_model.transformer_model(inputs, training=False).numpy()[0]
+                else:
+                    with timing.span("lstm.predict"):
+                        lstm_future_candles_scaled = registered_model.lstm_model(window, training=False).numpy()[0]
+                    with timing.span("transformer.predict"):
+                        transformer_future_candles_scaled = registered_model.transformer_model(window, training=False).numpy()[0]
+
+                # The window ends on the newest bar, so the predicted hours are the ones after it
+                self.store_predictions(lstm_future_candles_scaled, transformer_future_candles_scaled, target_scaler, metadata["lstm_avg_metrics"], metadata["transformer_avg_metrics"],
+                                       metadata.get("ensemble_weights"), preprocessing.LastBarTime(data))
+                self.stock_predictions[self.ticker]["model_version"] = registered_model.version
+                if key == GLOBAL_KEY:
+                    self.stock_predictions[self.ticker]["global_model"] = True
+
+            # A full inference queue is handed to the caller, so the request can be retried instead of failing
+            except InferenceQueueFull:
+                raise
+            except Exception as exception:
+                print(f"Error during predicting from registry: {exception}")
+                self.stock_predictions[self.ticker] =  {"Error" : str(exception)}
+
+        self.attach_timings(timings)
+        return True
 
     def prediction_to_json(self):
         try:
-            stock_predictions_json = json.dumps(self.stock_predictions)
+            with timing.span("serialize"):
+                stock_predictions_json = json.dumps(self.stock_predictions)
             return stock_predictions_json
         
         except Exception as exception:
             print(f"Error during prediction to JSON:  {exception}")
-            return json.dumps({"Error" : str(exception)})
\ No newline at end of file
+            return json.dumps({"Error" : str(exception)})
+
+# Builds the LSTM and Transformer graphs once on an empty batch so TensorFlow, Keras and the layer code are fully loaded.
+# Running this in the preloading parent process lets forked web workers share those pages copy on write instead of
+# every worker paying for them on its first prediction.
+def warmup(backcandles=21, futurecandles=7, feature_count=len(DEFAULT_FEATURES)):
+    with timing.span("warmup"):
+        X = np.zeros((1, backcandles, feature_count), dtype=np.float32)
+        y = np.zeros((1, futurecandles), dtype=np.float32)
+        for model_class in model_classes():
+            model = model_class(X, X, y, y, backcandles)
+            model.build_model()
+            model.model(X, training=False)
@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+from trading_hours import generate_trading_hours
+
+# Predictions are made for the next trading hours, so they stay valid until the next trading hour slot starts. Returns
+# that slot, which is both part of the cache key and the moment the entry expires.
+def next_trading_slot(current_time=None):
+    return datetime.strptime(generate_trading_hours(current_time)[0], '%Y-%m-%d %H:%M:%S')
+
+# In process prediction cache keyed by (ticker, next trading hour slot, model version) with LRU eviction. Concurrent
+# requests for the same key are single flighted, the first request computes the value while the others wait on it.
+class PredictionCache:
+    def __init__(self, max_entries=256, clock=datetime.now):
+        self.max_entries = max_entries
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expired": 0}
+
+    def key(self, ticker, model_version):
+        return (ticker.upper(), next_trading_slot(self.clock()), model_version)
+
+    # Returns the cached value for the key, or computes it once for every concurrent caller. The value is only cached
+    # when cacheable(value) is true so errors are retried by the next request.
+    def get_or_compute(self, key, compute, cacheable=lambda value: True):
+        expires_at = key[1]
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > self.clock():
+                    self.entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry[1]
+
+                del self.entries[key]
+                self.stats["expired"] += 1
+
+            flight = self.inflight.get(key)
+            if flight is not None:
+                self.stats["coalesced"] += 1
+                leader = False
+            else:
+                flight = Future()
+                self.inflight[key] = flight
+                self.stats["misses"] += 1
+                leader = True
+
+        if not leader:
+            return flight.result()
+
+        try:
+            value = compute()
+        except Exception as exception:
+            with self.lock:
+                self.inflight.pop(key, None)
+            flight.set_exception(exception)
+            raise
+
+        with self.lock:
+            self.inflight.pop(key, None)
+            if cacheable(value) and expires_at > self.clock():
+                self.entries[key] = (expires_at, value)
+                self.entries.move_to_end(key)
+                self.evict()
+        flight.set_result(value)
+        return value
+
+    # Drops expired entries first, then the least recently used ones until the cache fits within max_entries
+    def evict(self):
+        now = self.clock()
+        for key in [key for key, entry in self.entries.items() if entry[0] <= now]:
+            del self.entries[key]
+            self.stats["expired"] += 1
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def cache_stats(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), inflight=len(self.inflight))
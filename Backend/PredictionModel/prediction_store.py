@@ -0,0 +1,191 @@
+import os
+import json
+import argparse
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+# SQLite file holding the prediction history, can be moved with the PROFITPULSE_PREDICTION_DB environment variable
+DEFAULT_PREDICTION_DB = os.environ.get('PROFITPULSE_PREDICTION_DB', os.path.abspath(os.path.join(os.path.dirname(__file__), 'predictions.db')))
+
+# Hourly predictions older than this many days are removed by compact(), the daily averages are kept
+DEFAULT_RETENTION_DAYS = int(os.environ.get('PROFITPULSE_PREDICTION_RETENTION_DAYS', 365))
+
+# The tables are WITHOUT ROWID so rows are stored clustered by (symbol, predicted_time). Each symbol's history is one
+# contiguous time ordered range of the primary key, so upserts and range reads are single index seeks that cost the same
+# however long the history grows.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    symbol TEXT NOT NULL,
+    predicted_time TEXT NOT NULL,
+    lstm_predicted_price REAL,
+    transformer_predicted_price REAL,
+    predictions_average REAL,
+    model_version INTEGER,
+    stored_at TEXT NOT NULL,
+    PRIMARY KEY (symbol, predicted_time)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS daily_averages (
+    symbol TEXT NOT NULL,
+    date TEXT NOT NULL,
+    daily_average REAL,
+    PRIMARY KEY (symbol, date)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS model_metrics (
+    symbol TEXT PRIMARY KEY,
+    lstm_avg_metrics TEXT,
+    transformer_avg_metrics TEXT,
+    last_trained_metrics TEXT,
+    updated_at TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Completes a bare yyyy-mm-dd bound so "to" covers the whole day, the times are stored as yyyy-mm-dd HH:MM:SS text
+def time_bound(value, end=False):
+    if value and len(value) == 10:
+        return value + (' 23:59:59' if end else ' 00:00:00')
+    return value
+
+# Append only prediction history. Every stored run upserts its hourly predictions by predicted time, replacing the
+# earlier prediction for the same hour, and its daily average by date.
+class PredictionStore:
+    def __init__(self, path=DEFAULT_PREDICTION_DB, retention_days=DEFAULT_RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.connection() as connection:
+            connection.executescript(SCHEMA)
+
+    # One connection per thread, as sqlite3 connections cannot be shared between threads. WAL lets readers run while a
+    # run is being stored.
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    # Stores one prediction run in the format /api/predict returns, in a single transaction
+    def store(self, symbol, prediction):
+        symbol = symbol.upper()
+        stored_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        rows = [(symbol, predicted_time, lstm, transformer, average, prediction.get("model_version"), stored_at)
+                for predicted_time, lstm, transformer, average in zip(prediction["time"], prediction["lstm_predicted_price"],
+                                                                     prediction["transformer_predicted_price"], prediction["predictions_average"])]
+
+        with self.connection() as connection:
+            connection.executemany("""
+                INSERT INTO predictions VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (symbol, predicted_time) DO UPDATE SET
+                    lstm_predicted_price = excluded.lstm_predicted_price,
+                    transformer_predicted_price = excluded.transformer_predicted_price,
+                    predictions_average = excluded.predictions_average,
+                    model_version = excluded.model_version,
+                    stored_at = excluded.stored_at
+            """, rows)
+
+            if prediction.get("date") and prediction.get("daily_average") is not None:
+                connection.execute("""
+                    INSERT INTO daily_averages VALUES (?, ?, ?)
+                    ON CONFLICT (symbol, date) DO UPDATE SET daily_average = excluded.daily_average
+                """, (symbol, prediction["date"], prediction["daily_average"]))
+
+            connection.execute("""
+                INSERT INTO model_metrics VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (symbol) DO UPDATE SET
+                    lstm_avg_metrics = excluded.lstm_avg_metrics,
+                    transformer_avg_metrics = excluded.transformer_avg_metrics,
+                    last_trained_metrics = excluded.last_trained_metrics,
+                    updated_at = excluded.updated_at
+            """, (symbol, json.dumps(prediction.get("lstm_avg_metrics")), json.dumps(prediction.get("transformer_avg_metrics")),
+                  json.dumps(prediction.get("last_trained_metrics")), stored_at))
+
+        return len(rows)
+
+    # Hourly predictions of the symbol between the two times, both inclusive, oldest first
+    def predictions(self, symbol, start=None, end=None, limit=None):
+        query = "SELECT predicted_time, lstm_predicted_price, transformer_predicted_price, predictions_average, model_version FROM predictions WHERE symbol = ? AND predicted_time >= ? AND predicted_time <= ? ORDER BY predicted_time"
+        parameters = [symbol.upper(), time_bound(start) or '', time_bound(end, end=True) or '9999']
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(int(limit))
+        return [dict(row) for row in self.connection().execute(query, parameters)]
+
+    # Daily averages of the symbol between the two dates, both inclusive, oldest first
+    def daily_averages(self, symbol, start=None, end=None):
+        rows = self.connection().execute("SELECT date, daily_average FROM daily_averages WHERE symbol = ? AND date >= ? AND date <= ? ORDER BY date",
+                                         (symbol.upper(), start or '', end or '9999'))
+        return [dict(row) for row in rows]
+
+    # Latest stored metrics of the symbol, or None if nothing has been stored for it
+    def metrics(self, symbol):
+        row = self.connection().execute("SELECT * FROM model_metrics WHERE symbol = ?", (symbol.upper(),)).fetchone()
+        if row is None:
+            return None
+        return {"symbol": row["symbol"], "lstm_avg_metrics": json.loads(row["lstm_avg_metrics"]), "transformer_avg_metrics": json.loads(row["transformer_avg_metrics"]),
+                "last_trained_metrics": json.loads(row["last_trained_metrics"]), "updated_at": row["updated_at"]}
+
+    # Removes the hourly predictions older than the retention, keeping the daily averages, and returns how many rows
+    # were removed. The freed pages are reused by later inserts.
+    def compact(self, retention_days=None, now=None):
+        retention_days = self.retention_days if retention_days is None else retention_days
+        cutoff = ((now or datetime.now()) - timedelta(days=retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+        with self.connection() as connection:
+            removed = connection.execute("DELETE FROM predictions WHERE predicted_time < ?", (cutoff,)).rowcount
+        self.connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return removed
+
+    # Imports a symbol's document of the old Firestore layout, predictions/<symbol> with a predictions array of predicted
+    # hours, a daily_average array and the latest metrics. Rows already in the store are newer than the document and
+    # are kept, so the import can be rerun. Returns how many hourly predictions were added.
+    def import_document(self, symbol, document):
+        symbol = symbol.upper()
+        stored_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        rows = [(symbol, prediction["predicted_time"], prediction.get("lstm_predicted_price"), prediction.get("transformer_predicted_price"),
+                 prediction.get("predictions_average"), None, stored_at)
+                for prediction in document.get("predictions") or [] if prediction.get("predicted_time")]
+        # Firestore appended a daily average on every run, the last one of a date is the one the dashboard showed
+        daily_averages = {average["date"]: average.get("daily_average") for average in document.get("daily_average") or [] if average.get("date")}
+
+        with self.connection() as connection:
+            added = connection.executemany("INSERT INTO predictions VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (symbol, predicted_time) DO NOTHING", rows).rowcount
+            connection.executemany("INSERT INTO daily_averages VALUES (?, ?, ?) ON CONFLICT (symbol, date) DO NOTHING",
+                                   [(symbol, date, average) for date, average in daily_averages.items()])
+            connection.execute("INSERT INTO model_metrics VALUES (?, ?, ?, ?, ?) ON CONFLICT (symbol) DO NOTHING",
+                               (symbol, json.dumps(document.get("lstm_avg_metrics")), json.dumps(document.get("transformer_avg_metrics")),
+                                json.dumps(document.get("last_trained_metrics")), stored_at))
+        return added
+
+# Copies the prediction history the dashboard used to keep in Firestore into the store, for every symbol of the
+# predictions collection or only the given ones. Uses the same credentials as the admin check of the web app.
+def backfill_firestore(store, symbols=None):
+    from firebase_admin import firestore
+    import admin_auth
+
+    collection = firestore.client(admin_auth.firebase()).collection("predictions")
+    documents = [collection.document(symbol).get() for symbol in symbols] if symbols else collection.stream()
+
+    added = {}
+    for document in documents:
+        if document.exists:
+            added[document.id.upper()] = store.import_document(document.id, document.to_dict() or {})
+    return added
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintains the prediction history database")
+    parser.add_argument('--backfill-firestore', nargs='*', metavar='SYMBOL', help="Import the Firestore prediction history, of all symbols when none are given")
+    parser.add_argument('--compact', action='store_true', help="Remove the hourly predictions older than the retention")
+    args = parser.parse_args()
+
+    store = PredictionStore()
+    if args.backfill_firestore is not None:
+        for symbol, added in backfill_firestore(store, [symbol.upper() for symbol in args.backfill_firestore]).items():
+            print(f"{symbol}: {added} hourly predictions imported")
+    if args.compact:
+        print(f"{store.compact()} hourly predictions removed")
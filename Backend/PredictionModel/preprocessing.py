@@ -1,31 +1,51 @@
+import math
+import tempfile
 from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import train_test_split
-import pandas_ta as ta
 import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+import timing
+from features import DEFAULT_FEATURES, FeatureEngine, FeatureFrame
+
+# Rows the history preprocessing reads from the memory mapped columns at a time, which bounds its working memory
+HISTORY_CHUNK_ROWS = 65536
+
+# Features of the models registered before the feature set was configurable, and the target field process_stock_data
+# stacks after the features
+FEATURE_FIELDS = ['Open', 'High', 'Low']
+TARGET_FIELD = 'Adj Close'
 
 # Class that processes stock and allows instances for each ticker
 class ProcessedStock:
-    def __init__(self, data):
+    def __init__(self, data, feature_scaler=None, target_scaler=None, features=None, ticker=None):
         self.data = data
-        self.feature_scaler = None
-        self.target_scaler = None
+        self.feature_scaler = feature_scaler
+        self.target_scaler = target_scaler
+        self.features = list(features or DEFAULT_FEATURES)
+        self.ticker = ticker
 
-    def process_stock_data(self, data):
+    # Scales the features and target, fitting new scalers unless fit is False, which reuses the scalers the object was
+    # created with so the data matches a model trained earlier
+    def process_stock_data(self, data, fit=True):
         try:
             # Dropping any null values within dataset
             data.dropna(inplace=True)
 
-            # Separate features and targets for scaling
-            features = data[['Open', 'High', 'Low']]
+            # Separate features and targets for scaling, the indicators of a known ticker come from its feature cache
+            features = FeatureFrame(data, self.features, self.ticker)
             target = data[['Adj Close']]
 
-            # Initialize the scalers to the object
-            self.feature_scaler = StandardScaler()
-            self.target_scaler = StandardScaler()
+            if fit:
+                # Initialize the scalers to the object
+                self.feature_scaler = StandardScaler()
+                self.target_scaler = StandardScaler()
 
-            # Scale both features and targets
-            scaled_features = self.feature_scaler.fit_transform(features)
-            scaled_target = self.target_scaler.fit_transform(target)
+                # Scale both features and targets
+                scaled_features = self.feature_scaler.fit_transform(features)
+                scaled_target = self.target_scaler.fit_transform(target)
+            else:
+                scaled_features = self.feature_scaler.transform(features)
+                scaled_target = self.target_scaler.transform(target)
 
             self.data = np.hstack((scaled_features, scaled_target))
 
@@ -40,34 +60,173 @@ class ProcessedStock:
         except Exception as exception:
             print(f"Exception error in processing stock data: {exception}")
 
-def ProcessData(data):
+# Builds the X and y windows as strided views over the processed stock instead of copying every window. The features
+# are the first feature_count columns and the target is the column after them. Row i of X holds the backcandles rows
+# before candle i + backcandles and row i of y holds the futurecandles targets from that candle on.
+def BuildWindows(processed_stock, backcandles=21, futurecandles=7, feature_count=3, dtype=np.float32):
+    # The only copy made is the cast of the base array, the windows themselves share its memory
+    data = np.asarray(processed_stock, dtype=dtype)
+    samples = data.shape[0] - backcandles - futurecandles
+    if samples <= 0:
+        raise ValueError(f"Need more than {backcandles + futurecandles} rows to build windows, got {data.shape[0]}")
+
+    # Windows over the first axis come out as (rows, columns, window), so the last two axes are swapped back
+    X = sliding_window_view(data[:, :feature_count], backcandles, axis=0)[:samples].transpose(0, 2, 1)
+    y = sliding_window_view(data[:, feature_count], futurecandles)[backcandles:backcandles + samples]
+    return X, y
+
+# Index that splits the windows into the leading training set and the trailing test set, the same boundary
+# train_test_split uses without shuffling
+def SplitIndex(samples, test_size=0.2):
+    return samples - math.ceil(samples * test_size)
+
+def ProcessData(data, backcandles=21, futurecandles=7, dtype=np.float32, features=None, ticker=None):
     try:
-        scaled_data = ProcessedStock(data)
-        processed_stock = scaled_data.process_stock_data(data)
+        scaled_data = ProcessedStock(data, features=features, ticker=ticker)
+        with timing.span("preprocess.scale"):
+            processed_stock = scaled_data.process_stock_data(data)
 
         # Backcandles for values specifiying how many data points within each index in X array
         # Futurecandles for values specifiying how many data points for the future predictions in Y array
-        backcandles = 21
-        futurecandles = 7
-        X = []
-        y = []
+        with timing.span("preprocess.window"):
+            X, y = BuildWindows(processed_stock, backcandles, futurecandles, len(scaled_data.features), dtype=dtype)
 
-        # Appending all the data for each of the X array based on the backcandles and futurecandles
-        for i in range(backcandles, processed_stock.shape[0] - futurecandles):
-            X.append(processed_stock[i-backcandles:i, :3])
-            y.append(processed_stock[i:i + futurecandles, 3])   
-
-        # Appending both arrays to numpy array so it may be used for data splitting
-        X = np.array(X)
-        y = np.array(y)
-        y = np.reshape(y, (y.shape[0], futurecandles))
-
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size= 0.2, shuffle=False)
-        return X_train, X_test, y_train, y_test, backcandles, scaled_data.target_scaler
+        # Splitting on an index keeps the train and test sets as views of the same windows
+        split = SplitIndex(X.shape[0])
+        X_train, X_test, y_train, y_test = X[:split], X[split:], y[:split], y[split:]
+        return X_train, X_test, y_train, y_test, backcandles, scaled_data.target_scaler, scaled_data.feature_scaler
 
     except ValueError as valueError:
         print(f"Value error in processing scaled data: {valueError}")
     except TypeError as typeError:
         print(f"Type error in processing scaled data: {typeError}")
     except Exception as exception:
-        print(f"Exception Error in processing scaled data: {exception}")
\ No newline at end of file
+        print(f"Exception Error in processing scaled data: {exception}")
+
+# Builds the single window the registry models predict from, scaling the features with the stored scaler instead of
+# refitting it. The window ends on the newest bar, so the predictions are of the hours after it. Training windows end
+# futurecandles bars earlier because their targets have to exist, a served window has no targets yet.
+def LatestWindow(data, feature_scaler, backcandles=21, futurecandles=7, features=None, ticker=None):
+    try:
+        with timing.span("preprocess.scale"):
+            data = data.dropna()
+            scaled_features = feature_scaler.transform(FeatureFrame(data, features, ticker))
+
+        if scaled_features.shape[0] < backcandles:
+            raise ValueError(f"Need at least {backcandles} rows to build a window, got {scaled_features.shape[0]}")
+
+        return scaled_features[-backcandles:].reshape(1, backcandles, -1)
+
+    except KeyError as keyError:
+        print(f"Key error in building latest window: {keyError}")
+    except ValueError as valueError:
+        print(f"Value error in building latest window: {valueError}")
+    except Exception as exception:
+        print(f"Exception error in building latest window: {exception}")
+
+# Time of the newest bar LatestWindow ends on, as a naive New York time like the trading hours the predictions are for
+def LastBarTime(data):
+    timestamp = data.dropna().index[-1]
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert("America/New_York").tz_localize(None)
+    return timestamp.to_pydatetime()
+
+# Builds every window with the scalers of an earlier training run and returns them with the timestamps of the rows, so
+# the windows that contain bars newer than that run can be found
+def ProcessDataWithScalers(data, feature_scaler, target_scaler, backcandles=21, futurecandles=7, dtype=np.float32, features=None, ticker=None):
+    try:
+        scaled_data = ProcessedStock(data, feature_scaler, target_scaler, features, ticker)
+        with timing.span("preprocess.scale"):
+            processed_stock = scaled_data.process_stock_data(data, fit=False)
+
+        with timing.span("preprocess.window"):
+            X, y = BuildWindows(processed_stock, backcandles, futurecandles, len(scaled_data.features), dtype=dtype)
+
+        # process_stock_data dropped the null rows in place, so the index lines up with the processed rows
+        return X, y, data.index
+
+    except ValueError as valueError:
+        print(f"Value error in processing data with scalers: {valueError}")
+    except Exception as exception:
+        print(f"Exception error in processing data with scalers: {exception}")
+
+# Index of the first window whose targets reach past the watermark, every window from there on holds at least one bar
+# that was not part of the training run that set the watermark
+def NewWindowStart(index, watermark, backcandles=21, futurecandles=7):
+    watermark = pd.Timestamp(watermark)
+    if index.tz is not None and watermark.tz is None:
+        watermark = watermark.tz_localize(index.tz)
+    elif index.tz is None and watermark.tz is not None:
+        watermark = watermark.tz_localize(None)
+
+    first_new_row = index.searchsorted(watermark, side='right')
+    return max(0, first_new_row - backcandles - futurecandles + 1)
+
+# Yields the features and target of rows start to stop of the stored history chunk_rows rows at a time, as (rows, feature
+# frame, target frame). The indicators carry their rolling state from one chunk into the next, so the values match
+# FeatureFrame over the same rows however the history is chunked.
+def HistoryChunks(store, ticker, features=None, start=0, stop=None, chunk_rows=HISTORY_CHUNK_ROWS):
+    engine = FeatureEngine(features)
+    columns = {field: store.column(ticker, field) for field in (store.meta(ticker) or {}).get("fields", [])}
+    target = columns[TARGET_FIELD]
+    stop = target.shape[0] if stop is None else stop
+
+    state = None
+    for chunk_start in range(start, stop, chunk_rows):
+        chunk = slice(chunk_start, min(chunk_start + chunk_rows, stop))
+        bars = pd.DataFrame({field: column[chunk].astype(np.float64) for field, column in columns.items()})
+        values, state = engine.compute(bars, state)
+        # Frames keep the feature names, so the scalers transform downloaded frames like any other scaler
+        yield chunk, pd.DataFrame(values, columns=engine.features), bars[[TARGET_FIELD]]
+
+# Fits the feature and target scalers over rows start to stop of the stored history in a single streaming pass with
+# partial_fit, so the memory used stays the same however long the history is
+def FitScalersChunked(store, ticker, start=0, stop=None, chunk_rows=HISTORY_CHUNK_ROWS, features=None):
+    feature_scaler = StandardScaler()
+    target_scaler = StandardScaler()
+    for _, chunk_features, chunk_target in HistoryChunks(store, ticker, features, start, stop, chunk_rows):
+        feature_scaler.partial_fit(chunk_features)
+        target_scaler.partial_fit(chunk_target)
+
+    return feature_scaler, target_scaler
+
+# Scales rows start to stop of the stored history chunk by chunk into a (rows, features + 1) array laid out like
+# process_stock_data's output. The scaled rows go to a memory mapped scratch file, the path in out or an anonymous file
+# within the store's directory that is removed once the array is released, so they never have to fit in memory.
+def ScaleHistory(store, ticker, feature_scaler, target_scaler, start=0, stop=None, chunk_rows=HISTORY_CHUNK_ROWS, dtype=np.float32, out=None, features=None):
+    features = list(features or DEFAULT_FEATURES)
+    stop = store.rows(ticker) if stop is None else stop
+
+    shape = (stop - start, len(features) + 1)
+    scratch = out if out is not None else tempfile.TemporaryFile(dir=store.directory, prefix=f"{ticker.upper()}.", suffix='.scaled')
+    scaled = np.memmap(scratch, dtype=dtype, mode='w+', shape=shape)
+    for chunk, chunk_features, chunk_target in HistoryChunks(store, ticker, features, start, stop, chunk_rows):
+        rows = slice(chunk.start - start, chunk.stop - start)
+        scaled[rows, :len(features)] = feature_scaler.transform(chunk_features)
+        scaled[rows, len(features)] = target_scaler.transform(chunk_target)[:, 0]
+
+    return scaled
+
+# ProcessData for histories in the columnar store, returning the same values. The scalers are fitted in a streaming pass
+# and the windows are strided views over the memory mapped scaled rows, so neither a DataFrame of the history nor a copy
+# of every window is built.
+def ProcessHistory(store, ticker, backcandles=21, futurecandles=7, start=0, stop=None, chunk_rows=HISTORY_CHUNK_ROWS, dtype=np.float32, out=None, features=None):
+    try:
+        features = list(features or DEFAULT_FEATURES)
+        with timing.span("preprocess.scale"):
+            feature_scaler, target_scaler = FitScalersChunked(store, ticker, start, stop, chunk_rows, features)
+            scaled = ScaleHistory(store, ticker, feature_scaler, target_scaler, start, stop, chunk_rows, dtype, out, features)
+
+        with timing.span("preprocess.window"):
+            X, y = BuildWindows(scaled, backcandles, futurecandles, len(features), dtype=dtype)
+
+        split = SplitIndex(X.shape[0])
+        X_train, X_test, y_train, y_test = X[:split], X[split:], y[:split], y[split:]
+        return X_train, X_test, y_train, y_test, backcandles, target_scaler, feature_scaler
+
+    except KeyError as keyError:
+        print(f"Key error in processing stored history: {keyError}")
+    except ValueError as valueError:
+        print(f"Value error in processing stored history: {valueError}")
+    except Exception as exception:
+        print(f"Exception error in processing stored history: {exception}")
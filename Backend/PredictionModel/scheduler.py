@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+import timing
+from batch import clean_symbols
+
+# Tickers whose predictions are precomputed, a comma separated list in the PROFITPULSE_WATCHLIST environment variable.
+# The scheduler is only started when the watchlist is not empty.
+DEFAULT_WATCHLIST = clean_symbols(os.environ.get('PROFITPULSE_WATCHLIST', '').split(','))
+
+# Minutes before the 9:30 open the pre-market run starts, and minutes after each hourly bar closes that its run starts so
+# the upstream has published the bar
+PRE_MARKET_LEAD = int(os.environ.get('PROFITPULSE_PRE_MARKET_LEAD', 30))
+BAR_CLOSE_DELAY = int(os.environ.get('PROFITPULSE_BAR_CLOSE_DELAY', 2))
+
+# The 9:30 to 16:30 session the hourly bars close within, the same slots generate_trading_hours steps through
+SESSION_OPEN = "09:30"
+BAR_CLOSES = ["10:30", "11:30", "12:30", "13:30", "14:30", "15:30", "16:30"]
+
+# Longest the loop sleeps between checks, so a changed clock or a stop is noticed
+MAX_SLEEP = 60
+
+# Directory of the <TICKER>.npz files stock_api's BarCache keeps, read here directly so fingerprinting a ticker neither
+# imports pandas and yfinance into the web process nor downloads anything
+BAR_CACHE_DIR = os.environ.get('PROFITPULSE_DATA_DIR', os.path.abspath(os.path.join(os.path.dirname(__file__), 'bar_cache')))
+
+# Runs of a single trading day as (time, reason) pairs, oldest first. Weekends have no runs.
+def session_runs(day):
+    if day.weekday() >= 5:
+        return []
+
+    at = lambda clock_time: datetime.combine(day, datetime.strptime(clock_time, "%H:%M").time())
+    runs = [(at(SESSION_OPEN) - timedelta(minutes=PRE_MARKET_LEAD), "pre_market")]
+    runs += [(at(bar_close) + timedelta(minutes=BAR_CLOSE_DELAY), "bar_close") for bar_close in BAR_CLOSES]
+    return runs
+
+# Most recent hourly bar close at or before the current time, looking back over the weekend
+def last_bar_close(current_time):
+    day = current_time.date()
+    for _ in range(8):
+        if day.weekday() < 5:
+            closes = [datetime.combine(day, datetime.strptime(bar_close, "%H:%M").time()) for bar_close in BAR_CLOSES]
+            closes = [bar_close for bar_close in closes if bar_close <= current_time]
+            if closes:
+                return closes[-1]
+        day -= timedelta(days=1)
+    return None
+
+# First run strictly after the current time, looking ahead over the weekend
+def next_run(current_time):
+    day = current_time.date()
+    for _ in range(8):
+        for run_at, reason in session_runs(day):
+            if run_at > current_time:
+                return run_at, reason
+        day += timedelta(days=1)
+    return None
+
+# Maps the PredictionModel output of a ticker to the format /api/predict returns and the prediction store keeps
+def stored_prediction(predictions):
+    return {
+        "time": predictions["time"],
+        "lstm_predicted_price": predictions["lstm_predictions"],
+        "lstm_avg_metrics": predictions["lstm_avg_metrics"],
+        "transformer_predicted_price": predictions["transformer_predictions"],
+        "transformer_avg_metrics": predictions["transformer_avg_metrics"],
+        "predictions_average": predictions["predictions_average"],
+        "daily_average": predictions["daily_average"],
+        "date": predictions["date"],
+        "model_version": predictions.get("model_version"),
+    }
+
+# Default input fingerprint of a ticker: the time of its newest cached bar and the model serving it, read from
+# the bar cache on disk without fetching. A ticker whose fingerprint matches the one recorded after its last run would
+# get the same predictions again. The cache only shows new bars once something has fetched them, so a cache that has
+# not been written since the last bar closed has no fingerprint and the ticker is run, fetching the bar.
+def bar_fingerprint(registry, directory=BAR_CACHE_DIR, clock=datetime.now):
+    def fingerprint(ticker):
+        path = os.path.join(directory, f"{ticker.upper()}.npz")
+        try:
+            written_at = datetime.fromtimestamp(os.path.getmtime(path))
+            with np.load(path, allow_pickle=False) as cached:
+                index = cached["index"]
+        except FileNotFoundError:
+            return None
+
+        bar_close = last_bar_close(clock())
+        if len(index) == 0 or (bar_close is not None and written_at < bar_close):
+            return None
+        return [str(np.datetime64(int(index[-1]), 'ns'))] + list(registry.serving_model(ticker))
+    return fingerprint
+
+# Predictor that runs the tickers one after the other within this process, used with a fake clock and local data. The
+# app hands in BatchPredictor.predict instead, which fans the tickers out over its pool of worker processes. Tickers
+# without a registered model are reported as failed, they have to be trained first.
+def local_predictor(registry):
+    def predict(symbols):
+        import predict_model
+        from model_registry import not_trained_error
+
+        for symbol in symbols:
+            prediction_model = predict_model.PredictionModel(symbol)
+            if not prediction_model.predict_from_registry(registry):
+                prediction_model.stock_predictions[symbol] = {"Error": not_trained_error(symbol)}
+            yield prediction_model.stock_predictions
+    return predict
+
+# Precomputes and stores the watchlist's predictions before the open and after every hourly bar closes, so the dashboard
+# reads stored predictions instead of waiting on a forward pass. Tickers whose inputs have not changed since their last
+# run are skipped, the rest are handed to the predictor longest first so the slow tickers start while the worker pool
+# is still empty. The clock is injectable so the schedule can be driven by a fake clock.
+class PrecomputeScheduler:
+    def __init__(self, watchlist, predictor, store, fingerprint, on_result=None, clock=datetime.now):
+        self.watchlist = clean_symbols(watchlist)
+        self.predictor = predictor
+        self.store = store
+        self.fingerprint = fingerprint
+        self.on_result = on_result
+        self.clock = clock
+        self.fingerprints = {}
+        self.durations = {}
+        self.next = next_run(self.clock())
+        self.last_run = None
+        self.running = False
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    # Runs the schedule's next run once the clock has reached it, returning the run's summary or None if it is not due.
+    # Runs that were missed while the process was down are collapsed into the one run.
+    def tick(self):
+        now = self.clock()
+        if self.next is None or now < self.next[0]:
+            return None
+
+        reason = self.next[1]
+        self.next = next_run(now)
+        return self.run(reason)
+
+    # Precomputes the watchlist now, regardless of the schedule
+    def run(self, reason="manual"):
+        with self.lock:
+            if self.running:
+                return None
+            self.running = True
+
+        try:
+            summary = self.precompute(reason)
+        finally:
+            with self.lock:
+                self.running = False
+
+        self.last_run = summary
+        timing.metrics.set_gauge("profitpulse_precompute_seconds", summary["latency_seconds"])
+        return summary
+
+    def read_fingerprint(self, ticker):
+        try:
+            return self.fingerprint(ticker)
+        except Exception as exception:
+            print(f"Error fingerprinting {ticker} for precomputation: {exception}")
+            return None
+
+    def precompute(self, reason):
+        started_at = self.clock()
+        start = time.perf_counter()
+        summary = {"reason": reason, "started_at": started_at.strftime('%Y-%m-%d %H:%M:%S'), "computed": [], "skipped": [], "failed": {}}
+
+        # Tickers whose inputs changed since their last successful run
+        changed = []
+        for ticker in self.watchlist:
+            fingerprint = self.read_fingerprint(ticker)
+            if fingerprint is not None and fingerprint == self.fingerprints.get(ticker):
+                summary["skipped"].append(ticker)
+            else:
+                changed.append(ticker)
+
+        # Longest first, by how long each ticker took to come back last time, tickers never run before go first
+        order = sorted(changed, key=lambda ticker: -self.durations.get(ticker, float('inf')))
+
+        for predictions in self.predictor(order):
+            for ticker, prediction in predictions.items():
+                self.durations[ticker] = time.perf_counter() - start
+                if "Error" in prediction:
+                    summary["failed"][ticker] = prediction["Error"]
+                    continue
+
+                try:
+                    self.store.store(ticker, stored_prediction(prediction))
+                    if self.on_result is not None:
+                        self.on_result(ticker, predictions)
+                except Exception as exception:
+                    print(f"Error storing precomputed predictions for {ticker}: {exception}")
+                    summary["failed"][ticker] = str(exception)
+                    continue
+
+                # Only successful runs record the fingerprint, taken once the predictor has fetched the bars it predicted
+                # from, so failed tickers are retried on the next run
+                fingerprint = self.read_fingerprint(ticker)
+                if fingerprint is not None:
+                    self.fingerprints[ticker] = fingerprint
+                summary["computed"].append(ticker)
+
+        summary["latency_seconds"] = time.perf_counter() - start
+        summary["finished_at"] = self.clock().strftime('%Y-%m-%d %H:%M:%S')
+        summary["ticker_seconds"] = {ticker: self.durations[ticker] for ticker in changed if ticker in self.durations}
+        return summary
+
+    # Every run of the current day and the next run, for the admin dashboard
+    def schedule(self):
+        now = self.clock()
+        return {
+            "watchlist": self.watchlist,
+            "now": now.strftime('%Y-%m-%d %H:%M:%S'),
+            "today": [{"at": run_at.strftime('%Y-%m-%d %H:%M:%S'), "reason": reason, "done": run_at <= now} for run_at, reason in session_runs(now.date())],
+            "next_run": {"at": self.next[0].strftime('%Y-%m-%d %H:%M:%S'), "reason": self.next[1]} if self.next else None,
+        }
+
+    def status(self):
+        return dict(self.schedule(), running=self.running, last_run=self.last_run)
+
+    # Starts the loop on a daemon thread, which wakes at the next run or after MAX_SLEEP seconds, whichever is sooner
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+
+            def loop():
+                while not self.stopped.is_set():
+                    try:
+                        self.tick()
+                    except Exception as exception:
+                        print(f"Error during scheduled precomputation: {exception}")
+                    wait = (self.next[0] - self.clock()).total_seconds() if self.next else MAX_SLEEP
+                    self.stopped.wait(min(max(wait, 1), MAX_SLEEP))
+
+            self.thread = threading.Thread(target=loop, name="precompute-scheduler", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+# Runs the scheduler on its own, for example python scheduler.py AAPL MSFT. With --csv-dir the bars are read from
+# <TICKER>.csv files and --now pins the clock, so a run can be tried offline: python scheduler.py AAPL --csv-dir bars
+# --now "2024-03-06 10:32" --once
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precompute the watchlist's predictions around the market session")
+    parser.add_argument('symbols', nargs='*', default=DEFAULT_WATCHLIST)
+    parser.add_argument('--csv-dir', default=None)
+    parser.add_argument('--now', default=None)
+    parser.add_argument('--once', action='store_true')
+    arguments = parser.parse_args()
+
+    import stock_api
+    from model_registry import ModelRegistry
+    from prediction_store import PredictionStore
+
+    if arguments.csv_dir:
+        stock_api.bar_cache.source = stock_api.CsvSource(arguments.csv_dir)
+    clock = (lambda: datetime.strptime(arguments.now, '%Y-%m-%d %H:%M')) if arguments.now else datetime.now
+
+    registry = ModelRegistry()
+    scheduler = PrecomputeScheduler(arguments.symbols, local_predictor(registry), PredictionStore(), bar_fingerprint(registry, clock=clock), clock=clock)
+    if arguments.once:
+        print(json.dumps(scheduler.run()), flush=True)
+    else:
+        print(json.dumps(scheduler.schedule()), flush=True)
+        while True:
+            summary = scheduler.tick()
+            if summary is not None:
+                print(json.dumps(summary), flush=True)
+            time.sleep(min(max((scheduler.next[0] - clock()).total_seconds(), 1), MAX_SLEEP))
@@ -1,19 +1,167 @@
+import os
+import time
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
 import yfinance as yf
+import timing
+
+# Directory for the per ticker bar cache, can be moved with the PROFITPULSE_DATA_DIR environment variable when hosting
+DEFAULT_DATA_DIR = os.environ.get('PROFITPULSE_DATA_DIR', os.path.abspath(os.path.join(os.path.dirname(__file__), 'bar_cache')))
+
+# Yahoo only serves hourly bars for the last 730 days, so the cache keeps the same 2 year window
+HISTORY_WINDOW = pd.Timedelta(days=730)
+
+# Flattens the (field, ticker) columns yfinance returns for single tickers so the cache stores plain field names
+def flatten_columns(data):
+    if isinstance(data.columns, pd.MultiIndex):
+        data = data.copy()
+        data.columns = data.columns.get_level_values(0)
+    return data
+
+# Default upstream source, downloads the full 2 year history or only the bars since start with 1 hour intervals
+def yahoo_source(ticker, start=None):
+    if start is None:
+        data = yf.download(ticker, period='2y', interval='1h', progress=False)
+    else:
+        data = yf.download(ticker, start=start, interval='1h', progress=False)
+    return flatten_columns(data)
+
+# Writes the arrays to a uniquely named temporary file next to path and renames it over path, so readers never see a
+# partially written file. The job and batch worker processes can write the same ticker at once, a shared temporary name
+# would let one writer replace the file the other is still writing. With compressed the arrays are zip compressed.
+def write_npz(path, compressed=False, **arrays):
+    temp_file = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp', delete=False)
+    try:
+        with temp_file:
+            (np.savez_compressed if compressed else np.savez)(temp_file, **arrays)
+        os.replace(temp_file.name, path)
+    except Exception:
+        try:
+            os.remove(temp_file.name)
+        except FileNotFoundError:
+            pass
+        raise
+
+# Offline stand-in source that reads <TICKER>.csv files from a directory, used for testing the cache without network access
+class CsvSource:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __call__(self, ticker, start=None):
+        data = pd.read_csv(os.path.join(self.directory, f"{ticker.upper()}.csv"), index_col=0, parse_dates=True)
+        if start is not None:
+            data = data[data.index >= start]
+        return data
+
+# Per ticker bar cache that stores the downloaded history as .npz files. Each read only fetches the missing tail since
+# the last cached bar, replacing that bar as it may still have been forming, and appends it. Bars fetched within
+# min_refresh seconds are served straight from memory.
+class BarCache:
+    def __init__(self, directory=DEFAULT_DATA_DIR, source=yahoo_source, min_refresh=60):
+        self.directory = directory
+        self.source = source
+        self.min_refresh = min_refresh
+        self.frames = {}
+        self.refreshed = {}
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        self.stats = {"cold": 0, "warm": 0, "hits": 0, "appended_rows": 0, "fetch_errors": 0}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, ticker):
+        return os.path.join(self.directory, f"{ticker.upper()}.npz")
+
+    def ticker_lock(self, ticker):
+        with self.locks_lock:
+            return self.locks.setdefault(ticker.upper(), threading.Lock())
+
+    # Reads the cached bars for the ticker from disk, returns None if it has never been cached
+    def read(self, ticker):
+        try:
+            with np.load(self.path(ticker), allow_pickle=False) as cached:
+                index = pd.to_datetime(cached["index"], utc=True)
+                timezone = str(cached["timezone"])
+                if timezone:
+                    index = index.tz_convert(timezone)
+                else:
+                    index = index.tz_localize(None)
+                return pd.DataFrame(cached["values"], index=index, columns=cached["columns"].tolist())
+        except FileNotFoundError:
+            return None
+
+    # Writes the bars through a temporary file so readers never see a partially written cache
+    def write(self, ticker, data):
+        index = data.index
+        timezone = str(index.tz) if index.tz is not None else ""
+        if index.tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+
+        write_npz(self.path(ticker), index=index.values.astype('datetime64[ns]').astype(np.int64),
+                  columns=np.array(data.columns, dtype=str), values=data.to_numpy(dtype=np.float64), timezone=np.array(timezone))
+
+    # Returns the full cached history for the ticker, fetching only what is missing from the source
+    def get(self, ticker):
+        ticker = ticker.upper()
+        with self.ticker_lock(ticker):
+            cached = self.frames.get(ticker)
+            if cached is None:
+                cached = self.read(ticker)
+
+            if cached is not None and time.monotonic() - self.refreshed.get(ticker, float('-inf')) < self.min_refresh:
+                self.stats["hits"] += 1
+                return cached.copy()
+
+            try:
+                if cached is None or cached.empty:
+                    data = flatten_columns(self.source(ticker))
+                    self.stats["cold"] += 1
+                    self.stats["appended_rows"] += len(data)
+                else:
+                    tail = flatten_columns(self.source(ticker, start=cached.index[-1]))
+                    data = pd.concat([cached, tail[cached.columns]]) if not tail.empty else cached
+                    data = data[~data.index.duplicated(keep='last')].sort_index()
+                    self.stats["warm"] += 1
+                    self.stats["appended_rows"] += len(data) - len(cached)
+
+            except Exception as exception:
+                # Serve the cached bars when the source cannot be reached
+                print(f"Error fetching bars for {ticker}, serving cache: {exception}")
+                self.stats["fetch_errors"] += 1
+                if cached is None:
+                    raise
+                return cached.copy()
+
+            if not data.empty:
+                data = data[data.index > data.index[-1] - HISTORY_WINDOW]
+                self.write(ticker, data)
+                self.frames[ticker] = data
+                self.refreshed[ticker] = time.monotonic()
+
+            return data.copy()
+
+    def cache_stats(self):
+        return dict(self.stats, tickers=len(self.frames))
+
+# Shared cache used by DownloadData
+bar_cache = BarCache()
 
 # Stock class that will modularize downloads and allow objects that are pandas dataframes
 class Stock:
     #Object initializer with ticker as identifier
-    def __init__(self,ticker):
+    def __init__(self,ticker, cache=None):
         self.ticker = ticker
+        self.cache = cache if cache is not None else bar_cache
         self.data = None
 
-    # API data downloader function with a 2 year period with 1 hour intervals
+    # API data downloader function with a 2 year period with 1 hour intervals, served through the bar cache
     def download_data(self):
         try:
-            self.data = yf.download(self.ticker, period='2y', interval='1h')
+            self.data = self.cache.get(self.ticker)
             if self.data.empty:
                 raise ValueError("No data has been found for the ticker and time period")
-        
+
         # Error handling
         except ValueError as valueError:
             print(f"Value error downloading data for {self.ticker}: {valueError}")
@@ -30,11 +178,16 @@ class Stock:
 def DownloadData(ticker):
     try:
         stock = Stock(ticker)
-        stock_data = stock.download_data()
+        with timing.span("download"):
+            stock_data = stock.download_data()
 
         return stock_data
-    
+
     # Error Handling
     except Exception as exception:
         print(f"Error in downloading data for {ticker}: {exception}")
-        return None
\ No newline at end of file
+        return None
+
+# Cold and warm hit statistics of the shared bar cache
+def CacheStats():
+    return bar_cache.cache_stats()
@@ -0,0 +1,203 @@
+import os
+import time
+import bisect
+import resource
+import threading
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds, from a cached forward pass up to a full training run
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Timings collected for the current thread, set by collect()
+local = threading.local()
+
+# Peak resident set size of this process in bytes, getrusage reports it in kilobytes on Linux
+def peak_rss_bytes():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# Current resident set size of this process in bytes, read from /proc on Linux and falling back to the peak elsewhere
+def current_rss_bytes():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+# Seconds since this process was started, read from /proc on Linux, or None where that is not available
+def process_age_seconds():
+    try:
+        with open('/proc/self/stat') as stat:
+            # The command name can contain spaces, so the fields are counted from after its closing parenthesis
+            start_ticks = int(stat.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as uptime:
+            uptime_seconds = float(uptime.read().split()[0])
+        return uptime_seconds - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+# Durations of every stage that ran while collecting, plus the duration of each training epoch per model
+class Timings:
+    def __init__(self):
+        self.stages = {}
+        self.epochs = {}
+        self.started = time.perf_counter()
+        self.total = None
+        # Threads attached to the run add to the same stages concurrently
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_epoch(self, model, seconds):
+        with self.lock:
+            self.epochs.setdefault(model, []).append(seconds)
+
+    def to_dict(self):
+        total = self.total if self.total is not None else time.perf_counter() - self.started
+        return {
+            "total": round(total, 6),
+            "stages": {stage: round(seconds, 6) for stage, seconds in self.stages.items()},
+            "epochs": {model: [round(seconds, 6) for seconds in epochs] for model, epochs in self.epochs.items()},
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+
+# Collects the spans that run on this thread within the block into a Timings object
+@contextmanager
+def collect():
+    previous = getattr(local, "timings", None)
+    local.timings = Timings()
+    try:
+        yield local.timings
+    finally:
+        local.timings.total = time.perf_counter() - local.timings.started
+        local.timings = previous
+
+# Timings being collected on this thread, None when nothing is collecting
+def current():
+    return getattr(local, "timings", None)
+
+# Collects the spans of this thread within the block into timings collected on another thread, so work handed to a
+# worker thread is still timed as part of the run that started it
+@contextmanager
+def attach(timings):
+    previous = getattr(local, "timings", None)
+    local.timings = timings
+    try:
+        yield timings
+    finally:
+        local.timings = previous
+
+# Times the stage within the block. The duration goes to the timings being collected on this thread, or straight into
+# the stage histogram when nothing is collecting.
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timings = getattr(local, "timings", None)
+        if timings is not None:
+            timings.add(stage, elapsed)
+        else:
+            metrics.observe("profitpulse_stage_seconds", "stage", stage, elapsed)
+
+# Records the duration of one training epoch for the model on this thread
+def record_epoch(model, seconds):
+    timings = getattr(local, "timings", None)
+    if timings is not None:
+        timings.add_epoch(model, seconds)
+    else:
+        metrics.observe("profitpulse_epoch_seconds", "model", model, seconds)
+
+# Cumulative histogram in the Prometheus sense, counts[i] is the number of observations at or below buckets[i]
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index in range(bisect.bisect_left(self.buckets, value), len(self.buckets)):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+# Histograms and gauges of the process, rendered in the Prometheus text format by the /metrics endpoint
+class MetricsRegistry:
+    def __init__(self):
+        self.histograms = {}
+        self.gauges = {}
+        self.help = {
+            "profitpulse_stage_seconds": "Time spent in each prediction pipeline stage",
+            "profitpulse_epoch_seconds": "Time spent fitting a single training epoch",
+            "profitpulse_request_seconds": "Time spent handling an API request",
+            "profitpulse_peak_rss_bytes": "Peak resident set size of the web process",
+            "profitpulse_worker_peak_rss_bytes": "Highest peak resident set size reported by a prediction run",
+            "profitpulse_rss_bytes": "Current resident set size of the web process",
+            "profitpulse_startup_seconds": "Seconds from process start until the app was ready to serve",
+            "profitpulse_ml_import_seconds": "Seconds spent importing the machine learning stack",
+            "profitpulse_inference_batch_size": "Windows run within a single batched forward pass of a model",
+            "profitpulse_inference_queue_seconds": "Time a window waited for its batched forward pass",
+            "profitpulse_inference_queue_depth": "Highest number of windows waiting for the inference dispatcher",
+            "profitpulse_precompute_seconds": "Seconds the last scheduled precomputation of the watchlist took",
+        }
+        self.lock = threading.Lock()
+
+    def observe(self, name, label, value, seconds, buckets=DEFAULT_BUCKETS):
+        with self.lock:
+            family = self.histograms.setdefault(name, {"label": label, "series": {}})
+            histogram = family["series"].get(value)
+            if histogram is None:
+                histogram = family["series"][value] = Histogram(buckets)
+            histogram.observe(seconds)
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def set_gauge_max(self, name, value):
+        with self.lock:
+            self.gauges[name] = max(self.gauges.get(name, 0), value)
+
+    # Adds the stages and epochs of a finished run, which may have been collected in another process, to the histograms
+    def observe_timings(self, timings):
+        if not timings:
+            return
+        for stage, seconds in timings.get("stages", {}).items():
+            self.observe("profitpulse_stage_seconds", "stage", stage, seconds)
+        for model, epochs in timings.get("epochs", {}).items():
+            for seconds in epochs:
+                self.observe("profitpulse_epoch_seconds", "model", model, seconds)
+        if "total" in timings:
+            self.observe("profitpulse_stage_seconds", "stage", "total", timings["total"])
+        if "peak_rss_bytes" in timings:
+            self.set_gauge_max("profitpulse_worker_peak_rss_bytes", timings["peak_rss_bytes"])
+
+    def render(self):
+        self.set_gauge("profitpulse_peak_rss_bytes", peak_rss_bytes())
+        self.set_gauge("profitpulse_rss_bytes", current_rss_bytes())
+        lines = []
+        with self.lock:
+            for name, family in sorted(self.histograms.items()):
+                lines.append(f"# HELP {name} {self.help.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                label = family["label"]
+                for value, histogram in sorted(family["series"].items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{{{label}="{value}",le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{label}="{value}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{{label}="{value}"}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{label}="{value}"}} {histogram.count}')
+
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f"# HELP {name} {self.help.get(name, name)}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+# Metrics of this process
+metrics = MetricsRegistry()
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta, time
+
+# From the current time, it will find the next time within the specific time range from 9:30 - 16:30
+def find_next_time(current_time, specific_times):
+    specific_times = [datetime.strptime(t, "%H:%M").time() for t in specific_times]
+    current_time_only = current_time.time()
+
+    for t in specific_times:
+        if current_time_only < t:
+            return datetime.combine(current_time.date(), t)
+
+    # If no time is found, wrap around to the first time on the next day
+    return datetime.combine(current_time.date() + timedelta(days=1), specific_times[0])
+
+# Get the trading hours from the current time and exclude weekends and off hours. The current time can be passed in to
+# get the trading hours for another moment, it defaults to now.
+def generate_trading_hours(current_time=None):
+    specific_times = ["09:30", "10:30", "11:30", "12:30", "13:30", "14:30", "15:30", "16:30"]
+    start_time = time(9, 30)
+    end_time = time(16, 30)
+
+    if current_time is None:
+        current_time = datetime.now()
+    trading_hours = []
+
+    # Skip weekends
+    while current_time.weekday() >= 5:
+        current_time += timedelta(days=1)
+
+    # Generate the next 7 trading hours
+    while len(trading_hours) < 7:
+        if start_time <= current_time.time() <= end_time:
+            next_time = find_next_time(current_time, specific_times)
+            trading_hours.append(next_time.strftime('%Y-%m-%d %H:%M:%S'))
+            current_time = next_time
+        else:
+            # Move to the next trading day
+            if current_time.time() > end_time:
+                current_time = datetime.combine(current_time.date() + timedelta(days=1), start_time)
+            else:
+                current_time = datetime.combine(current_time.date(), start_time)
+
+    return trading_hours
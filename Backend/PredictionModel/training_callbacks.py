@@ -0,0 +1,69 @@
+import time
+from keras import callbacks
+import timing
+import training_log
+from training_profiles import BASE_LEARNING_RATE
+
+# Keras callback that records how long each training epoch of the model took
+class EpochTimer(callbacks.Callback):
+    def __init__(self, model_name):
+        super().__init__()
+        self.model_name = model_name
+        self.epoch_start = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        timing.record_epoch(self.model_name, time.perf_counter() - self.epoch_start)
+
+# Keras callback that logs the loss, validation loss and estimated time left after every epoch through the training
+# logger, which replaces the verbose output fit used to print to stdout
+class ProgressLogger(callbacks.Callback):
+    def __init__(self, model_name):
+        super().__init__()
+        self.model_name = model_name
+        self.epochs = None
+        self.train_start = None
+        self.epoch_start = None
+
+    def on_train_begin(self, logs=None):
+        self.epochs = self.params.get("epochs")
+        self.train_start = time.perf_counter()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        now = time.perf_counter()
+        epoch_seconds = now - self.epoch_start
+        eta_seconds = (now - self.train_start) / (epoch + 1) * (self.epochs - epoch - 1)
+
+        event = {
+            "type": "epoch",
+            "model": self.model_name,
+            "epoch": epoch + 1,
+            "epochs": self.epochs,
+            "loss": logs.get("loss"),
+            "val_loss": logs.get("val_loss"),
+            "epoch_seconds": epoch_seconds,
+            "eta_seconds": eta_seconds,
+        }
+        message = f"{self.model_name} epoch {epoch + 1}/{self.epochs} - {epoch_seconds:.1f}s"
+        for name, value in logs.items():
+            message += f" - {name}: {value:.4f}"
+        message += f" - eta: {eta_seconds:.0f}s"
+
+        training_log.logger.info(message, extra={"event": event})
+
+# Callbacks used while fitting the model with the training profile, early stopping restores the weights of the epoch
+# with the best val_loss
+def fit_callbacks(model_name, profile):
+    model_callbacks = [EpochTimer(model_name), ProgressLogger(model_name)]
+    if profile["early_stopping_patience"]:
+        model_callbacks.append(callbacks.EarlyStopping(monitor='val_loss', patience=profile["early_stopping_patience"], restore_best_weights=True))
+    if profile["reduce_lr_patience"]:
+        model_callbacks.append(callbacks.ReduceLROnPlateau(monitor='val_loss', factor=profile["reduce_lr_factor"], patience=profile["reduce_lr_patience"],
+                                                           min_lr=BASE_LEARNING_RATE / 100))
+    return model_callbacks
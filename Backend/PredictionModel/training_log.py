@@ -0,0 +1,57 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+# Logger the training progress is written to, records that carry an event are also routed to the run's TrainingLog
+logger = logging.getLogger('profitpulse.training')
+logger.setLevel(logging.INFO)
+
+# TrainingLog of the run on the current thread, set by capture()
+local = threading.local()
+
+# Progress events of a single training run. The events are appended to the sink, which can be a plain list or a
+# multiprocessing manager list when the run happens within a worker process and is streamed from the web process.
+class TrainingLog:
+    def __init__(self, sink=None):
+        self.events = sink if sink is not None else []
+
+    def emit(self, event):
+        event = dict(event, time=time.time())
+        self.events.append(event)
+
+    # Text of every event message, this replaces the captured stdout that used to be returned as console_output
+    def text(self):
+        return "\n".join(event["message"] for event in list(self.events) if "message" in event)
+
+# Logging handler that routes records with an event to the TrainingLog of the thread that logged them, so concurrent
+# runs on different threads never see each other's progress
+class RunLogHandler(logging.Handler):
+    def emit(self, record):
+        training_log = getattr(local, "training_log", None)
+        if training_log is None:
+            return
+
+        event = dict(getattr(record, "event", None) or {"type": "log"})
+        event["message"] = record.getMessage()
+        training_log.emit(event)
+
+logger.addHandler(RunLogHandler())
+
+# Routes the training progress logged on this thread within the block to the training log
+@contextmanager
+def capture(training_log):
+    previous = getattr(local, "training_log", None)
+    local.training_log = training_log
+    try:
+        yield training_log
+    finally:
+        local.training_log = previous
+
+# TrainingLog of the run on this thread, handed to worker threads so they log to the same run
+def current():
+    return getattr(local, "training_log", None)
+
+# Logs a pipeline stage change with the fraction of the run that is done
+def log_stage(stage, fraction):
+    logger.info(f"Stage: {stage}", extra={"event": {"type": "stage", "stage": stage, "fraction": fraction}})
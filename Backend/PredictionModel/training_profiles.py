@@ -0,0 +1,88 @@
+import os
+import math
+
+# Batch size and learning rate the models were originally tuned with, larger batches scale the learning rate from these
+BASE_BATCH_SIZE = 3
+BASE_LEARNING_RATE = 0.0001
+
+# Training profiles trading accuracy against time. Epochs are the most each model may run, early stopping ends training
+# once val_loss stops improving for early_stopping_patience epochs and the learning rate is reduced by reduce_lr_factor
+# after reduce_lr_patience epochs without improvement. "full" keeps the original batch size and epochs without stopping.
+TRAINING_PROFILES = {
+    "fast": {"batch_size": 64, "epochs": {"lstm": 15, "transformer": 20}, "early_stopping_patience": 3, "reduce_lr_patience": 2, "reduce_lr_factor": 0.5},
+    "balanced": {"batch_size": 32, "epochs": {"lstm": 25, "transformer": 40}, "early_stopping_patience": 5, "reduce_lr_patience": 3, "reduce_lr_factor": 0.5},
+    "full": {"batch_size": BASE_BATCH_SIZE, "epochs": {"lstm": 25, "transformer": 40}, "early_stopping_patience": None, "reduce_lr_patience": None, "reduce_lr_factor": 0.5},
+}
+
+# Profile used when none is requested, can be changed with the PROFITPULSE_TRAINING_PROFILE environment variable
+DEFAULT_PROFILE = os.environ.get('PROFITPULSE_TRAINING_PROFILE', 'balanced')
+
+# Incremental fine tuning settings. The windows with new bars are mixed with replay_ratio times as many older windows
+# (at least min_replay) so the model does not forget the older history, and trained for a few epochs at a reduced
+# learning rate. When the validation loss on the newest windows ends above drift_threshold times the validation loss of
+# the last full training run, the fine tuned model is discarded and the ticker is fully retrained.
+FINE_TUNING = {"epochs": 3, "replay_ratio": 1.0, "min_replay": 64, "learning_rate_factor": 0.1, "drift_threshold": 1.5, "validation_split": 0.2}
+
+# Share of the training windows held out for validation, the trailing windows like Keras' validation_split
+VALIDATION_SPLIT = 0.2
+
+# Training windows that would take more than this many megabytes once copied into a tensor are streamed batch by batch
+# instead, so the strided windows over a long memory mapped history are never copied as a whole. Can be changed with the
+# PROFITPULSE_STREAM_DATASET_MB environment variable.
+STREAM_DATASET_BYTES = int(os.environ.get('PROFITPULSE_STREAM_DATASET_MB', 256)) * 1024 * 1024
+
+# Returns the name and settings of the profile, falling back to the default profile for unknown or missing names
+def get_profile(name=None):
+    name = name or DEFAULT_PROFILE
+    if name not in TRAINING_PROFILES:
+        print(f"Unknown training profile {name}, using {DEFAULT_PROFILE}")
+        name = DEFAULT_PROFILE
+    return name, TRAINING_PROFILES[name]
+
+# Learning rate for the profile's batch size, scaled with the square root of the batch size increase which suits Adam
+def scaled_learning_rate(profile):
+    return BASE_LEARNING_RATE * math.sqrt(profile["batch_size"] / BASE_BATCH_SIZE)
+
+# Pipeline that copies only one batch of windows at a time out of the window views, in a new random order every epoch
+# when shuffled
+def streamed_dataset(X, y, batch_size, shuffle):
+    import numpy as np
+    import tensorflow as tf
+
+    def batches():
+        order = np.random.default_rng().permutation(X.shape[0]) if shuffle else np.arange(X.shape[0])
+        for batch_start in range(0, X.shape[0], batch_size):
+            # Sorted rows read the memory mapped history front to back within the batch
+            rows = np.sort(order[batch_start:batch_start + batch_size])
+            yield X[rows], y[rows]
+
+    signature = (tf.TensorSpec((None,) + X.shape[1:], X.dtype), tf.TensorSpec((None,) + y.shape[1:], y.dtype))
+    dataset = tf.data.Dataset.from_generator(batches, output_signature=signature)
+    return dataset.apply(tf.data.experimental.assert_cardinality(math.ceil(X.shape[0] / batch_size))).prefetch(tf.data.AUTOTUNE)
+
+# Builds the shuffled and prefetched training pipeline and the validation pipeline from the training windows
+def make_datasets(X_train, y_train, batch_size, validation_split=VALIDATION_SPLIT):
+    import tensorflow as tf
+
+    split = X_train.shape[0] - int(X_train.shape[0] * validation_split)
+
+    if X_train.nbytes > STREAM_DATASET_BYTES:
+        return streamed_dataset(X_train[:split], y_train[:split], batch_size, True), streamed_dataset(X_train[split:], y_train[split:], batch_size, False)
+
+    train_dataset = tf.data.Dataset.from_tensor_slices((X_train[:split], y_train[:split]))
+    train_dataset = train_dataset.shuffle(split, reshuffle_each_iteration=True).batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+    validation_dataset = tf.data.Dataset.from_tensor_slices((X_train[split:], y_train[split:]))
+    validation_dataset = validation_dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+    return train_dataset, validation_dataset
+
+# Profile settings recorded within avg_metrics so stored metrics show how the model was trained
+def profile_metrics(profile_name, profile, model_name, epochs_run):
+    return {
+        "training_profile": profile_name,
+        "epochs_run": epochs_run,
+        "max_epochs": profile["epochs"][model_name],
+        "batch_size": profile["batch_size"],
+        "learning_rate": scaled_learning_rate(profile),
+    }
@@ -1,8 +1,32 @@
 from keras import layers, models, metrics, optimizers, losses, regularizers
+import timing
+from training_callbacks import fit_callbacks
+from training_profiles import get_profile, scaled_learning_rate, make_datasets, profile_metrics
+
+# Attention and feed forward layers of the transformer applied to its inputs, shared with the global model which feeds
+# them the windows of every ticker
+def transformer_outputs(inputs):
+    # Attention layer that uses normalization during training, with having the inputs and set to the heads with
+    # dropout of 10%
+    attention_output = layers.MultiHeadAttention(num_heads = 2, key_dim= 2)(inputs, inputs)
+
+    # Creating the feed forward layer that uses the previous attention layer to create two dense layers with 64
+    # neurons that has one relu activation as it helps with the complex inputs and outputs as they are not
+    # linear
+    feedforward_output = layers.Dense(units = 256)(attention_output)
+    feedforward_output = layers.Dropout(0.2)(feedforward_output)
+    feedforward_output = layers.Dense(units = 128)(feedforward_output)
+
+    # Variable to have a global average pooling that normalizes all the data and gathers the average and stores
+    # the data into a 1D array
+    global_avg_output = layers.GlobalAveragePooling1D()(feedforward_output)
+
+    # Output dense layer that outputs 7 numbers which are the next 7 hours
+    return layers.Dense(7)(global_avg_output)
 
 # Transformer model class that will handle the preparing, building, training, and running the model. 
 class TransformerModel:
-    def __init__(self, X_train, X_test, y_train, y_test, backcandles):
+    def __init__(self, X_train, X_test, y_train, y_test, backcandles, profile=None):
         self.X_train = X_train
         self.X_test = X_test
         self.y_train = y_train
@@ -31,6 +55,7 @@ class TransformerModel:
         self.avg_train_r2 = None
         self.avg_val_r2 = None
         self.avg_metrics = {}
+        self.profile_name, self.profile = get_profile(profile)
 
 
 
@@ -40,34 +65,17 @@ class TransformerModel:
     def build_model(self):
         try:
 
-            features = ['Open', 'High', 'Low']
-            input_shape = (self.backcandles, len(features))
+            input_shape = (self.backcandles, self.X_train.shape[-1])
 
             # Creating a variable to have the input for the model to be all the features and the amount of backcandles.
             inputs = layers.Input(shape = input_shape)
 
-            # Attention layer that uses normalization during training, with having the inputs and set to the heads with
-            # dropout of 10%
-            attention_output = layers.MultiHeadAttention(num_heads = 2, key_dim= 2)(inputs, inputs)
-
-            # Creating the feed forward layer that uses the previous attention layer to create two dense layers with 64
-            # neurons that has one relu activation as it helps with the complex inputs and outputs as they are not
-            # linear
-            feedforward_output = layers.Dense(units = 256)(attention_output)
-            feedforward_output = layers.Dropout(0.2)(feedforward_output)
-            feedforward_output = layers.Dense(units = 128)(feedforward_output)
-            
-            # Variable to have a global average pooling that normalizes all the data and gathers the average and stores
-            # the data into a 1D array
-            global_avg_output = layers.GlobalAveragePooling1D()(feedforward_output)
-
-            # Output dense layer that outputs 7 numbers which are the next 7 hours
-            outputs = layers.Dense(7)(global_avg_output)
-            optimizer = optimizers.Adam(learning_rate = 0.0001)
+            outputs = transformer_outputs(inputs)
+            optimizer = optimizers.Adam(learning_rate = scaled_learning_rate(self.profile))
 
             # Sets the class object model variable to this model and compiles it 
             self.model = models.Model(inputs = inputs, outputs = outputs)
-            self.model.compile(optimizer = optimizer, loss = losses.MeanSquaredError(), metrics=[metrics.MeanAbsoluteError(), metrics.RootMeanSquaredError(), metrics.R2Score])
+            self.model.compile(optimizer = optimizer, loss = losses.MeanSquaredError(), metrics=[metrics.MeanAbsoluteError(), metrics.RootMeanSquaredError(), metrics.R2Score()])
 
         # Exceptions
         except ValueError as valueError:
@@ -88,30 +96,11 @@ class TransformerModel:
         # Train model allows the model to begin working with 20% validation.
     def train_model(self):
         try:
-            self.history = self.model.fit(self.X_train, self.y_train, batch_size = 3, epochs = 40, validation_split = 0.2, verbose=2)
-            self.train_loss = self.history.history['loss']
-            self.val_loss = self.history.history['val_loss']
-            self.train_mae = self.history.history['mean_absolute_error']
-            self.val_mae = self.history.history['val_mean_absolute_error']
-            self.train_rmse = self.history.history['root_mean_squared_error']
-            self.val_rmse = self.history.history['val_root_mean_squared_error']
-            self.train_r2 = self.history.history['r2_score']
-            self.val_r2 = self.history.history['val_r2_score']
-
-            # Calculate averages for each metric
-            self.avg_train_loss = sum(self.train_loss) / len(self.train_loss)
-            self.avg_val_loss = sum(self.val_loss) / len(self.val_loss)
-            self.avg_train_mae = sum(self.train_mae) / len(self.train_mae)
-            self.avg_val_mae = sum(self.val_mae) / len(self.val_mae)
-            self.avg_train_rmse = sum(self.train_rmse) / len(self.train_rmse)
-            self.avg_val_rmse = sum(self.val_rmse) / len(self.val_rmse)
-            self.avg_train_r2 = sum(self.train_r2) / len(self.train_r2)
-            self.avg_val_r2 = sum(self.val_r2) / len(self.val_r2)
-
-            self.avg_metrics = {"avg_train_loss": self.avg_train_loss, "avg_val_loss": self.avg_val_loss,
-                "avg_train_mae": self.avg_train_mae, "avg_val_mae": self.avg_val_mae,
-                "avg_train_rmse": self.avg_train_rmse, "avg_val_rmse": self.avg_val_rmse,
-                "avg_train_r2": self.avg_train_r2, "avg_val_r2": self.avg_val_r2}
+            # The windows are fed through a prefetched tf.data pipeline with the profile's batch size, early stopping and
+            # learning rate reduction on val_loss
+            train_dataset, validation_dataset = make_datasets(self.X_train, self.y_train, self.profile["batch_size"])
+            self.history = self.model.fit(train_dataset, validation_data = validation_dataset, epochs = self.profile["epochs"]["transformer"], verbose=0, callbacks = fit_callbacks("transformer", self.profile))
+            self.record_metrics()
         
         # Exceptions
         except ValueError as valueError:
@@ -127,6 +116,56 @@ class TransformerModel:
         
 
 
+    # Stores every metric of the fit history and their averages over the epochs that ran
+    def record_metrics(self):
+        self.train_loss = self.history.history['loss']
+        self.val_loss = self.history.history['val_loss']
+        self.train_mae = self.history.history['mean_absolute_error']
+        self.val_mae = self.history.history['val_mean_absolute_error']
+        self.train_rmse = self.history.history['root_mean_squared_error']
+        self.val_rmse = self.history.history['val_root_mean_squared_error']
+        self.train_r2 = self.history.history['r2_score']
+        self.val_r2 = self.history.history['val_r2_score']
+
+        # Calculate averages for each metric
+        self.avg_train_loss = sum(self.train_loss) / len(self.train_loss)
+        self.avg_val_loss = sum(self.val_loss) / len(self.val_loss)
+        self.avg_train_mae = sum(self.train_mae) / len(self.train_mae)
+        self.avg_val_mae = sum(self.val_mae) / len(self.val_mae)
+        self.avg_train_rmse = sum(self.train_rmse) / len(self.train_rmse)
+        self.avg_val_rmse = sum(self.val_rmse) / len(self.val_rmse)
+        self.avg_train_r2 = sum(self.train_r2) / len(self.train_r2)
+        self.avg_val_r2 = sum(self.val_r2) / len(self.val_r2)
+
+        self.avg_metrics = {"avg_train_loss": self.avg_train_loss, "avg_val_loss": self.avg_val_loss,
+            "avg_train_mae": self.avg_train_mae, "avg_val_mae": self.avg_val_mae,
+            "avg_train_rmse": self.avg_train_rmse, "avg_val_rmse": self.avg_val_rmse,
+            "avg_train_r2": self.avg_train_r2, "avg_val_r2": self.avg_val_r2}
+
+        # The averages above are over the epochs that actually ran, which early stopping can cut short
+        self.avg_metrics.update(profile_metrics(self.profile_name, self.profile, "transformer", len(self.train_loss)))
+
+    # Fine tunes the already trained model on X_train, which holds the windows with new bars plus replayed older windows,
+    # validating on X_val. It starts from the trained weights with a reduced learning rate and runs a few epochs.
+    def fine_tune_model(self, X_val, y_val, epochs, learning_rate):
+        try:
+            self.model.compile(optimizer = optimizers.Adam(learning_rate = learning_rate), loss = losses.MeanSquaredError(), metrics = [metrics.MeanAbsoluteError(), metrics.RootMeanSquaredError(), metrics.R2Score()])
+            self.history = self.model.fit(self.X_train, self.y_train, validation_data = (X_val, y_val), batch_size = self.profile["batch_size"], epochs = epochs, verbose = 0, callbacks = fit_callbacks("transformer", self.profile))
+            self.record_metrics()
+            self.avg_metrics["max_epochs"] = epochs
+            self.avg_metrics["learning_rate"] = learning_rate
+            self.avg_metrics["fine_tuned"] = True
+
+        # Exceptions
+        except ValueError as valueError:
+            print(f"Value error in fine tuning transformer model: {valueError}")
+        except RuntimeError as runtimeError:
+            print(f"Runtime error in fine tuning transformer model: {runtimeError}")
+        except Exception as exception:
+            print(f"Unexpected error in fine tuning transformer model: {exception}")
+
     def run_model(self):
-        self.build_model()
-        self.train_model()
\ No newline at end of file
+        with timing.span("transformer.build"):
+            self.build_model()
+        with timing.span("transformer.fit"):
+            self.train_model()
\ No newline at end of file
@@ -1,13 +1,44 @@
-from flask import Flask, send_from_directory, jsonify, request
+from flask import Flask, Response, g, send_from_directory, jsonify, request, stream_with_context
 from flask_cors import CORS
 import os
-import io
 import sys
 import json
+import time
+import functools
+import threading
+
+app_import_start = time.perf_counter()
 
 # Set system path for the backend file to get the models
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../PredictionModel')))
-import predict_model
+from model_registry import ModelRegistry, GLOBAL_KEY, not_trained_error
+from jobs import JobQueue, QueueFull, DONE, FAILED
+from batch import BatchPredictor, clean_symbols
+from prediction_cache import PredictionCache
+from prediction_store import PredictionStore
+from market_data import MarketDataCache, ALPHA_VANTAGE_KEY, MARKET_DATA_DISABLED, INTRADAY_SLOTS, daily_window, intraday_window, last_market_day
+from scheduler import DEFAULT_WATCHLIST, PrecomputeScheduler, bar_fingerprint
+from inference_server import InferenceDispatcher, InferenceQueueFull
+from admin_auth import AdminAuth, AdminAuthError
+import timing
+from training_log import TrainingLog, capture
+
+# The machine learning stack (TensorFlow, Keras, scikit-learn, pandas and yfinance) is only imported on the first
+# prediction, so the server starts quickly and serves the React app without holding those libraries in every worker.
+# TensorFlow and Keras are only imported once a model has to be trained, or with PROFITPULSE_INFERENCE=keras.
+predict_model = None
+ml_stack_lock = threading.Lock()
+
+def load_predict_model():
+    global predict_model
+    if predict_model is None:
+        with ml_stack_lock:
+            if predict_model is None:
+                start = time.perf_counter()
+                import predict_model as module
+                timing.metrics.set_gauge("profitpulse_ml_import_seconds", time.perf_counter() - start)
+                predict_model = module
+    return predict_model
 
 # Adjust the path to the static folder based on the main directory on Render
 static_folder_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../Frontend/profitpulsex/dist'))
@@ -16,6 +47,64 @@ static_folder_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..
 app = Flask(__name__, static_url_path='', static_folder=static_folder_path)
 CORS(app)
 
+# Registry of trained models per ticker, the hot models stay loaded in memory between requests
+model_registry = ModelRegistry()
+
+# Bounded pool of training workers, the size and the queue limit can be tuned through environment variables when hosting
+job_queue = JobQueue(model_registry.root, max_workers=int(os.environ.get('PROFITPULSE_TRAINING_WORKERS', 0)) or None,
+                     max_pending=int(os.environ.get('PROFITPULSE_MAX_PENDING_JOBS', 16)))
+
+# Pool of prediction workers for batch requests, started on the first batch and sized to the machine's cores
+batch_predictor = BatchPredictor(model_registry.root, max_workers=int(os.environ.get('PROFITPULSE_BATCH_WORKERS', 0)) or None)
+MAX_BATCH_SYMBOLS = 100
+
+# Seconds between checks for new progress events while streaming a job
+SSE_POLL_INTERVAL = 0.5
+SSE_KEEP_ALIVE = 15
+
+# Predictions cached until the next trading hour slot, bounded with LRU eviction
+prediction_cache = PredictionCache(max_entries=int(os.environ.get('PROFITPULSE_PREDICTION_CACHE_SIZE', 256)))
+
+# History of the stored prediction runs, upserted per predicted hour so storing and reading never touch the whole history
+prediction_store = PredictionStore()
+
+# Shared cache of the Alpha Vantage series the charts show, the hot series are refreshed in the background every
+# PROFITPULSE_MARKET_REFRESH seconds once the first chart has been requested. Without an Alpha Vantage key there is no
+# cache and the market endpoints answer 503 saying how to enable it.
+market_data_cache = MarketDataCache() if ALPHA_VANTAGE_KEY else None
+MARKET_REFRESH_INTERVAL = int(os.environ.get('PROFITPULSE_MARKET_REFRESH', 60))
+
+# Batches the global model's forward passes of concurrent /api/predict requests for different tickers, up to
+# PROFITPULSE_INFERENCE_MAX_BATCH windows gathered within PROFITPULSE_INFERENCE_MAX_WAIT_MS, and turns requests away once
+# PROFITPULSE_INFERENCE_MAX_QUEUE wait
+inference_dispatcher = InferenceDispatcher()
+
+# Checks the bearer token of the requests that write or delete the shared prediction history
+admin_auth = AdminAuth()
+
+# Precomputed predictions are cached like the ones /api/predict computes, so the first request after a bar closes is a hit
+def cache_precomputed(symbol, preds):
+    key = prediction_cache.key(symbol, preds[symbol].get("model_version"))
+    prediction_cache.get_or_compute(key, lambda: (preds, ""))
+
+# Precomputes the PROFITPULSE_WATCHLIST tickers before the open and after every hourly bar closes over the batch worker
+# pool. Every app process runs its own scheduler, so with a watchlist the app should be served by a single process.
+precompute_scheduler = PrecomputeScheduler(DEFAULT_WATCHLIST, batch_predictor.predict, prediction_store, bar_fingerprint(model_registry),
+                                           on_result=cache_precomputed)
+if precompute_scheduler.watchlist:
+    precompute_scheduler.start()
+
+# Time every API request so the latency of each endpoint shows up within /metrics
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    if request.path.startswith('/api/') and 'request_start' in g:
+        timing.metrics.observe("profitpulse_request_seconds", "endpoint", request.endpoint or "unknown", time.perf_counter() - g.request_start)
+    return response
+
 # Serve the React app by setting the proper default path and returning the proper directory that is required by
 # the React frontend
 @app.route('/', defaults={'path': ''})
@@ -37,27 +126,26 @@ def ignore_favicon():
 def not_found(e):
     return send_from_directory(app.static_folder, 'index.html')
 
-@app.route('/api/predict', methods = ['GET'])
-def predict():
-    symbol = request.args.get('symbol')
-
-    if not symbol:
-        return jsonify("Error: symbol not found!")
-    
-    console_output = io.StringIO()
-    sys.stdout = console_output
-
-    try:
-        prediction_model = predict_model.PredictionModel(symbol)
-        prediction_model.build_train_predict_model()
-        preds_json = prediction_model.prediction_to_json()
-        preds = json.loads(preds_json)
+# Only admins may write or delete the shared prediction history. The dashboard sends the signed in user's Firebase ID
+# token as a bearer token, scripts can send PROFITPULSE_ADMIN_TOKEN instead.
+def admin_required(view):
+    @functools.wraps(view)
+    def checked(*args, **kwargs):
+        try:
+            g.admin = admin_auth.verify(request.headers.get('Authorization'))
+        except AdminAuthError as adminAuthError:
+            return jsonify({"Error": str(adminAuthError)}), adminAuthError.status
+        return view(*args, **kwargs)
+    return checked
 
-        console_output = console_output.getvalue()
-        print(console_output)
-    finally:
-        sys.stdout = sys.__stdout__
+# Symbol of the request from the query string or the JSON body, upper cased once so the cache key, the model and the
+# predictions it returns are all keyed the same way however the symbol was typed
+def request_symbol(body=None):
+    symbol = request.args.get('symbol') or (body or {}).get('symbol') or ''
+    return str(symbol).strip().upper()
 
+# Builds the JSON response for a prediction, keeping the same keys the frontend reads
+def prediction_response(symbol, preds, console_output):
     return jsonify({
         "symbol": symbol,
         "time": preds[symbol]["time"],
@@ -68,5 +156,348 @@ def predict():
         "predictions_average": preds[symbol]["predictions_average"],
         "daily_average": preds[symbol]["daily_average"],
         "date": preds[symbol]["date"],
+        "model_version": preds[symbol].get("model_version"),
+        "timings": preds[symbol].get("timings"),
         "console_output": console_output
-    })
\ No newline at end of file
+    })
+
+# Serves predictions from the registered models with a single forward pass. Training is the separate POST /api/train
+# action, so a ticker whose model went missing answers with an error instead of training within the request.
+def run_prediction(symbol):
+    # The log of this request is captured through the training logger instead of redirecting stdout, so concurrent
+    # requests each get their own console output
+    with capture(TrainingLog()) as run_log:
+        prediction_model = load_predict_model().PredictionModel(symbol)
+        if not prediction_model.predict_from_registry(model_registry, inference_dispatcher):
+            prediction_model.stock_predictions[symbol] = {"Error": not_trained_error(symbol)}
+        preds_json = prediction_model.prediction_to_json()
+        preds = json.loads(preds_json)
+        timing.metrics.observe_timings(preds[symbol].get("timings"))
+
+    return preds, run_log.text()
+
+# Predictions only change with the next trading hour or a new model version, so they are cached until then and
+# concurrent requests for the same symbol share one computation. A ticker without a model of its own is served by the
+# global model when that was trained on it, otherwise it answers with a 404 pointing at POST /api/train.
+@app.route('/api/predict', methods = ['GET'])
+def predict():
+    symbol = request_symbol()
+
+    if not symbol:
+        return jsonify("Error: symbol not found!")
+
+    model_key, version = model_registry.serving_model(symbol)
+    if version is None:
+        return jsonify({"Error": not_trained_error(symbol), "train": f"/api/train?symbol={symbol}"}), 404
+
+    # Predictions of the global model are cached apart from the ones of a model trained for the ticker later on
+    key = prediction_cache.key(symbol, f"global-{version}" if model_key == GLOBAL_KEY else version)
+    try:
+        preds, console_output = prediction_cache.get_or_compute(key, lambda: run_prediction(symbol),
+                                                                cacheable=lambda value: "Error" not in value[0][symbol])
+    except InferenceQueueFull as inferenceQueueFull:
+        return jsonify({"Error": str(inferenceQueueFull)}), 429, {"Retry-After": "1"}
+    if "Error" in preds[symbol]:
+        return jsonify({"symbol": symbol, "Error": preds[symbol]["Error"], "console_output": console_output}), 500
+
+    return prediction_response(symbol, preds, console_output)
+
+# Predicts a comma separated list of symbols across the batch worker pool and streams one JSON line per symbol as each
+# one completes, every line in the same format as PredictionModel.prediction_to_json. A symbol that fails, or that has
+# no trained model yet, gets a line with its error without stopping the batch.
+@app.route('/api/predict/batch', methods = ['GET'])
+def predict_batch():
+    symbols = clean_symbols(request.args.get('symbols', '').split(','))
+
+    if not symbols:
+        return jsonify({"Error": "symbols not found!"}), 400
+    if len(symbols) > MAX_BATCH_SYMBOLS:
+        return jsonify({"Error": f"at most {MAX_BATCH_SYMBOLS} symbols can be predicted at once"}), 400
+
+    def stream():
+        for predictions in batch_predictor.predict(symbols):
+            yield json.dumps(predictions) + "\n"
+
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson')
+
+# Hit, miss and coalesce counters of the prediction cache
+@app.route('/api/predict/stats', methods = ['GET'])
+def predict_stats():
+    return jsonify(prediction_cache.cache_stats())
+
+# Batch, queue and back-pressure counters of the inference dispatcher
+@app.route('/api/inference/stats', methods = ['GET'])
+def inference_stats():
+    return jsonify(inference_dispatcher.status())
+
+# Queues a job of the kind for the symbol of the request with the optional training profile and answers with its job id
+# straight away, the progress and the result are read through the /api/jobs endpoints. An identical job that has not
+# finished yet is returned instead of queueing a duplicate.
+def queue_job(kind, symbol, body):
+    if not symbol:
+        return jsonify({"Error": "symbol not found!"}), 400
+
+    try:
+        job, created = job_queue.submit(kind, symbol, request.args.get('profile') or body.get('profile'))
+    except QueueFull as queueFull:
+        return jsonify({"Error": str(queueFull)}), 429
+
+    return jsonify(dict(job_queue.status(job.id), created=created)), 202
+
+# Retrains both models for the symbol from scratch in a training worker and stores them as a new version within the
+# registry, the same job as POST /api/train without a mode
+@app.route('/api/retrain', methods = ['POST'])
+@admin_required
+def retrain():
+    body = request.get_json(silent=True) or {}
+    return queue_job('train', request_symbol(body), body)
+
+# Queues a training job for the symbol, the job retrains and registers new models in a worker process with the optional
+# training profile. With mode=incremental the registered models are fine tuned on the bars since they were trained
+# instead, falling back to a full retrain when needed.
+@app.route('/api/train', methods = ['POST'])
+@admin_required
+def train():
+    body = request.get_json(silent=True) or {}
+    kind = 'fine_tune' if (request.args.get('mode') or body.get('mode')) == 'incremental' else 'train'
+    return queue_job(kind, request_symbol(body), body)
+
+# Reports the status and progress of a job
+@app.route('/api/jobs/<job_id>', methods = ['GET'])
+def job_status(job_id):
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify({"Error": "job not found!"}), 404
+
+    return jsonify(status)
+
+# Returns the predictions of a finished job in the same format as /api/predict, or the summary of a backtest job
+@app.route('/api/jobs/<job_id>/result', methods = ['GET'])
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"Error": "job not found!"}), 404
+    if job.status == FAILED:
+        return jsonify({"Error": job.error, "status": job.status}), 500
+    if job.status != DONE:
+        return jsonify({"status": job.status}), 409
+
+    if job.kind == 'backtest':
+        return jsonify(dict(job.result[job.ticker], console_output=job_queue.console_output(job_id)))
+    return prediction_response(job.ticker, job.result, job_queue.console_output(job_id))
+
+# Streams the progress of a job as Server-Sent Events, one event per stage change and training epoch with the epoch,
+# loss, val_loss and estimated time left. A final "end" event carries the status once the job has finished.
+@app.route('/api/jobs/<job_id>/events', methods = ['GET'])
+def job_events(job_id):
+    if job_queue.get(job_id) is None:
+        return jsonify({"Error": "job not found!"}), 404
+
+    def stream():
+        cursor = 0
+        last_sent = time.monotonic()
+        while True:
+            job = job_queue.get(job_id)
+            if job is None:
+                return
+
+            # The status is read before the events so every event of a finished job is sent before the end event
+            finished = job.status in (DONE, FAILED)
+            events = job_queue.job_events(job_id, cursor) or []
+            for event in events:
+                yield f"data: {json.dumps(event)}\n\n"
+            cursor += len(events)
+
+            if finished:
+                yield f"event: end\ndata: {json.dumps(job_queue.status(job_id))}\n\n"
+                return
+
+            # Comment line that keeps proxies from closing a stream that has been idle for a while
+            if events:
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent > SSE_KEEP_ALIVE:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+            time.sleep(SSE_POLL_INTERVAL)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream', headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Stores a prediction run from the admin dashboard, with the keys /api/predict returns plus last_trained_metrics
+@app.route('/api/predictions', methods = ['POST'])
+@admin_required
+def store_predictions():
+    body = request.get_json(silent=True) or {}
+    symbol = body.get('symbol')
+
+    if not symbol:
+        return jsonify({"Error": "symbol not found!"}), 400
+
+    try:
+        stored = prediction_store.store(symbol, body)
+    except (KeyError, TypeError) as error:
+        return jsonify({"Error": f"invalid predictions: {error}"}), 400
+
+    return jsonify({"symbol": symbol.upper(), "stored": stored})
+
+# Hourly predictions of the symbol between from and to, which are yyyy-mm-dd dates or yyyy-mm-dd HH:MM:SS times
+@app.route('/api/predictions', methods = ['GET'])
+def get_predictions():
+    symbol = request.args.get('symbol')
+    if not symbol:
+        return jsonify({"Error": "symbol not found!"}), 400
+
+    return jsonify({
+        "symbol": symbol.upper(),
+        "predictions": prediction_store.predictions(symbol, request.args.get('from'), request.args.get('to'), request.args.get('limit', type=int)),
+    })
+
+# Daily averages of the symbol between the from and to dates
+@app.route('/api/predictions/daily', methods = ['GET'])
+def get_daily_averages():
+    symbol = request.args.get('symbol')
+    if not symbol:
+        return jsonify({"Error": "symbol not found!"}), 400
+
+    return jsonify({"symbol": symbol.upper(), "daily_average": prediction_store.daily_averages(symbol, request.args.get('from'), request.args.get('to'))})
+
+# Latest stored model metrics of the symbol for the admin dashboard, the ones the last stored prediction run reported
+@app.route('/api/predictions/metrics', methods = ['GET'])
+def get_prediction_metrics():
+    symbol = request.args.get('symbol')
+    if not symbol:
+        return jsonify({"Error": "symbol not found!"}), 400
+
+    metrics = prediction_store.metrics(symbol)
+    if metrics is None:
+        return jsonify({"Error": f"No stored predictions for {symbol.upper()}"}), 404
+    return jsonify(metrics)
+
+# Removes the hourly predictions older than the retention, or older than the given number of days
+@app.route('/api/predictions/compact', methods = ['POST'])
+@admin_required
+def compact_predictions():
+    return jsonify({"removed": prediction_store.compact(request.args.get('days', type=int))})
+
+# Builds a compact chart response that browsers and proxies can revalidate with If-None-Match, answering 304 when the
+# bars have not changed
+def market_data_response(payload):
+    response = jsonify(payload)
+    response.add_etag()
+    response.cache_control.public = True
+    response.cache_control.max_age = 60
+    return response.make_conditional(request)
+
+# Closes of the symbol at the half hour slots the prediction charts use, for the day given or the last market day
+@app.route('/api/market/intraday', methods = ['GET'])
+def market_intraday():
+    symbol = request.args.get('symbol')
+    if not symbol:
+        return jsonify({"Error": "symbol not found!"}), 400
+    if market_data_cache is None:
+        return jsonify({"Error": MARKET_DATA_DISABLED}), 503
+
+    market_data_cache.start(MARKET_REFRESH_INTERVAL)
+    try:
+        series_data, fetched_at = market_data_cache.get("intraday", symbol)
+    except Exception as exception:
+        return jsonify({"Error": f"Failed to fetch stock data for {symbol}: {exception}"}), 502
+
+    day = request.args.get('day') or last_market_day()
+    slots = request.args.get('slots').split(',') if request.args.get('slots') else INTRADAY_SLOTS
+    return market_data_response({"symbol": symbol.upper(), "day": day, "fetched_at": fetched_at, "bars": intraday_window(series_data, day, slots)})
+
+# Closes of the symbol's last days, newest first
+@app.route('/api/market/daily', methods = ['GET'])
+def market_daily():
+    symbol = request.args.get('symbol')
+    if not symbol:
+        return jsonify({"Error": "symbol not found!"}), 400
+    if market_data_cache is None:
+        return jsonify({"Error": MARKET_DATA_DISABLED}), 503
+
+    market_data_cache.start(MARKET_REFRESH_INTERVAL)
+    try:
+        series_data, fetched_at = market_data_cache.get("daily", symbol)
+    except Exception as exception:
+        return jsonify({"Error": f"Failed to fetch stock data for {symbol}: {exception}"}), 502
+
+    return market_data_response({"symbol": symbol.upper(), "fetched_at": fetched_at, "bars": daily_window(series_data, request.args.get('days', 7, type=int))})
+
+# Hits, coalesced upstream requests and background refreshes of the market data cache
+@app.route('/api/market/stats', methods = ['GET'])
+def market_stats():
+    if market_data_cache is None:
+        return jsonify({"Error": MARKET_DATA_DISABLED}), 503
+    return jsonify(market_data_cache.cache_stats())
+
+# The precomputation schedule of the current day, the next run and the latency of the last run
+@app.route('/api/schedule', methods = ['GET'])
+def schedule_status():
+    return jsonify(precompute_scheduler.status())
+
+# Precomputes the watchlist straight away in the background instead of waiting for the next scheduled run
+@app.route('/api/schedule/run', methods = ['POST'])
+@admin_required
+def schedule_run():
+    if not precompute_scheduler.watchlist:
+        return jsonify({"Error": "no watchlist configured!"}), 400
+    if precompute_scheduler.running:
+        return jsonify({"Error": "a precomputation is already running!"}), 409
+
+    threading.Thread(target=precompute_scheduler.run, name="precompute-manual", daemon=True).start()
+    return jsonify(precompute_scheduler.status()), 202
+
+# Queues a walk forward backtest of the symbol with the optional training profile, the summary is the job's result
+@app.route('/api/backtest', methods = ['POST'])
+@admin_required
+def run_backtest():
+    body = request.get_json(silent=True) or {}
+    return queue_job('backtest', request_symbol(body), body)
+
+# Per horizon error and directional hit rate of the symbol's last stored backtest for the admin dashboard
+@app.route('/api/backtest', methods = ['GET'])
+def backtest_summary():
+    symbol = request.args.get('symbol')
+    if not symbol:
+        return jsonify({"Error": "symbol not found!"}), 400
+
+    import backtest
+    summary = backtest.LoadSummary(symbol)
+    if summary is None:
+        return jsonify({"Error": "no backtest found!"}), 404
+
+    return jsonify(summary)
+
+# Cold and warm hit statistics of the bar cache that sits in front of the market data downloads
+@app.route('/api/data/stats', methods = ['GET'])
+def data_stats():
+    import stock_api
+    return jsonify(stock_api.CacheStats())
+
+# Stage latency histograms, epoch fit times and peak memory in the Prometheus text format
+@app.route('/metrics', methods = ['GET'])
+def metrics():
+    return Response(timing.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Start up time, memory and whether the machine learning stack has been loaded in this worker
+@app.route('/api/health', methods = ['GET'])
+def health():
+    return jsonify({
+        "pid": os.getpid(),
+        "ml_stack_loaded": predict_model is not None,
+        "startup_seconds": startup_seconds,
+        "rss_bytes": timing.current_rss_bytes(),
+        "peak_rss_bytes": timing.peak_rss_bytes(),
+    })
+
+# With PROFITPULSE_PRELOAD set, the machine learning stack is imported and the model graphs are built once while the
+# app module loads. Under a preforking server started with preloading (for example gunicorn --preload) this happens
+# in the parent, so every forked worker starts warm and shares those pages copy on write.
+if os.environ.get('PROFITPULSE_PRELOAD'):
+    load_predict_model().warmup()
+
+# Seconds from process start until the app was ready to serve, from the module import when /proc is not available
+startup_seconds = timing.process_age_seconds()
+if startup_seconds is None:
+    startup_seconds = time.perf_counter() - app_import_start
+timing.metrics.set_gauge("profitpulse_startup_seconds", startup_seconds)
@@ -0,0 +1,303 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import importlib.metadata
+import tempfile
+import tracemalloc
+from datetime import datetime
+import numpy as np
+
+# The suite runs offline on the CPU, so TensorFlow is kept off any GPU and every store the pipeline writes to is moved
+# into a scratch directory before the backend modules read their locations
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+WORKSPACE = tempfile.mkdtemp(prefix='profitpulse-bench-')
+os.environ['PROFITPULSE_DATA_DIR'] = os.path.join(WORKSPACE, 'bar_cache')
+os.environ['PROFITPULSE_MODEL_DIR'] = os.path.join(WORKSPACE, 'saved_models')
+os.environ['PROFITPULSE_HISTORY_DIR'] = os.path.join(WORKSPACE, 'history')
+os.environ['PROFITPULSE_PREDICTION_DB'] = os.path.join(WORKSPACE, 'predictions.db')
+os.environ['PROFITPULSE_WATCHLIST'] = ''
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHMARK_DIR, '../PredictionModel'))
+sys.path.append(os.path.join(BENCHMARK_DIR, '../WebApp'))
+
+from synthetic_data import DEFAULT_ROWS, SyntheticSource, synthetic_bars
+
+# Baseline compared against and written to when no path is given
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baselines', 'baseline.json')
+
+# A case regresses when a metric grows by more than the tolerance over its baseline, latencies below the noise floor
+# are never flagged since scheduler jitter alone moves them by more than the tolerance
+DEFAULT_TOLERANCE = 0.25
+LATENCY_NOISE_FLOOR = 0.001
+COMPARED_METRICS = ("p50_seconds", "p99_seconds", "peak_traced_bytes")
+
+# Times repeat calls of fn after warmup untimed calls, then makes one more call under tracemalloc for the peak memory it
+# allocates. items is how many windows, calls or requests a single call handles, for the throughput.
+def measure(fn, repeat, warmup=1, items=1):
+    for _ in range(warmup):
+        fn()
+
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak_traced = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    import timing
+    p50, p99 = np.percentile(latencies, [50, 99])
+    return {
+        "repeat": repeat,
+        "items": items,
+        "mean_seconds": float(np.mean(latencies)),
+        "p50_seconds": float(p50),
+        "p99_seconds": float(p99),
+        "throughput_per_second": items / float(np.mean(latencies)),
+        "peak_traced_bytes": int(peak_traced),
+        "peak_rss_bytes": timing.peak_rss_bytes(),
+    }
+
+# Registers a training profile that fits the given number of epochs without early stopping, so the fit and the end to
+# end cases do the same work on every run
+def benchmark_profile(epochs):
+    import training_profiles
+
+    training_profiles.TRAINING_PROFILES["benchmark"] = dict(training_profiles.TRAINING_PROFILES["fast"], epochs={"lstm": epochs, "transformer": epochs},
+                                                            early_stopping_patience=None, reduce_lr_patience=None)
+    training_profiles.DEFAULT_PROFILE = "benchmark"
+    return "benchmark"
+
+# ProcessData scaling and windowing of the whole synthetic history
+def bench_process_data(settings):
+    import preprocessing
+
+    data = synthetic_bars(settings.rows, settings.seed, multi_index=False)
+    windows = data.shape[0] - 21 - 7
+    return {"process_data": measure(lambda: preprocessing.ProcessData(data.copy()), settings.repeat, items=windows)}
+
+def bench_trading_hours(settings):
+    from trading_hours import generate_trading_hours
+
+    current_time = datetime(2024, 12, 31, 11, 45)
+    return {"generate_trading_hours": measure(lambda: generate_trading_hours(current_time), settings.repeat * 100)}
+
+# Serializing the predictions of a ticker the way every /api/predict response does
+def bench_serialize(settings):
+    from sklearn.preprocessing import StandardScaler
+    from predict_model import PredictionModel
+
+    rng = np.random.default_rng(settings.seed)
+    prediction_model = PredictionModel("SYN")
+    target_scaler = StandardScaler().fit(rng.normal(100.0, 5.0, (100, 1)))
+    metrics = {"avg_val_loss": 0.1, "avg_val_mae": 0.2}
+    prediction_model.store_predictions(rng.normal(size=7), rng.normal(size=7), target_scaler, metrics, metrics)
+    return {"prediction_to_json": measure(prediction_model.prediction_to_json, settings.repeat * 100)}
+
+# Build, per epoch fit and single window predict latency of both models, with the NumPy engine predict that serves them
+def bench_models(settings):
+    import keras
+    import preprocessing
+    from predict_model import model_classes
+    from numpy_inference import NumpyModel
+    from training_profiles import get_profile, make_datasets
+
+    keras.utils.set_random_seed(settings.seed)
+    X_train, X_test, y_train, y_test, backcandles, _, _ = preprocessing.ProcessData(synthetic_bars(settings.rows, settings.seed, multi_index=False))
+    profile_name = benchmark_profile(settings.epochs)
+    _, profile = get_profile(profile_name)
+    train_dataset, validation_dataset = make_datasets(X_train, y_train, profile["batch_size"])
+    window = X_test[-1:]
+
+    results = {}
+    for name, model_class in zip(("lstm", "transformer"), model_classes()):
+        model = model_class(X_train, X_test, y_train, y_test, backcandles, profile_name)
+        results[f"{name}_build"] = measure(model.build_model, max(1, settings.repeat // 4))
+
+        fit_epoch = lambda: model.model.fit(train_dataset, validation_data=validation_dataset, epochs=1, verbose=0)
+        results[f"{name}_fit_epoch"] = measure(fit_epoch, settings.epochs, items=X_train.shape[0])
+
+        results[f"{name}_predict"] = measure(lambda: model.model.predict(window, verbose=0), settings.repeat * 4)
+        numpy_model = NumpyModel.from_keras(model.model)
+        results[f"{name}_predict_numpy"] = measure(lambda: numpy_model.predict(window), settings.repeat * 4)
+    return results
+
+# Latest windows of many tickers served by one global LSTM: each window in its own forward pass the way the requests
+# ran before the dispatcher, against the same windows queued together and run as the dispatcher's batched passes
+def bench_global_batching(settings, tickers=16):
+    import keras
+    from global_model import build_global_network
+    from inference_server import InferenceDispatcher
+    from training_profiles import get_profile
+
+    keras.utils.set_random_seed(settings.seed)
+    _, profile = get_profile("fast")
+    model = build_global_network("lstm", 21, 3, tickers, profile=profile)
+    rng = np.random.default_rng(settings.seed)
+    requests = [(rng.normal(size=(1, 21, 3)).astype(np.float32), np.array([ticker], dtype=np.int32)) for ticker in range(tickers)]
+    dispatcher = InferenceDispatcher(max_batch=tickers, max_wait=0.002, max_queue=tickers)
+
+    def one_pass_each():
+        for inputs in requests:
+            model(inputs, training=False).numpy()
+
+    def dispatched():
+        for future in [dispatcher.submit(model, inputs, "global_lstm") for inputs in requests]:
+            future.result(timeout=30)
+
+    try:
+        return {
+            "global_one_pass_each": measure(one_pass_each, settings.repeat, items=tickers),
+            "global_dispatched": measure(dispatched, settings.repeat, items=tickers),
+        }
+    finally:
+        dispatcher.stop()
+
+# /api/predict through the Flask test client with the bars served by the synthetic source. The first request trains
+# and registers the models, then the uncached case clears the prediction cache before every request so each one loads
+# the registered models and runs the forward pass, and the cached case measures a cache hit.
+def bench_api(settings):
+    benchmark_profile(settings.epochs)
+    import stock_api
+    import app as web_app
+
+    # The bars are fetched once and then served from memory, so the requests time the pipeline rather than the source
+    stock_api.bar_cache.source = SyntheticSource(settings.rows, settings.seed)
+    stock_api.bar_cache.min_refresh = float('inf')
+    client = web_app.app.test_client()
+
+    def request_prediction():
+        response = client.get('/api/predict?symbol=SYN')
+        if response.status_code != 200 or "Error" in (response.get_json() or {}):
+            raise RuntimeError(f"/api/predict failed with {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+    def uncached():
+        web_app.prediction_cache.entries.clear()
+        request_prediction()
+
+    return {
+        "api_predict": measure(uncached, settings.repeat),
+        "api_predict_cached": measure(request_prediction, settings.repeat * 10),
+    }
+
+# Benchmark cases in the order they run, the model and end to end cases import TensorFlow so they run last
+CASES = {
+    "process_data": bench_process_data,
+    "trading_hours": bench_trading_hours,
+    "serialize": bench_serialize,
+    "models": bench_models,
+    "global_batching": bench_global_batching,
+    "api": bench_api,
+}
+
+# Versions and hardware of the run, baselines are only comparable on the same machine and stack
+def environment():
+    versions = {"python": platform.python_version()}
+    # TensorFlow is published under a different distribution name per platform
+    packages = {"numpy": ("numpy",), "pandas": ("pandas",), "scikit-learn": ("scikit-learn",), "keras": ("keras",), "Flask": ("Flask",),
+                "tensorflow": ("tensorflow", "tensorflow-cpu", "tensorflow-intel", "tensorflow-macos")}
+    for package, distributions in packages.items():
+        versions[package] = None
+        for distribution in distributions:
+            try:
+                versions[package] = importlib.metadata.version(distribution)
+                break
+            except importlib.metadata.PackageNotFoundError:
+                continue
+    return {"platform": platform.platform(), "machine": platform.machine(), "cpu_count": os.cpu_count(), "versions": versions}
+
+# Names of the metrics of every case that grew past the tolerance over the baseline, as {case: [messages]}
+def find_regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    regressions = {}
+    for case, result in results.items():
+        reference = baseline.get("results", {}).get(case)
+        if reference is None:
+            continue
+
+        for metric in COMPARED_METRICS:
+            current, previous = result.get(metric), reference.get(metric)
+            if not current or not previous:
+                continue
+            if metric.endswith("_seconds") and current < LATENCY_NOISE_FLOOR:
+                continue
+            if current > previous * (1 + tolerance):
+                regressions.setdefault(case, []).append(f"{metric} {previous:.6g} -> {current:.6g} (+{(current / previous - 1) * 100:.0f}%)")
+    return regressions
+
+def print_results(results, regressions):
+    print(f"{'case':<24}{'p50 ms':>12}{'p99 ms':>12}{'items/s':>14}{'peak MiB':>10}")
+    for case, result in results.items():
+        flag = "  REGRESSED" if case in regressions else ""
+        print(f"{case:<24}{result['p50_seconds'] * 1000:>12.3f}{result['p99_seconds'] * 1000:>12.3f}{result['throughput_per_second']:>14.1f}"
+              f"{result['peak_traced_bytes'] / 2 ** 20:>10.1f}{flag}")
+    for case, messages in regressions.items():
+        for message in messages:
+            print(f"regression in {case}: {message}")
+
+def write_json(path, payload):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.tmp', 'w') as output_file:
+        json.dump(payload, output_file, indent=2)
+    os.replace(path + '.tmp', path)
+
+# Runs the suite, for example: python run_benchmarks.py --save-baseline, then python run_benchmarks.py to compare a later
+# run against that baseline. Exits with 1 when any case regressed so it can gate CI.
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the ProfitPulse pipeline on synthetic market data")
+    parser.add_argument('--rows', type=int, default=DEFAULT_ROWS, help="hourly bars of synthetic history")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=20, help="timed calls of the slower cases, the fast ones scale it up")
+    parser.add_argument('--epochs', type=int, default=2, help="epochs timed per model and trained by the end to end case")
+    parser.add_argument('--cases', nargs='*', default=list(CASES), choices=list(CASES))
+    parser.add_argument('--output', default=None, help="write the results as JSON")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    settings = parser.parse_args(arguments)
+
+    try:
+        results = {}
+        for case in settings.cases:
+            print(f"running {case}", file=sys.stderr, flush=True)
+            results.update(CASES[case](settings))
+    finally:
+        shutil.rmtree(WORKSPACE, ignore_errors=True)
+
+    payload = {
+        "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "settings": {"rows": settings.rows, "seed": settings.seed, "repeat": settings.repeat, "epochs": settings.epochs},
+        "environment": environment(),
+        "results": results,
+    }
+
+    regressions = {}
+    if not settings.save_baseline and os.path.exists(settings.baseline):
+        with open(settings.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("settings") != payload["settings"]:
+            print(f"baseline was recorded with {baseline.get('settings')}, comparing anyway", file=sys.stderr)
+        regressions = find_regressions(results, baseline, settings.tolerance)
+    payload["regressions"] = regressions
+
+    print_results(results, regressions)
+    if settings.output:
+        write_json(settings.output, payload)
+    if settings.save_baseline:
+        write_json(settings.baseline, payload)
+        print(f"saved baseline to {settings.baseline}")
+
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
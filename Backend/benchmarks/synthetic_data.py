@@ -0,0 +1,48 @@
+import zlib
+import math
+import numpy as np
+import pandas as pd
+
+# Hourly bars yf.download returns for a US equity trading day, the first starts at the 9:30 open
+SESSION_BARS = ["09:30", "10:30", "11:30", "12:30", "13:30", "14:30", "15:30"]
+
+# Default length, two years of trading days like the 2y period stock_api downloads
+DEFAULT_ROWS = 252 * 2 * len(SESSION_BARS)
+
+# The synthetic history ends on a fixed day so every run builds exactly the same bars
+DEFAULT_END = "2024-12-31"
+
+# Timestamps of the last rows hourly bars of the weekdays up to end, in the exchange timezone like yf.download
+def trading_index(rows, end=DEFAULT_END, timezone="America/New_York"):
+    days = pd.bdate_range(end=end, periods=math.ceil(rows / len(SESSION_BARS)))
+    timestamps = [f"{day.date()} {bar}" for day in days for bar in SESSION_BARS]
+    return pd.DatetimeIndex(pd.to_datetime(timestamps[-rows:]), name="Datetime").tz_localize(timezone)
+
+# Seeded hourly OHLCV bars shaped like yf.download(ticker, period='2y', interval='1h'), the closes follow a geometric
+# random walk so prices stay positive. With multi_index the columns are (Price, Ticker) pairs like yfinance returns.
+def synthetic_bars(rows=DEFAULT_ROWS, seed=0, ticker="SYN", end=DEFAULT_END, price=100.0, volatility=0.004, multi_index=True):
+    rng = np.random.default_rng(seed)
+    close = price * np.exp(np.cumsum(rng.normal(0.00002, volatility, rows)))
+    open_ = np.concatenate([[price], close[:-1]]) * np.exp(rng.normal(0.0, volatility / 4, rows))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0.0, volatility / 2, rows)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0.0, volatility / 2, rows)))
+    volume = np.round(rng.lognormal(13.0, 0.5, rows))
+
+    data = pd.DataFrame({"Adj Close": close, "Close": close, "High": high, "Low": low, "Open": open_, "Volume": volume},
+                        index=trading_index(rows, end))
+    if multi_index:
+        data.columns = pd.MultiIndex.from_product([data.columns, [ticker]], names=["Price", "Ticker"])
+    return data
+
+# Offline stand-in for stock_api.yahoo_source that serves the same synthetic bars for a ticker on every call, each ticker
+# seeded from its name so different tickers get different but reproducible histories
+class SyntheticSource:
+    def __init__(self, rows=DEFAULT_ROWS, seed=0):
+        self.rows = rows
+        self.seed = seed
+
+    def __call__(self, ticker, start=None):
+        data = synthetic_bars(self.rows, self.seed + zlib.crc32(ticker.upper().encode()), ticker.upper())
+        if start is not None:
+            data = data[data.index >= start]
+        return data
@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+# The backend modules import each other by their plain names, the same way app.py puts PredictionModel on the path
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path[:0] = [os.path.join(BACKEND_DIR, 'PredictionModel'), os.path.join(BACKEND_DIR, 'WebApp')]
+
+# The modules read their storage locations when they are imported, so these point at a scratch directory before any
+# test imports them and the tests never touch the models, caches and history of the checkout
+WORKSPACE = tempfile.mkdtemp(prefix="profitpulse-tests-")
+os.environ["PROFITPULSE_MODEL_DIR"] = os.path.join(WORKSPACE, "saved_models")
+os.environ["PROFITPULSE_DATA_DIR"] = os.path.join(WORKSPACE, "bar_cache")
+os.environ["PROFITPULSE_HISTORY_DIR"] = os.path.join(WORKSPACE, "history")
+os.environ["PROFITPULSE_BACKTEST_DIR"] = os.path.join(WORKSPACE, "backtests")
+os.environ["PROFITPULSE_PREDICTION_DB"] = os.path.join(WORKSPACE, "predictions.db")
+os.environ["PROFITPULSE_WATCHLIST"] = ""
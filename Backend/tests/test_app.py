@@ -0,0 +1,184 @@
+import json
+import types
+import pytest
+import app as webapp
+from prediction_cache import PredictionCache
+from prediction_store import PredictionStore
+from admin_auth import AdminAuth, AdminAuthError
+
+# Serves fixed predictions keyed by the ticker it was built with, the way PredictionModel does, and counts the forward passes
+class FakePredictionModel:
+    forward_passes = 0
+
+    def __init__(self, ticker, **kwargs):
+        self.ticker = ticker
+        self.stock_predictions = {}
+
+    def predict_from_registry(self, registry, dispatcher=None):
+        FakePredictionModel.forward_passes += 1
+        self.stock_predictions[self.ticker] = predictions()
+        return True
+
+    def prediction_to_json(self):
+        return json.dumps(self.stock_predictions)
+
+def predictions():
+    return {
+        "time": ["2024-03-06 11:30:00"],
+        "lstm_predictions": [101.0],
+        "lstm_avg_metrics": {},
+        "transformer_predictions": [102.0],
+        "transformer_avg_metrics": {},
+        "predictions_average": [101.5],
+        "daily_average": 101.5,
+        "date": "2024-03-06",
+        "model_version": 1,
+    }
+
+@pytest.fixture
+def client(monkeypatch):
+    FakePredictionModel.forward_passes = 0
+    monkeypatch.setattr(webapp, "load_predict_model", lambda: types.SimpleNamespace(PredictionModel=FakePredictionModel))
+    monkeypatch.setattr(webapp, "prediction_cache", PredictionCache())
+    monkeypatch.setattr(webapp.model_registry, "latest_version", lambda ticker: None if ticker.upper() == "NEW" else 1)
+    return webapp.app.test_client()
+
+def test_symbol_case_does_not_split_the_cache(client):
+    first = client.get('/api/predict?symbol=aapl')
+    second = client.get('/api/predict?symbol=AAPL')
+    third = client.get('/api/predict?symbol= Aapl ')
+
+    for response in (first, second, third):
+        assert response.status_code == 200
+        assert response.get_json()["symbol"] == "AAPL"
+        assert response.get_json()["predictions_average"] == [101.5]
+    assert FakePredictionModel.forward_passes == 1
+
+def test_lowercase_request_reads_precomputed_predictions(client):
+    webapp.cache_precomputed("AAPL", {"AAPL": predictions()})
+
+    response = client.get('/api/predict?symbol=aapl')
+    assert response.status_code == 200
+    assert response.get_json()["symbol"] == "AAPL"
+    assert FakePredictionModel.forward_passes == 0
+
+def test_untrained_symbol_points_to_training(client):
+    response = client.get('/api/predict?symbol=new')
+    assert response.status_code == 404
+    assert response.get_json()["train"] == "/api/train?symbol=NEW"
+    assert FakePredictionModel.forward_passes == 0
+
+def test_batch_streams_one_line_per_symbol(client, monkeypatch):
+    requested = []
+
+    def predict(symbols):
+        requested.extend(symbols)
+        for symbol in symbols:
+            yield {symbol: predictions()} if symbol != "NEW" else {symbol: {"Error": webapp.not_trained_error(symbol)}}
+
+    monkeypatch.setattr(webapp.batch_predictor, "predict", predict)
+    response = client.get('/api/predict/batch?symbols=aapl, msft,AAPL,new')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert requested == ["AAPL", "MSFT", "NEW"]
+    assert [list(line) for line in lines] == [["AAPL"], ["MSFT"], ["NEW"]]
+    assert "Error" in lines[2]["NEW"]
+
+def test_batch_checks_the_symbol_list(client):
+    assert client.get('/api/predict/batch?symbols=').status_code == 400
+    symbols = ",".join(f"T{number}" for number in range(webapp.MAX_BATCH_SYMBOLS + 1))
+    assert client.get(f'/api/predict/batch?symbols={symbols}').status_code == 400
+
+# Accepts "admin-id-token" as an admin's Firebase ID token and "user-id-token" as a signed in user who is not an admin
+def verify_id_token(id_token):
+    if id_token == "admin-id-token":
+        return "admin-uid"
+    if id_token == "user-id-token":
+        raise AdminAuthError("Admin access is required", 403)
+    raise AdminAuthError("Invalid ID token", 401)
+
+@pytest.fixture
+def admin_client(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(webapp, "admin_auth", AdminAuth(admin_token="script-token", verify_id_token=verify_id_token))
+    monkeypatch.setattr(webapp, "prediction_store", PredictionStore(str(tmp_path / "predictions.db")))
+    return client
+
+def stored_run():
+    return {"symbol": "aapl", "time": ["2024-03-06 11:30:00"], "lstm_predicted_price": [101.0], "transformer_predicted_price": [102.0],
+            "predictions_average": [101.5], "daily_average": 101.5, "date": "2024-03-06"}
+
+@pytest.mark.parametrize("authorization, status", [
+    (None, 401),
+    ("admin-id-token", 401),
+    ("Bearer forged-token", 401),
+    ("Bearer user-id-token", 403),
+    ("Bearer admin-id-token", 200),
+    ("Bearer script-token", 200),
+])
+def test_prediction_writes_require_an_admin(admin_client, authorization, status):
+    headers = {"Authorization": authorization} if authorization else {}
+
+    stored = admin_client.post('/api/predictions', json=stored_run(), headers=headers)
+    assert stored.status_code == status
+    assert len(webapp.prediction_store.predictions("AAPL")) == (1 if status == 200 else 0)
+    assert admin_client.get('/api/predictions?symbol=aapl').status_code == 200
+
+    compacted = admin_client.post('/api/predictions/compact?days=100000', headers=headers)
+    assert compacted.status_code == status
+
+@pytest.mark.parametrize("path", ['/api/market/intraday?symbol=aapl', '/api/market/daily?symbol=aapl', '/api/market/stats'])
+def test_market_data_is_disabled_without_a_key(client, monkeypatch, path):
+    monkeypatch.setattr(webapp, "market_data_cache", None)
+
+    response = client.get(path)
+    assert response.status_code == 503
+    assert "PROFITPULSE_ALPHA_VANTAGE_KEY" in response.get_json()["Error"]
+
+def test_stored_metrics_are_served(admin_client):
+    assert admin_client.get('/api/predictions/metrics?symbol=aapl').status_code == 404
+
+    run = dict(stored_run(), lstm_avg_metrics={"mae": 1.0}, transformer_avg_metrics={"mae": 2.0}, last_trained_metrics="2024-03-06 09:00:00")
+    admin_client.post('/api/predictions', json=run, headers={"Authorization": "Bearer script-token"})
+
+    metrics = admin_client.get('/api/predictions/metrics?symbol=aapl').get_json()
+    assert metrics["symbol"] == "AAPL"
+    assert metrics["lstm_avg_metrics"] == {"mae": 1.0}
+    assert metrics["last_trained_metrics"] == "2024-03-06 09:00:00"
+    assert admin_client.get('/api/predictions/daily?symbol=aapl&from=2024-03-06&to=2024-03-06').get_json()["daily_average"] == [{"date": "2024-03-06", "daily_average": 101.5}]
+
+# Records the jobs the routes queue instead of starting training workers
+class FakeJobQueue:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, kind, ticker, profile=None):
+        self.submitted.append((kind, ticker, profile))
+        return types.SimpleNamespace(id=f"job-{len(self.submitted)}"), True
+
+    def status(self, job_id):
+        return {"job_id": job_id, "status": "queued"}
+
+@pytest.mark.parametrize("path, kind", [
+    ('/api/train?symbol=aapl', 'train'),
+    ('/api/train?symbol=aapl&mode=incremental', 'fine_tune'),
+    ('/api/retrain?symbol=aapl', 'train'),
+    ('/api/backtest?symbol=aapl&profile=fast', 'backtest'),
+])
+def test_job_routes_require_an_admin_and_only_queue(admin_client, monkeypatch, path, kind):
+    job_queue = FakeJobQueue()
+    monkeypatch.setattr(webapp, "job_queue", job_queue)
+
+    assert admin_client.post(path).status_code == 401
+    assert admin_client.post(path, headers={"Authorization": "Bearer user-id-token"}).status_code == 403
+    assert job_queue.submitted == []
+
+    response = admin_client.post(path, headers={"Authorization": "Bearer admin-id-token"})
+    assert response.status_code == 202
+    assert response.get_json()["job_id"] == "job-1"
+    assert job_queue.submitted == [(kind, "AAPL", "fast" if kind == "backtest" else None)]
+
+def test_manual_precomputation_requires_an_admin(admin_client):
+    assert admin_client.post('/api/schedule/run').status_code == 401
+    assert admin_client.post('/api/schedule/run', headers={"Authorization": "Bearer script-token"}).status_code == 400
@@ -0,0 +1,70 @@
+import os
+import threading
+import numpy as np
+import pytest
+from backtest import Backtest, LoadSummary, fold_training_end, horizon_metrics, walk_forward_folds
+
+@pytest.mark.parametrize("samples, retrain_every", [(1000, None), (1000, 50), (1000, 37), (130, 7)])
+def test_folds_cover_the_test_set_once(samples, retrain_every):
+    folds = walk_forward_folds(samples, retrain_every)
+
+    assert folds[0][0] == samples - int(np.ceil(samples * 0.2))
+    assert folds[-1][1] == samples
+    assert all(end == next_start for (_, end), (next_start, _) in zip(folds, folds[1:]))
+    assert all(end - start == (retrain_every or samples - folds[0][0]) for start, end in folds[:-1])
+
+@pytest.mark.parametrize("backcandles, futurecandles", [(21, 7), (5, 1), (10, 12)])
+def test_no_training_window_overlaps_a_test_target(backcandles, futurecandles):
+    for start, end in walk_forward_folds(400, 25):
+        train_end = fold_training_end(start, futurecandles)
+
+        # Window i sees rows i to i + backcandles - 1 and targets the futurecandles rows after them
+        last_training_target = (train_end - 1) + backcandles + futurecandles - 1
+        first_test_target = start + backcandles
+        assert last_training_target < first_test_target
+        # Every target row known at the fold start is trained on
+        assert last_training_target == first_test_target - 1
+
+def test_horizon_metrics():
+    actual = np.array([[101.0, 102.0], [99.0, 100.0]])
+    predicted = np.array([[102.0, 101.0], [98.0, 100.0]])
+    reference = np.array([100.0, 100.0])
+
+    metrics = horizon_metrics(actual, predicted, reference)
+    np.testing.assert_allclose(metrics["mae"], [1.0, 0.5])
+    np.testing.assert_allclose(metrics["rmse"], [1.0, np.sqrt(0.5)])
+    np.testing.assert_allclose(metrics["mape"], [(1 / 101 + 1 / 99) / 2, (1 / 102) / 2])
+    # Up and up, down and down, then up and up, flat and flat
+    assert metrics["hit_rate"] == [1.0, 1.0]
+
+    predicted[0, 0] = 99.0
+    assert horizon_metrics(actual, predicted, reference)["hit_rate"] == [0.5, 1.0]
+
+def backtest_result(windows):
+    backtest = Backtest("aapl")
+    backtest.summary = {"ticker": "AAPL", "windows": windows}
+    backtest.results = {name: np.full((windows, 7), windows, dtype=np.float32) for name in ("actual", "lstm", "transformer")}
+    return backtest
+
+def test_concurrent_saves_leave_a_complete_result(tmp_path):
+    errors = []
+
+    def save(windows):
+        try:
+            for _ in range(5):
+                backtest_result(windows).save(str(tmp_path))
+        except Exception as exception:
+            errors.append(exception)
+
+    threads = [threading.Thread(target=save, args=(windows,)) for windows in range(10, 18)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert os.listdir(tmp_path) == ["AAPL.npz"]
+    summary = LoadSummary("aapl", str(tmp_path))
+    with np.load(tmp_path / "AAPL.npz") as results:
+        assert results["lstm"].shape == (summary["windows"], 7)
+    assert LoadSummary("MSFT", str(tmp_path)) is None
@@ -0,0 +1,54 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from stock_api import BarCache
+
+def bars(rows, start="2024-03-04 09:30"):
+    index = pd.date_range(start, periods=rows, freq="h", tz="America/New_York").as_unit("ns")
+    close = np.linspace(100, 100 + rows, rows)
+    return pd.DataFrame({"Adj Close": close, "Close": close, "High": close + 1, "Low": close - 1, "Open": close, "Volume": close * 10}, index=index)
+
+# Source serving the first rows bars of a fixed history, the bars from start on when a tail is asked for
+class GrowingSource:
+    def __init__(self, rows):
+        self.history = bars(40)
+        self.rows = rows
+        self.calls = []
+
+    def __call__(self, ticker, start=None):
+        self.calls.append(start)
+        data = self.history.iloc[:self.rows]
+        return data if start is None else data[data.index >= start]
+
+def test_cached_bars_round_trip_and_only_the_tail_is_fetched(tmp_path):
+    source = GrowingSource(30)
+    cache = BarCache(str(tmp_path), source, min_refresh=0)
+    pd.testing.assert_frame_equal(cache.get("aapl"), source.history.iloc[:30], check_freq=False)
+
+    source.rows = 35
+    reopened = BarCache(str(tmp_path), source, min_refresh=0)
+    pd.testing.assert_frame_equal(reopened.get("AAPL"), source.history.iloc[:35], check_freq=False)
+    assert source.calls[-1] == source.history.index[29]
+    assert reopened.cache_stats()["warm"] == 1
+
+def test_concurrent_writers_leave_a_complete_file(tmp_path):
+    caches = [BarCache(str(tmp_path), GrowingSource(30)) for _ in range(8)]
+    errors = []
+
+    def write(cache):
+        try:
+            for _ in range(10):
+                cache.write("AAPL", bars(30))
+        except Exception as exception:
+            errors.append(exception)
+
+    threads = [threading.Thread(target=write, args=(cache,)) for cache in caches]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert os.listdir(tmp_path) == ["AAPL.npz"]
+    pd.testing.assert_frame_equal(caches[0].read("AAPL"), bars(30), check_freq=False)
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+from features import FeatureCache, FeatureEngine
+
+FEATURES = ["Open", "return", "ema_5", "rsi_14", "atr_14", "volume_z_10"]
+
+# Hourly random walk bars with positive prices and volumes
+def bars(rows=80, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, rows)))
+    index = pd.date_range("2024-03-04 09:30", periods=rows, freq="h", tz="America/New_York").as_unit("ns")
+    return pd.DataFrame({"Open": close * (1 + rng.normal(0, 0.002, rows)), "High": close * 1.01, "Low": close * 0.99, "Close": close,
+                         "Volume": rng.uniform(1e5, 1e6, rows)}, index=index)
+
+def full(data):
+    values, _ = FeatureEngine(FEATURES).compute(data)
+    return values
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = FeatureCache(str(tmp_path))
+    cache.writes = 0
+    write = cache.write
+
+    def counting_write(ticker, entry):
+        cache.writes += 1
+        write(ticker, entry)
+
+    cache.write = counting_write
+    return cache
+
+def test_appended_bars_match_the_full_recompute(cache):
+    data = bars()
+    engine = FeatureEngine(FEATURES)
+
+    cache.get("AAPL", data.iloc[:40], engine)
+    for rows in (41, 55, 80):
+        np.testing.assert_allclose(cache.get("AAPL", data.iloc[:rows], engine).to_numpy(), full(data.iloc[:rows]), rtol=1e-10)
+    assert cache.cache_stats()["full"] == 1
+    assert cache.cache_stats()["incremental"] == 3
+
+    # A reopened cache continues from the stored state
+    reopened = FeatureCache(cache.directory)
+    more = bars(90)
+    more.iloc[:80] = data
+    np.testing.assert_allclose(reopened.get("AAPL", more, engine).to_numpy(), full(more), rtol=1e-10)
+    assert reopened.cache_stats()["incremental"] == 1
+
+def test_the_forming_bar_is_recomputed_when_it_changes(cache):
+    data = bars()
+    engine = FeatureEngine(FEATURES)
+    forming = data.iloc[:40].copy()
+    forming.iloc[-1, forming.columns.get_loc("Close")] *= 1.02
+
+    cache.get("AAPL", forming, engine)
+    np.testing.assert_allclose(cache.get("AAPL", data.iloc[:40], engine).to_numpy(), full(data.iloc[:40]), rtol=1e-10)
+    np.testing.assert_allclose(cache.get("AAPL", data.iloc[:50], engine).to_numpy(), full(data.iloc[:50]), rtol=1e-10)
+    assert cache.writes == 3
+
+def test_cache_hits_skip_the_write(cache):
+    data = bars()
+    engine = FeatureEngine(FEATURES)
+
+    first = cache.get("AAPL", data, engine)
+    second = cache.get("AAPL", data, engine)
+    pd.testing.assert_frame_equal(first, second)
+    assert cache.writes == 1
+    assert cache.cache_stats()["hits"] == 1
+
+def test_a_history_ending_on_the_settled_bars_is_recomputed(cache):
+    data = bars()
+    engine = FeatureEngine(FEATURES)
+
+    cache.get("AAPL", data.iloc[:40], engine)
+    np.testing.assert_allclose(cache.get("AAPL", data.iloc[:39], engine).to_numpy(), full(data.iloc[:39]), rtol=1e-10)
+    # The state stored for the shorter history must settle bar 38, not bar 39, for the appended bars to line up
+    np.testing.assert_allclose(cache.get("AAPL", data.iloc[:45], engine).to_numpy(), full(data.iloc[:45]), rtol=1e-10)
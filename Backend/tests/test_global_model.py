@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+from global_model import InterleavedWindows
+
+BACKCANDLES = 5
+FUTURECANDLES = 3
+
+# Scaled rows of a ticker, the first feature holds the ticker id and the second the row number within the ticker so a
+# gathered window shows which rows of which ticker it read
+def ticker_rows(ticker_id, rows):
+    values = np.zeros((rows, 4), dtype=np.float32)
+    values[:, 0] = ticker_id
+    values[:, 1] = np.arange(rows)
+    values[:, 3] = ticker_id * 1000 + np.arange(rows)
+    return values
+
+def interleaved():
+    return InterleavedWindows([ticker_rows(0, 40), ticker_rows(1, 25), ticker_rows(2, 60)], BACKCANDLES, FUTURECANDLES, feature_count=3)
+
+@pytest.mark.parametrize("seed", [None, 0, 1])
+def test_no_window_crosses_tickers(seed):
+    windows = interleaved()
+    rng = np.random.default_rng(seed) if seed is not None else None
+
+    seen = 0
+    for groups in (windows.train, windows.validation, windows.test):
+        for (X, ticker_ids), y in windows.batches(groups, batch_size=16, rng=rng):
+            seen += X.shape[0]
+            # Every bar and every target of a window belongs to the ticker the window is labelled with
+            assert (X[:, :, 0] == ticker_ids[:, np.newaxis]).all()
+            assert (y // 1000 == ticker_ids[:, np.newaxis]).all()
+            # The bars are consecutive rows and the targets are the rows right after them
+            assert (np.diff(X[:, :, 1], axis=1) == 1).all()
+            assert (y % 1000 == X[:, -1:, 1] + 1 + np.arange(FUTURECANDLES)).all()
+    assert seen == windows.windows() == (40 + 25 + 60) - 3 * (BACKCANDLES + FUTURECANDLES)
+
+def test_splits_are_per_ticker_and_in_order():
+    windows = interleaved()
+    for train, validation, test in zip(windows.train, windows.validation, windows.test):
+        starts = np.concatenate([train, validation, test])
+        assert (np.diff(starts) == 1).all()
+        assert train.shape[0] and validation.shape[0] and test.shape[0]
+
+    X, ticker_ids = windows.latest()
+    assert ticker_ids.tolist() == [0, 1, 2]
+    assert (X[:, 0, 0] == ticker_ids).all()
+    assert X[:, -1, 1].tolist() == [rows - FUTURECANDLES - 2 for rows in (40, 25, 60)]
+
+# Hourly bars with positive prices shaped like the download
+def bars(rows, seed):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, rows)))
+    index = pd.date_range("2024-01-02 09:30", periods=rows, freq="h", tz="America/New_York").as_unit("ns")
+    return pd.DataFrame({"Adj Close": close, "Close": close, "High": close * 1.01, "Low": close * 0.99, "Open": close, "Volume": np.full(rows, 1e6)}, index=index)
+
+def test_registered_global_model_serves_tickers_without_their_own(tmp_path, monkeypatch):
+    pytest.importorskip("keras")
+    import stock_api
+    import preprocessing
+    import global_model
+    from model_registry import ModelRegistry, GLOBAL_KEY
+    from predict_model import PredictionModel
+    from inference_server import InferenceDispatcher
+
+    history = {"AAA": bars(120, 0), "BBB": bars(120, 1)}
+    monkeypatch.setattr(stock_api, "DownloadData", lambda ticker: history[ticker.upper()].copy())
+
+    # The networks are registered untrained, serving only has to run the registered weights
+    models = {}
+    for architecture in global_model.GLOBAL_ARCHITECTURES:
+        models[architecture] = global_model.GlobalModel(list(history), architecture, "fast", features=["Open", "High", "Low"])
+        models[architecture].prepare()
+        models[architecture].model = global_model.build_global_network(architecture, 21, 3, 2, profile=models[architecture].profile)
+        models[architecture].avg_metrics = {"global_model": True}
+
+    registry = ModelRegistry(str(tmp_path))
+    assert registry.serving_model("AAA") == (None, None)
+    assert global_model.register_global(registry, models["lstm"], models["transformer"]) == 1
+    assert registry.serving_model("aaa") == (GLOBAL_KEY, 1)
+    assert registry.serving_model("CCC") == (None, None)
+
+    prediction_model = PredictionModel("BBB")
+    assert prediction_model.predict_from_registry(registry)
+    predictions = prediction_model.stock_predictions["BBB"]
+    assert "Error" not in predictions
+    assert predictions["global_model"] is True
+    assert predictions["model_version"] == 1
+    # The hours are the ones after the newest bar, Sunday 08:30, rather than after the time of the request
+    assert predictions["time"][0] == "2024-01-08 10:30:00"
+
+    # The served window ends on the newest bar and is run with the ticker's own scalers and id
+    feature_scaler, target_scaler = models["lstm"].scalers["BBB"]
+    window = preprocessing.LatestWindow(history["BBB"], feature_scaler, 21, 7, ["Open", "High", "Low"], "BBB")
+    np.testing.assert_array_equal(window[0, -1], feature_scaler.transform(preprocessing.FeatureFrame(history["BBB"], ["Open", "High", "Low"], "BBB"))[-1])
+    expected = models["lstm"].model.predict((window, np.array([1], dtype=np.int32)), verbose=0)[0]
+    np.testing.assert_allclose(predictions["lstm_predictions"], target_scaler.inverse_transform(expected.reshape(-1, 1)).flatten(), rtol=1e-4)
+    assert not PredictionModel("CCC").predict_from_registry(registry)
+
+    # Through the dispatcher the global model's windows are batched and serve the same predictions
+    dispatcher = InferenceDispatcher(max_batch=8, max_wait=0.01)
+    batched_model = PredictionModel("BBB")
+    assert batched_model.predict_from_registry(registry, dispatcher)
+    np.testing.assert_allclose(batched_model.stock_predictions["BBB"]["lstm_predictions"], predictions["lstm_predictions"], rtol=1e-5)
+    np.testing.assert_allclose(batched_model.stock_predictions["BBB"]["transformer_predictions"], predictions["transformer_predictions"], rtol=1e-5)
+    assert dispatcher.status()["requests"] == 2
+    dispatcher.stop()
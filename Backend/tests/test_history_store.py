@@ -0,0 +1,72 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from history_store import HistoryStore, FIELDS, TIMESTAMPS_FILE
+
+# Hourly bars with every stored field, the values are the row numbers so slices are easy to check
+def bars(start, rows, timezone="America/New_York"):
+    index = pd.date_range("2024-03-04 09:30", periods=start + rows, freq="h", tz=timezone).as_unit("ns")[start:]
+    values = np.arange(start, start + rows, dtype=np.float64)
+    return pd.DataFrame({field: values + offset for offset, field in enumerate(FIELDS)}, index=index)
+
+def test_appends_across_calls_only_add_newer_bars(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    assert store.append("aapl", bars(0, 50)) == 50
+    # The overlapping bars are already stored, only the ones after the last stored bar are added
+    assert store.append("AAPL", bars(40, 30)) == 20
+    assert store.append("AAPL", bars(0, 70)) == 0
+
+    assert store.rows("AAPL") == 70
+    pd.testing.assert_frame_equal(store.frame("AAPL"), bars(0, 70).astype(np.float32), check_freq=False)
+
+def test_a_reopened_store_reads_the_committed_rows(tmp_path):
+    HistoryStore(str(tmp_path)).append("AAPL", bars(0, 30))
+
+    store = HistoryStore(str(tmp_path))
+    assert store.tickers() == ["AAPL"]
+    assert store.rows("AAPL") == 30
+    assert store.index("AAPL").equals(bars(0, 30).index)
+    assert store.append("AAPL", bars(25, 10)) == 5
+    assert store.column("AAPL", "Close")[-1] == 34 + FIELDS.index("Close")
+
+def test_tail_slices_return_the_last_rows(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append("AAPL", bars(0, 100))
+
+    tail = store.frame("AAPL", start=-10)
+    pd.testing.assert_frame_equal(tail, bars(90, 10).astype(np.float32), check_freq=False)
+    start = store.row_at("AAPL", bars(0, 100).index[95])
+    assert start == 95
+    assert store.frame("AAPL", start, fields=["Open"])["Open"].tolist() == [95, 96, 97, 98, 99]
+
+def test_the_memory_mapped_files_grow_with_the_appends(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append("AAPL", bars(0, 20))
+    before = store.timestamps("AAPL")
+
+    store.append("AAPL", bars(20, 30))
+    after = store.timestamps("AAPL")
+    assert before.shape[0] == 20
+    assert after.shape[0] == 50
+    np.testing.assert_array_equal(after[:20], before)
+    assert os.path.getsize(os.path.join(store.ticker_dir("AAPL"), TIMESTAMPS_FILE)) == 50 * 8
+    assert np.all(np.diff(after) > 0)
+
+def test_rows_left_by_an_interrupted_append_are_overwritten(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append("AAPL", bars(0, 20))
+    # Column bytes written past the committed row count, as an append that died before moving meta.json leaves them
+    with open(os.path.join(store.ticker_dir("AAPL"), TIMESTAMPS_FILE), "ab") as column:
+        column.write(np.arange(5, dtype=np.int64).tobytes())
+    assert store.rows("AAPL") == 20
+
+    store.append("AAPL", bars(20, 3))
+    assert store.rows("AAPL") == 23
+    assert store.index("AAPL").equals(bars(0, 23).index)
+
+def test_bars_in_another_timezone_are_refused(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append("AAPL", bars(0, 10))
+    with pytest.raises(ValueError):
+        store.append("AAPL", bars(10, 5, timezone="UTC"))
@@ -0,0 +1,107 @@
+import threading
+import numpy as np
+import pytest
+from inference_server import InferenceDispatcher, InferenceQueueFull
+
+class Output:
+    def __init__(self, values):
+        self.values = values
+
+    def numpy(self):
+        return self.values
+
+# Model that records the size of every batch and returns the window sums times its factor
+class FakeModel:
+    def __init__(self, factor, release=None):
+        self.factor = factor
+        self.release = release
+        self.batches = []
+
+    def __call__(self, windows, training=False):
+        if self.release is not None:
+            self.release.wait(5)
+        self.batches.append(len(windows))
+        return Output(windows.sum(axis=(1, 2))[:, None] * self.factor)
+
+def window(value):
+    return np.full((1, 4, 3), value, dtype=np.float32)
+
+def test_concurrent_windows_are_batched_per_model():
+    dispatcher = InferenceDispatcher(max_batch=64, max_wait=0.05, max_queue=64)
+    lstm, transformer = FakeModel(1), FakeModel(2)
+
+    futures = [(value, dispatcher.submit(lstm, window(value), "lstm"), dispatcher.submit(transformer, window(value), "transformer"))
+               for value in range(10)]
+    for value, lstm_future, transformer_future in futures:
+        assert lstm_future.result(5)[0] == value * 12
+        assert transformer_future.result(5)[0] == value * 24
+
+    assert sum(lstm.batches) == sum(transformer.batches) == 10
+    assert max(lstm.batches) > 1
+    status = dispatcher.status()
+    assert status["requests"] == 20
+    assert status["forward_passes"] == len(lstm.batches) + len(transformer.batches)
+    dispatcher.stop()
+
+# Model with a window and a ticker id input like the global model, the id picks the factor of the window sum
+class FakeGlobalModel(FakeModel):
+    def __call__(self, inputs, training=False):
+        windows, ticker_ids = inputs
+        self.batches.append(len(windows))
+        return Output(windows.sum(axis=(1, 2))[:, None] * (ticker_ids[:, None] + 1))
+
+def test_windows_of_different_tickers_share_the_global_models_pass():
+    dispatcher = InferenceDispatcher(max_batch=64, max_wait=0.05, max_queue=64)
+    model = FakeGlobalModel(1)
+
+    futures = [(value, dispatcher.submit(model, (window(value), np.array([value % 3], dtype=np.int32)), "global_lstm")) for value in range(9)]
+    for value, future in futures:
+        assert future.result(5)[0] == value * 12 * (value % 3 + 1)
+
+    assert sum(model.batches) == 9
+    assert max(model.batches) > 1
+    dispatcher.stop()
+
+def test_batches_are_capped_at_max_batch():
+    release = threading.Event()
+    dispatcher = InferenceDispatcher(max_batch=3, max_wait=0.05, max_queue=64)
+    model = FakeModel(1, release)
+
+    futures = [dispatcher.submit(model, window(value)) for value in range(7)]
+    release.set()
+    for future in futures:
+        future.result(5)
+
+    assert max(model.batches) <= 3
+    assert sum(model.batches) == 7
+    dispatcher.stop()
+
+def test_full_queue_rejects_windows():
+    release = threading.Event()
+    dispatcher = InferenceDispatcher(max_batch=1, max_wait=0, max_queue=2)
+    model = FakeModel(1, release)
+
+    accepted = []
+    with pytest.raises(InferenceQueueFull):
+        for value in range(10):
+            accepted.append(dispatcher.submit(model, window(value)))
+    release.set()
+    for future in accepted:
+        future.result(5)
+
+    assert dispatcher.status()["rejected"] == 1
+    dispatcher.stop()
+
+def test_model_errors_reach_every_window_of_the_batch():
+    class BrokenModel:
+        def __call__(self, windows, training=False):
+            raise ValueError("broken")
+
+    dispatcher = InferenceDispatcher(max_batch=8, max_wait=0.02, max_queue=8)
+    model = BrokenModel()
+    futures = [dispatcher.submit(model, window(value)) for value in range(3)]
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(5)
+    assert dispatcher.status()["errors"] >= 1
+    dispatcher.stop()
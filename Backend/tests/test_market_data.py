@@ -0,0 +1,132 @@
+import json
+import time
+import threading
+import pytest
+from market_data import MarketDataCache, JsonFileSource, SERIES
+
+SERIES_DATA = {"2024-03-05 10:30:00": {"4. close": "101.5"}, "2024-03-05 11:30:00": {"4. close": "102.0"}}
+
+# Saved Alpha Vantage responses for the file source
+@pytest.fixture
+def series_directory(tmp_path):
+    for series, (_, series_key) in SERIES.items():
+        with open(tmp_path / f"AAPL_{series}.json", "w") as series_file:
+            json.dump({"Meta Data": {}, series_key: SERIES_DATA}, series_file)
+    return str(tmp_path)
+
+# Source that counts its calls and can hold them until released, so callers pile up behind one upstream request
+class CountingSource:
+    def __init__(self, source, release=None):
+        self.source = source
+        self.release = release
+        self.calls = 0
+        self.started = threading.Event()
+        self.lock = threading.Lock()
+
+    def __call__(self, series, symbol):
+        with self.lock:
+            self.calls += 1
+        self.started.set()
+        if self.release is not None:
+            self.release.wait(5)
+        return self.source(series, symbol)
+
+# Clock the test moves by hand
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_file_source_reads_the_saved_series(series_directory):
+    assert JsonFileSource(series_directory)("intraday", "aapl") == SERIES_DATA
+
+def test_concurrent_identical_requests_hit_the_source_once(series_directory):
+    release = threading.Event()
+    source = CountingSource(JsonFileSource(series_directory), release)
+    cache = MarketDataCache(source)
+
+    results = []
+    def read():
+        results.append(cache.get("intraday", "aapl"))
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    threads[0].start()
+    assert source.started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    # Every follower is waiting on the leader's request before it is released
+    deadline = time.monotonic() + 5
+    while cache.cache_stats()["coalesced"] < 7 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert source.calls == 1
+    assert len(results) == 8
+    assert all(series_data == SERIES_DATA for series_data, _ in results)
+    stats = cache.cache_stats()
+    assert stats["misses"] == 1
+    assert stats["coalesced"] == 7
+    assert stats["inflight"] == 0
+
+def test_fresh_entries_are_served_without_the_source(series_directory):
+    source = CountingSource(JsonFileSource(series_directory))
+    clock = Clock()
+    cache = MarketDataCache(source, ttl={"intraday": 60, "daily": 3600}, clock=clock)
+
+    first = cache.get("intraday", "AAPL")
+    clock.now += 59
+    assert cache.get("intraday", "aapl") == first
+    assert source.calls == 1
+    assert cache.cache_stats()["hits"] == 1
+
+    # Past the TTL the series is downloaded again
+    clock.now += 2
+    cache.get("intraday", "AAPL")
+    assert source.calls == 2
+    assert cache.cache_stats()["misses"] == 2
+
+    # The series expire on their own TTL
+    cache.get("daily", "AAPL")
+    clock.now += 61
+    cache.get("daily", "AAPL")
+    assert source.calls == 3
+
+def test_an_expired_copy_is_served_when_the_upstream_fails(series_directory):
+    clock = Clock()
+    files = JsonFileSource(series_directory)
+    failing = {"now": False}
+
+    def source(series, symbol):
+        if failing["now"]:
+            raise ValueError("rate limited")
+        return files(series, symbol)
+
+    cache = MarketDataCache(source, ttl={"intraday": 60, "daily": 3600}, clock=clock)
+    cache.get("intraday", "AAPL")
+    failing["now"] = True
+    clock.now += 120
+    assert cache.get("intraday", "AAPL")[0] == SERIES_DATA
+    assert cache.cache_stats()["stale_served"] == 1
+    with pytest.raises(ValueError):
+        cache.get("intraday", "MSFT")
+
+def test_hot_series_are_refreshed_before_they_expire(series_directory):
+    source = CountingSource(JsonFileSource(series_directory))
+    clock = Clock()
+    cache = MarketDataCache(source, ttl={"intraday": 60, "daily": 3600}, hot_seconds=300, clock=clock)
+
+    cache.get("intraday", "AAPL")
+    clock.now += 30
+    assert cache.refresh_hot(interval=10) == 0
+    clock.now += 25
+    assert cache.refresh_hot(interval=10) == 1
+    assert source.calls == 2
+
+    # Series nobody read within hot_seconds are forgotten instead of refreshed
+    clock.now += 400
+    assert cache.refresh_hot(interval=10) == 0
+    assert cache.cache_stats()["entries"] == 0
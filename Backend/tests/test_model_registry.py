@@ -0,0 +1,49 @@
+import os
+import pytest
+import numpy_inference
+from model_registry import ModelRegistry, LATEST_FILE
+
+# Stands in for a Keras model, saving only writes a marker file
+class FakeModel:
+    def save(self, path):
+        with open(path, 'w') as model_file:
+            model_file.write("model")
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(numpy_inference, "export_models", lambda path, lstm_model, transformer_model: open(path, 'wb').close())
+    return ModelRegistry(str(tmp_path), keep_versions=2)
+
+def save(registry, ticker="aapl"):
+    return registry.save(ticker, FakeModel(), FakeModel(), None, None, {"backcandles": 21})
+
+def test_untrained_ticker_has_no_version(registry):
+    assert registry.latest_version("AAPL") is None
+    assert not registry.has_model("AAPL")
+    assert registry.load("AAPL") is None
+
+def test_versions_increase_and_latest_moves(registry):
+    assert save(registry) == 1
+    assert save(registry) == 2
+    assert registry.latest_version("aapl") == 2
+    assert registry.load_metadata("AAPL")["version"] == 2
+    assert registry.load_metadata("AAPL")["ticker"] == "AAPL"
+
+def test_old_versions_are_pruned(registry):
+    for _ in range(4):
+        save(registry)
+    assert registry.list_versions("AAPL") == [3, 4]
+    assert registry.latest_version("AAPL") == 4
+
+def test_failed_save_leaves_no_partial_version(registry):
+    class BrokenModel:
+        def save(self, path):
+            raise OSError("disk full")
+
+    save(registry)
+    with pytest.raises(OSError):
+        registry.save("AAPL", FakeModel(), BrokenModel(), None, None, {})
+
+    assert registry.list_versions("AAPL") == [1]
+    assert registry.latest_version("AAPL") == 1
+    assert sorted(os.listdir(registry.ticker_dir("AAPL"))) == [LATEST_FILE, "v0001"]
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+keras = pytest.importorskip("keras")
+from keras import layers, models
+import numpy_inference
+from numpy_inference import NumpyModel, UnsupportedLayer
+from lstm_model import lstm_layers
+from transformer_model import transformer_outputs
+
+BACKCANDLES = 21
+FEATURES = 3
+
+def windows(samples=16, seed=0):
+    return np.random.default_rng(seed).normal(size=(samples, BACKCANDLES, FEATURES)).astype(np.float32)
+
+# The LSTM the per ticker models are built with. The batch normalization statistics are moved away from their initial
+# zero mean and unit variance, so the normalization the NumPy engine reproduces is not the identity.
+def lstm_network():
+    keras.utils.set_random_seed(1)
+    model = models.Sequential([layers.Input(shape=(BACKCANDLES, FEATURES))] + lstm_layers())
+    normalization = next(layer for layer in model.layers if isinstance(layer, layers.BatchNormalization))
+    rng = np.random.default_rng(2)
+    gamma, beta, mean, variance = normalization.get_weights()
+    normalization.set_weights([rng.uniform(0.5, 2.0, gamma.shape), rng.normal(size=beta.shape), rng.normal(size=mean.shape), rng.uniform(0.5, 2.0, variance.shape)])
+    return model
+
+# The transformer the per ticker models are built with, attention, feed forward and pooling
+def transformer_network():
+    keras.utils.set_random_seed(3)
+    inputs = layers.Input(shape=(BACKCANDLES, FEATURES))
+    return models.Model(inputs=inputs, outputs=transformer_outputs(inputs))
+
+@pytest.mark.parametrize("build", [lstm_network, transformer_network])
+def test_numpy_engine_matches_keras(build):
+    model = build()
+    X = windows()
+
+    expected = model.predict(X, verbose=0)
+    numpy_model = NumpyModel.from_keras(model)
+    np.testing.assert_allclose(numpy_model.predict(X), expected, rtol=1e-4, atol=1e-5)
+    np.testing.assert_allclose(numpy_model(X[:1], training=False).numpy()[0], expected[0], rtol=1e-4, atol=1e-5)
+    np.testing.assert_allclose(numpy_model.predict(X[0]), expected[0], rtol=1e-4, atol=1e-5)
+
+def test_exported_weights_round_trip(tmp_path):
+    lstm_model, transformer_model = lstm_network(), transformer_network()
+    X = windows(seed=4)
+
+    path = str(tmp_path / "weights.npz")
+    numpy_inference.export_models(path, lstm_model, transformer_model)
+    loaded_lstm, loaded_transformer = numpy_inference.load_models(path)
+
+    np.testing.assert_allclose(loaded_lstm.predict(X), lstm_model.predict(X, verbose=0), rtol=1e-4, atol=1e-5)
+    np.testing.assert_allclose(loaded_transformer.predict(X), transformer_model.predict(X, verbose=0), rtol=1e-4, atol=1e-5)
+
+# Layers the engine cannot reproduce are refused at export instead of serving different predictions
+def test_unsupported_layers_are_refused():
+    model = models.Sequential([layers.Input(shape=(BACKCANDLES, FEATURES)), layers.LayerNormalization(), layers.GlobalAveragePooling1D(), layers.Dense(7)])
+    with pytest.raises(UnsupportedLayer):
+        NumpyModel.from_keras(model)
+
+    model = models.Sequential([layers.Input(shape=(BACKCANDLES, FEATURES)), layers.GlobalAveragePooling1D(), layers.Dense(7, activation="relu")])
+    with pytest.raises(UnsupportedLayer):
+        NumpyModel.from_keras(model)
@@ -0,0 +1,69 @@
+import threading
+from datetime import datetime, timedelta
+from prediction_cache import PredictionCache, next_trading_slot
+
+def at(clock_time):
+    return datetime.strptime(clock_time, '%Y-%m-%d %H:%M')
+
+def test_slot_is_the_next_trading_hour():
+    assert next_trading_slot(at('2024-03-06 10:32')) == at('2024-03-06 11:30')
+    assert next_trading_slot(at('2024-03-06 09:00')) == at('2024-03-06 10:30')
+    assert next_trading_slot(at('2024-03-06 16:40')) == at('2024-03-07 10:30')
+
+def test_key_is_case_insensitive_and_holds_the_version():
+    cache = PredictionCache(clock=lambda: at('2024-03-06 10:32'))
+    assert cache.key("aapl", 3) == cache.key("AAPL", 3) == ("AAPL", at('2024-03-06 11:30'), 3)
+    assert cache.key("AAPL", 3) != cache.key("AAPL", 4)
+
+def test_entries_expire_with_the_slot():
+    now = [at('2024-03-06 10:32')]
+    cache = PredictionCache(clock=lambda: now[0])
+    key = cache.key("AAPL", 1)
+
+    assert cache.get_or_compute(key, lambda: "first") == "first"
+    assert cache.get_or_compute(key, lambda: "second") == "first"
+
+    now[0] += timedelta(hours=1)
+    assert cache.get_or_compute(key, lambda: "third") == "third"
+    assert cache.cache_stats()["expired"] == 1
+
+def test_uncacheable_values_are_recomputed():
+    cache = PredictionCache(clock=lambda: at('2024-03-06 10:32'))
+    key = cache.key("AAPL", 1)
+    cache.get_or_compute(key, lambda: "error", cacheable=lambda value: False)
+    assert cache.get_or_compute(key, lambda: "value") == "value"
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PredictionCache(max_entries=2, clock=lambda: at('2024-03-06 10:32'))
+    for ticker in ("A", "B", "C"):
+        cache.get_or_compute(cache.key(ticker, 1), lambda: ticker)
+    assert cache.get_or_compute(cache.key("A", 1), lambda: "recomputed") == "recomputed"
+    assert cache.cache_stats()["evictions"] >= 1
+
+def test_concurrent_requests_share_one_computation():
+    cache = PredictionCache(clock=lambda: at('2024-03-06 10:32'))
+    key = cache.key("AAPL", 1)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "value"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get_or_compute(key, compute)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(cache.get_or_compute(key, compute))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    while cache.cache_stats()["coalesced"] < 3:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert results == ["value"] * 4
+    assert len(calls) == 1
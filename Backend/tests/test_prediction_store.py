@@ -0,0 +1,66 @@
+from datetime import datetime
+import pytest
+from prediction_store import PredictionStore
+
+@pytest.fixture
+def store(tmp_path):
+    return PredictionStore(str(tmp_path / "predictions.db"), retention_days=30)
+
+def prediction(times, price, date="2024-03-06", version=1):
+    return {
+        "time": times,
+        "lstm_predicted_price": [price] * len(times),
+        "transformer_predicted_price": [price + 1] * len(times),
+        "predictions_average": [price + 0.5] * len(times),
+        "lstm_avg_metrics": {"mae": 1.0},
+        "transformer_avg_metrics": {"mae": 2.0},
+        "daily_average": price,
+        "date": date,
+        "model_version": version,
+    }
+
+def test_runs_upsert_by_predicted_hour(store):
+    store.store("aapl", prediction(["2024-03-06 10:30:00", "2024-03-06 11:30:00"], 100.0))
+    store.store("AAPL", prediction(["2024-03-06 11:30:00", "2024-03-06 12:30:00"], 200.0, version=2))
+
+    rows = store.predictions("AAPL")
+    assert [row["predicted_time"] for row in rows] == ["2024-03-06 10:30:00", "2024-03-06 11:30:00", "2024-03-06 12:30:00"]
+    assert [row["lstm_predicted_price"] for row in rows] == [100.0, 200.0, 200.0]
+    assert [row["model_version"] for row in rows] == [1, 2, 2]
+    assert store.daily_averages("AAPL") == [{"date": "2024-03-06", "daily_average": 200.0}]
+    assert store.metrics("aapl")["lstm_avg_metrics"] == {"mae": 1.0}
+
+def test_day_bounds_cover_the_whole_day(store):
+    store.store("AAPL", prediction(["2024-03-06 15:30:00", "2024-03-07 10:30:00"], 100.0))
+    assert len(store.predictions("AAPL", "2024-03-06", "2024-03-06")) == 1
+    assert len(store.predictions("AAPL", "2024-03-06", "2024-03-07")) == 2
+    assert len(store.predictions("AAPL", limit=1)) == 1
+    assert store.predictions("MSFT") == []
+
+def test_compact_removes_old_hours_and_keeps_daily_averages(store):
+    store.store("AAPL", prediction(["2024-01-02 10:30:00"], 100.0, date="2024-01-02"))
+    store.store("AAPL", prediction(["2024-03-06 10:30:00"], 110.0, date="2024-03-06"))
+
+    assert store.compact(now=datetime(2024, 3, 7)) == 1
+    assert [row["predicted_time"] for row in store.predictions("AAPL")] == ["2024-03-06 10:30:00"]
+    assert len(store.daily_averages("AAPL")) == 2
+    assert store.compact(retention_days=0, now=datetime(2024, 3, 7)) == 1
+
+def test_firestore_documents_import_without_overwriting_newer_rows(store):
+    store.store("AAPL", prediction(["2024-03-06 11:30:00"], 200.0, version=3))
+    document = {
+        "predictions": [
+            {"predicted_time": "2024-03-06 10:30:00", "lstm_predicted_price": 100.0, "transformer_predicted_price": 101.0, "predictions_average": 100.5},
+            {"predicted_time": "2024-03-06 11:30:00", "lstm_predicted_price": 100.0, "transformer_predicted_price": 101.0, "predictions_average": 100.5},
+        ],
+        "daily_average": [{"daily_average": 90.0, "date": "2024-03-05"}, {"daily_average": 95.0, "date": "2024-03-05"}, {"daily_average": 100.0, "date": "2024-03-06"}],
+        "lstm_avg_metrics": {"mae": 5.0},
+    }
+
+    assert store.import_document("aapl", document) == 1
+    assert store.import_document("aapl", document) == 0
+
+    rows = store.predictions("AAPL")
+    assert [(row["predicted_time"], row["lstm_predicted_price"], row["model_version"]) for row in rows] == [("2024-03-06 10:30:00", 100.0, None), ("2024-03-06 11:30:00", 200.0, 3)]
+    assert store.daily_averages("AAPL") == [{"date": "2024-03-05", "daily_average": 95.0}, {"date": "2024-03-06", "daily_average": 200.0}]
+    assert store.metrics("AAPL")["lstm_avg_metrics"] == {"mae": 1.0}
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+from history_store import HistoryStore
+from datetime import datetime
+from preprocessing import BuildWindows, SplitIndex, ProcessData, ProcessHistory, FeatureFrame, LatestWindow, LastBarTime
+
+FEATURES = ['Open', 'High', 'Low', 'ema_12', 'rsi_14', 'atr_14', 'volume_z_20', 'return']
+
+def bars(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.004, rows)))
+    index = pd.date_range("2024-01-02 14:30", periods=rows, freq="h", tz="UTC")
+    return pd.DataFrame({"Open": close * 1.001, "High": close * 1.003, "Low": close * 0.997, "Close": close, "Adj Close": close,
+                         "Volume": rng.lognormal(13, 0.5, rows)}, index=index)
+
+def test_windows_match_the_rows_they_cover():
+    data = np.arange(40 * 4, dtype=np.float64).reshape(40, 4)
+    X, y = BuildWindows(data, backcandles=5, futurecandles=3, feature_count=3)
+
+    assert X.shape == (32, 5, 3)
+    assert y.shape == (32, 3)
+    for sample in (0, 17, 31):
+        np.testing.assert_array_equal(X[sample], data[sample:sample + 5, :3])
+        np.testing.assert_array_equal(y[sample], data[sample + 5:sample + 8, 3])
+
+def test_windows_are_views_of_one_base_array():
+    data = np.ones((30, 4), dtype=np.float32)
+    X, y = BuildWindows(data, backcandles=5, futurecandles=3, feature_count=3)
+    assert np.shares_memory(X, data)
+    assert np.shares_memory(y, data)
+
+def test_windows_need_enough_rows():
+    with pytest.raises(ValueError):
+        BuildWindows(np.ones((8, 4)), backcandles=5, futurecandles=3, feature_count=3)
+
+@pytest.mark.parametrize("samples, test_size, split", [(100, 0.2, 80), (101, 0.2, 80), (10, 0.25, 7), (1, 0.2, 0)])
+def test_split_index_keeps_the_trailing_test_set(samples, test_size, split):
+    assert SplitIndex(samples, test_size) == split
+
+def test_chunked_history_matches_process_data(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append("AAPL", bars(1200))
+
+    chunked = ProcessHistory(store, "AAPL", chunk_rows=97, features=FEATURES)
+    whole = ProcessData(store.frame("AAPL"), features=FEATURES)
+
+    assert chunked[0].shape == (937, 21, len(FEATURES))
+    for chunked_values, whole_values in zip(chunked[:4], whole[:4]):
+        np.testing.assert_allclose(chunked_values, whole_values, rtol=1e-5, atol=1e-5)
+
+def test_scaled_history_lives_in_a_scratch_memory_map(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append("AAPL", bars(300))
+
+    X_train = ProcessHistory(store, "AAPL", chunk_rows=64)[0]
+    base = X_train
+    while not isinstance(base, np.memmap) and getattr(base, "base", None) is not None:
+        base = base.base
+
+    assert isinstance(base, np.memmap)
+    assert X_train.shape[-1] == 3
+    assert store.tickers() == ["AAPL"]
+
+# The served window ends on the newest bar instead of where the last training window ends
+def test_latest_window_ends_on_the_newest_bar():
+    data = bars(60)
+    _, _, _, _, backcandles, _, feature_scaler = ProcessData(data.copy(), features=FEATURES)
+    scaled = feature_scaler.transform(FeatureFrame(data.dropna(), FEATURES))
+
+    window = LatestWindow(data, feature_scaler, backcandles, 7, FEATURES)
+    np.testing.assert_allclose(window[0], scaled[-backcandles:])
+    assert LatestWindow(data.iloc[:backcandles - 1], feature_scaler, backcandles, 7, FEATURES) is None
+
+def test_last_bar_time_is_naive_new_york_time():
+    assert LastBarTime(bars(3)) == datetime(2024, 1, 2, 11, 30)
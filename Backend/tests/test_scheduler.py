@@ -0,0 +1,160 @@
+import os
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from stock_api import BarCache
+import timing
+from scheduler import PrecomputeScheduler, bar_fingerprint, last_bar_close, next_run, session_runs
+
+def at(value):
+    return datetime.strptime(value, '%Y-%m-%d %H:%M')
+
+# Clock the tests move forward by hand
+class FakeClock:
+    def __init__(self, now):
+        self.now = at(now)
+
+    def __call__(self):
+        return self.now
+
+class FakeRegistry:
+    def __init__(self, version=1):
+        self.version = version
+
+    def serving_model(self, ticker):
+        return ticker.upper(), self.version
+
+class FakeStore:
+    def __init__(self):
+        self.stored = []
+
+    def store(self, symbol, prediction):
+        self.stored.append(symbol)
+
+# Predictor that stands in for the worker pool. Like a worker it fetches the ticker's bars into the cache before
+# predicting, the bars it fetches are the ones in bars_upstream. Tickers in failing come back with an error.
+class FakePredictor:
+    def __init__(self, cache, clock):
+        self.cache = cache
+        self.clock = clock
+        self.bars_upstream = {}
+        self.failing = set()
+        self.calls = []
+
+    def __call__(self, symbols):
+        self.calls.append(list(symbols))
+        for symbol in symbols:
+            if symbol in self.failing:
+                yield {symbol: {"Error": "upstream failed"}}
+                continue
+
+            write_bars(self.cache, symbol, self.bars_upstream.get(symbol, 3), self.clock())
+            yield {symbol: prediction()}
+
+def prediction():
+    return {"time": ["2024-03-06 11:30:00"], "lstm_predictions": [1.0], "lstm_avg_metrics": {}, "transformer_predictions": [2.0],
+            "transformer_avg_metrics": {}, "predictions_average": [1.5], "daily_average": 1.5, "date": "2024-03-06", "model_version": 1}
+
+# Writes the first rows hourly bars into the cache, stamped as written at the given time
+def write_bars(cache, ticker, rows, written_at):
+    close = np.linspace(100, 100 + rows, rows)
+    index = pd.date_range("2024-03-06 09:30", periods=rows, freq="h", tz="America/New_York").as_unit("ns")
+    cache.write(ticker, pd.DataFrame({"Close": close, "Volume": close * 10}, index=index))
+    os.utime(cache.path(ticker), (written_at.timestamp(), written_at.timestamp()))
+
+def scheduler(tmp_path, now, watchlist=("AAPL", "MSFT")):
+    clock = FakeClock(now)
+    cache = BarCache(str(tmp_path), source=None)
+    predictor = FakePredictor(cache, clock)
+    registry = FakeRegistry()
+    store = FakeStore()
+    return PrecomputeScheduler(list(watchlist), predictor, store, bar_fingerprint(registry, str(tmp_path), clock), clock=clock), predictor, registry, store
+
+def test_session_has_a_pre_market_run_and_one_per_bar_close():
+    runs = session_runs(at('2024-03-06 00:00').date())
+    assert runs[0] == (at('2024-03-06 09:00'), "pre_market")
+    assert runs[1] == (at('2024-03-06 10:32'), "bar_close")
+    assert runs[-1] == (at('2024-03-06 16:32'), "bar_close")
+    assert session_runs(at('2024-03-09 00:00').date()) == []
+
+def test_next_run_and_last_bar_close_skip_the_weekend():
+    assert next_run(at('2024-03-06 10:32')) == (at('2024-03-06 11:32'), "bar_close")
+    assert next_run(at('2024-03-08 17:00')) == (at('2024-03-11 09:00'), "pre_market")
+    assert last_bar_close(at('2024-03-11 09:00')) == at('2024-03-08 16:30')
+    assert last_bar_close(at('2024-03-06 11:29')) == at('2024-03-06 10:30')
+
+def test_tick_runs_only_once_the_next_run_is_due(tmp_path):
+    precompute, predictor, _, store = scheduler(tmp_path, '2024-03-06 10:00')
+    assert precompute.tick() is None
+    assert predictor.calls == []
+
+    precompute.clock.now = at('2024-03-06 10:33')
+    summary = precompute.tick()
+    assert summary["reason"] == "bar_close"
+    assert sorted(summary["computed"]) == ["AAPL", "MSFT"]
+    assert sorted(store.stored) == ["AAPL", "MSFT"]
+    assert precompute.next == (at('2024-03-06 11:32'), "bar_close")
+    assert precompute.tick() is None
+
+def test_every_bar_close_runs_although_nothing_fetched_the_new_bar_yet(tmp_path):
+    precompute, predictor, _, _ = scheduler(tmp_path, '2024-03-06 10:33')
+    assert sorted(precompute.run()["computed"]) == ["AAPL", "MSFT"]
+
+    # The cache was last written at 10:33, before the 11:30 bar closed, so the tickers are run to fetch it
+    precompute.clock.now = at('2024-03-06 11:33')
+    assert precompute.run()["skipped"] == []
+    assert len(predictor.calls) == 2
+
+def test_run_latency_is_exported_with_its_help(tmp_path):
+    precompute, _, _, _ = scheduler(tmp_path, '2024-03-06 10:33')
+    precompute.run()
+
+    lines = timing.metrics.render().splitlines()
+    assert "# HELP profitpulse_precompute_seconds Seconds the last scheduled precomputation of the watchlist took" in lines
+    assert "# TYPE profitpulse_precompute_seconds gauge" in lines
+
+def test_unchanged_bars_and_model_are_skipped(tmp_path):
+    precompute, predictor, registry, _ = scheduler(tmp_path, '2024-03-06 16:33')
+    precompute.run()
+
+    # Nothing closed overnight, the pre-market run finds the bars the 16:32 run predicted from
+    precompute.clock.now = at('2024-03-07 09:00')
+    summary = precompute.run()
+    assert sorted(summary["skipped"]) == ["AAPL", "MSFT"]
+    assert summary["computed"] == []
+    assert predictor.calls[-1] == []
+
+    # A newly registered model changes the fingerprint
+    registry.version = 2
+    assert sorted(precompute.run()["computed"]) == ["AAPL", "MSFT"]
+
+def test_new_bars_are_computed_and_failed_tickers_retried(tmp_path):
+    precompute, predictor, _, _ = scheduler(tmp_path, '2024-03-06 16:33')
+    predictor.failing = {"MSFT"}
+    summary = precompute.run()
+    assert summary["computed"] == ["AAPL"]
+    assert summary["failed"] == {"MSFT": "upstream failed"}
+
+    # A dashboard request fetched a new AAPL bar into the cache after the last run
+    write_bars(predictor.cache, "AAPL", 4, at('2024-03-06 16:50'))
+    predictor.bars_upstream["AAPL"] = 4
+    predictor.failing = set()
+    precompute.clock.now = at('2024-03-06 17:00')
+    summary = precompute.run()
+    assert sorted(summary["computed"]) == ["AAPL", "MSFT"]
+    assert summary["skipped"] == []
+
+    summary = precompute.run()
+    assert sorted(summary["skipped"]) == ["AAPL", "MSFT"]
+
+def test_fingerprint_reads_the_cache_without_fetching(tmp_path):
+    clock = FakeClock('2024-03-06 12:00')
+    fingerprint = bar_fingerprint(FakeRegistry(3), str(tmp_path), clock)
+    assert fingerprint("AAPL") is None
+
+    write_bars(BarCache(str(tmp_path), source=None), "AAPL", 3, at('2024-03-06 11:45'))
+    assert fingerprint("aapl") == [str(np.datetime64(pd.Timestamp("2024-03-06 11:30", tz="America/New_York").value, 'ns')), "AAPL", 3]
+
+    # Once the next bar has closed the cached bars are stale
+    clock.now = at('2024-03-06 12:31')
+    assert fingerprint("AAPL") is None
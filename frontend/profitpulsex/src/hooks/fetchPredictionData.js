@@ -1,6 +1,3 @@
-import { doc, getDoc } from "firebase/firestore";
-import { db } from "../firebaseConfig";
-
 const fetchPredictions = async (symbol) => {
   try {
     //  date in Eastern Time Zone
@@ -39,36 +36,23 @@ const fetchPredictions = async (symbol) => {
       nextMarketDateString
     );
 
-    // retrive predictions document
-    const stockDocRef = doc(db, "predictions", symbol);
-    const stockDocSnap = await getDoc(stockDocRef);
-
-    if (stockDocSnap.exists()) {
-      // access the predicitons data
-      const data = stockDocSnap.data().predictions || [];
-      console.log("Raw predictions data:", data);
-
-      // filter the market data for next market days to display
-      const nextDayPredictions = data.filter((prediction) => {
-        const predictionDate = prediction.predicted_time.split(" ")[0];
-        console.log(
-          "Comparing predictionDate:",
-          predictionDate,
-          "with nextMarketDateString:",
-          nextMarketDateString
-        );
-        return predictionDate === nextMarketDateString;
-      });
+    // retrieve only the next market day's predictions from the prediction history endpoint
+    const response = await fetch(
+      `/api/predictions?symbol=${encodeURIComponent(symbol)}&from=${nextMarketDateString}&to=${nextMarketDateString}`
+    );
+    if (!response.ok) {
+      throw new Error(`Fetching predictions failed with status ${response.status}`);
+    }
 
-      console.log(
-        "Filtered predictions for next market day:",
-        nextDayPredictions
-      );
-      return nextDayPredictions;
-    } else {
+    const nextDayPredictions = (await response.json()).predictions || [];
+    if (nextDayPredictions.length === 0) {
       console.log(`No predictions found for the stock ${symbol}.`);
-      return [];
     }
+    console.log(
+      "Predictions for next market day:",
+      nextDayPredictions
+    );
+    return nextDayPredictions;
   } catch (error) {
     console.error("Error fetching next market day's prediction data:", error);
     return [];
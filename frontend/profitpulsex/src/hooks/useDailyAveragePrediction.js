@@ -1,6 +1,5 @@
 import { useState, useEffect } from "react";
-import { doc, getDoc } from "firebase/firestore";
-import { db } from "../firebaseConfig";
+import axios from "axios";
 // Function to get the next market day in "YYYY-MM-DD" format.
 const getNextMarketDay = () => {
   const today = new Date();
@@ -39,29 +38,22 @@ const useDailyAveragePrediction = (symbol) => {
   useEffect(() => {
     const fetchDailyAverage = async () => {
       try {
-        const stockDocRef = doc(db, "predictions", symbol);
-        const stockDocSnap = await getDoc(stockDocRef);
-        if (stockDocSnap.exists()) {
-          const data = stockDocSnap.data().daily_average || [];
-          // Get the next market day
-          const nextMarketDateString = getNextMarketDay();
-          console.log(
-            "Next Market Date (nextMarketDateString):",
-            nextMarketDateString
-          );
-          // Match next market day
-          const predictionForNextMarketDay = data.find(
-            (entry) => entry.date === nextMarketDateString
-          );
-          if (predictionForNextMarketDay) {
-            setDailyAverage(predictionForNextMarketDay.daily_average);
-          } else {
-            // removed No prediction data available for the next market day.
-            setError("");
-            setDailyAverage(null);
-          }
+        // Get the next market day
+        const nextMarketDateString = getNextMarketDay();
+        console.log(
+          "Next Market Date (nextMarketDateString):",
+          nextMarketDateString
+        );
+        // Read only the next market day's average from the prediction history endpoint
+        const response = await axios.get("/api/predictions/daily", {
+          params: { symbol, from: nextMarketDateString, to: nextMarketDateString },
+        });
+        const predictionForNextMarketDay = (response.data.daily_average || [])[0];
+        if (predictionForNextMarketDay) {
+          setDailyAverage(predictionForNextMarketDay.daily_average);
         } else {
-          setError(`No data found for stock ${symbol}`);
+          // removed No prediction data available for the next market day.
+          setError("");
           setDailyAverage(null);
         }
       } catch (error) {
@@ -1,7 +1,5 @@
 import { useEffect, useState } from "react";
 import axios from "axios";
-import { doc, getDoc, setDoc } from "firebase/firestore";
-import { db } from "../firebaseConfig";
 
 const useSpecificStockData = (symbol) => {
   // state variables for setting stock,  prediction data, loading and errors
@@ -10,10 +8,6 @@ const useSpecificStockData = (symbol) => {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
 
-  // Api and cache duration of 24 hours
-  const apiKey = "ZLEF4DDCNCJGHU3I";
-  const cacheDuration = 24 * 60 * 60 * 1000;
-
   // function to get last market day
   const getLastMarketDay = () => {
     const today = new Date();
@@ -46,125 +40,50 @@ const useSpecificStockData = (symbol) => {
     return localDate.toLocaleDateString("en-CA");
   };
 
-  // filter to times relevant to prediction data
-  const filterSpecificTimes = (data, lastMarketDay) => {
-    const specificTimes = [
-      "10:30:00",
-      "11:30:00",
-      "12:30:00",
-      "13:30:00",
-      "14:30:00",
-      "15:30:00",
-      "16:30:00",
-    ];
-
-    return Object.keys(data)
-      .filter((timestamp) => {
-        const [date, time] = timestamp.split(" ");
-        return date === lastMarketDay && specificTimes.includes(time);
-      })
-      .map((timestamp) => ({
-        time: timestamp,
-        close: parseFloat(data[timestamp]["4. close"]),
-      }));
-  };
-
-  // fetches hourly prediction data from firestore
+  // fetches the hourly predictions of the last market day from the prediction history endpoint
   const fetchPredictionData = async (symbol, lastMarketDay) => {
-    const predictionsRef = doc(db, "predictions", symbol);
-
     try {
-      const predictionsSnapshot = await getDoc(predictionsRef);
-      if (predictionsSnapshot.exists()) {
-        const predictions = predictionsSnapshot.data();
-        const hourlyPredictions = predictions.predictions || [];
-
-        // Align predictions with specific times
-        const alignedPredictions = hourlyPredictions
-          .filter((prediction) =>
-            prediction.predicted_time.startsWith(lastMarketDay)
-          )
-          .map((prediction) => ({
-            time: prediction.predicted_time,
-            average: parseFloat(prediction.predictions_average),
-            lstm: parseFloat(prediction.lstm_predicted_price),
-            transformer: parseFloat(prediction.transformer_predicted_price),
-          }));
+      const response = await axios.get("/api/predictions", {
+        params: { symbol, from: lastMarketDay, to: lastMarketDay },
+      });
+      const hourlyPredictions = response.data.predictions || [];
+
+      // Align predictions with specific times
+      const alignedPredictions = hourlyPredictions.map((prediction) => ({
+        time: prediction.predicted_time,
+        average: parseFloat(prediction.predictions_average),
+        lstm: parseFloat(prediction.lstm_predicted_price),
+        transformer: parseFloat(prediction.transformer_predicted_price),
+      }));
 
-        setPredictedHourlyData(alignedPredictions);
-      } else {
-        console.warn("No hourly prediction data found in Firestore.");
-        setPredictedHourlyData([]);
+      if (alignedPredictions.length === 0) {
+        console.warn("No hourly prediction data found.");
       }
+      setPredictedHourlyData(alignedPredictions);
     } catch (error) {
       console.error("Error fetching hourly prediction data:", error);
       setError(`Failed to fetch prediction data for ${symbol}`);
     }
   };
 
-  // fetches data from cache or API based on cache duration
+  // fetches the closes at the prediction slots of the last market day from the shared market data endpoint, which
+  // serves every user from one cached upstream download
   const fetchSpecificStockData = async () => {
     setLoading(true);
     setError(null);
 
     const lastMarketDay = getLastMarketDay();
-    const docRef = doc(
-      db,
-      "specificTimesStockData",
-      `${symbol}-${lastMarketDay}`
-    );
-    const now = Date.now();
 
     try {
-      const docSnapshot = await getDoc(docRef);
-
-      if (docSnapshot.exists()) {
-        const cachedData = docSnapshot.data();
-
-        if (now - cachedData.timestamp < cacheDuration) {
-          console.log(`Using cached data for ${symbol} - ${lastMarketDay}`);
-          setSpecificTimesStockData(cachedData.data);
-          await fetchPredictionData(symbol, lastMarketDay);
-          setLoading(false);
-          return;
-        }
-      }
-
-      console.log("Fetching new data from API.");
-      const response = await axios.get(
-        `https://www.alphavantage.co/query?function=TIME_SERIES_INTRADAY&symbol=${symbol}&interval=30min&apikey=${apiKey}`
-      );
-
-      // filter API data for specific times
-      if (!response.data["Time Series (30min)"]) {
-        throw new Error(`API response invalid for ${symbol}`);
-      }
-
-      const data = response.data["Time Series (30min)"];
-      const filteredData = filterSpecificTimes(data, lastMarketDay);
-
-      // cache data in firestore
-      await setDoc(docRef, {
-        data: filteredData,
-        lastMarketDay,
-        timestamp: now,
+      const response = await axios.get("/api/market/intraday", {
+        params: { symbol, day: lastMarketDay },
       });
 
-      setSpecificTimesStockData(filteredData);
+      setSpecificTimesStockData(response.data.bars || []);
       await fetchPredictionData(symbol, lastMarketDay);
     } catch (error) {
       console.error(`Error fetching stock data for ${symbol}:`, error);
-
-      // in case of API failure, use data from firestore
-      const fallbackSnapshot = await getDoc(docRef);
-      if (fallbackSnapshot.exists()) {
-        console.warn("Using fallback data from Firestore.");
-        setSpecificTimesStockData(fallbackSnapshot.data().data || []);
-        await fetchPredictionData(symbol, lastMarketDay);
-      } else {
-        console.error("No fallback data available in Firestore.");
-        setSpecificTimesStockData([]);
-      }
+      setSpecificTimesStockData([]);
       setError(`Failed to fetch stock data for ${symbol}`);
     } finally {
       setLoading(false);
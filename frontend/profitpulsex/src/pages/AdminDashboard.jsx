@@ -8,10 +8,44 @@ import { auth, db, } from "../firebaseConfig";
 import MetricsPopup from "../component/MetricsPopup";
 
 
-// Function to fetch predicted price from Python API that is located in Backend/PredictionModel/predict_model.py and if the fetched response
-// is not code 200, it will throw an error stating that it failed. If code 200 is present, it will return the data in JSON format
-const fetchPredictedPrice = async (symbol) => {
-    const response = await fetch(`/api/predict?symbol=${symbol}`);
+// Function to retrain the models through the Python API that is located in Backend/PredictionModel/predict_model.py. Training runs as a background
+// job, so it submits the job, follows its live progress events until it has finished and then fetches the new predictions. Each progress event
+// (stage changes and training epochs) is passed to onProgress. If any of the responses are not code 200, or the job fails, it will throw an error
+// stating that it failed. Otherwise it will return the predictions in JSON format. Only admins may start jobs, so the signed in user's ID token is sent along.
+const fetchPredictedPrice = async (symbol, onProgress) => {
+    if (!auth.currentUser) {
+        throw new Error("Training requires a signed in admin");
+    }
+    const idToken = await auth.currentUser.getIdToken();
+    const submitResponse = await fetch(`/api/train?symbol=${symbol}`, { method: "POST", headers: { "Authorization": `Bearer ${idToken}` } });
+    if (!submitResponse.ok) {
+        throw new Error("Failed to submit training job to API");
+    }
+    const { job_id } = await submitResponse.json();
+
+    await new Promise((resolve, reject) => {
+        const progressEvents = new EventSource(`/api/jobs/${job_id}/events`);
+        progressEvents.onmessage = (message) => {
+            if (onProgress) {
+                onProgress(JSON.parse(message.data));
+            }
+        };
+        progressEvents.addEventListener("end", (message) => {
+            progressEvents.close();
+            const job = JSON.parse(message.data);
+            if (job.status === "done") {
+                resolve();
+            } else {
+                reject(new Error(`Training job failed: ${job.error}`));
+            }
+        });
+        progressEvents.onerror = () => {
+            progressEvents.close();
+            reject(new Error("Lost connection to the training job progress"));
+        };
+    });
+
+    const response = await fetch(`/api/jobs/${job_id}/result`);
     if (!response.ok) {
         throw new Error("Failed to fetch predicted price from API");
     }
@@ -260,7 +294,10 @@ function AdminDashboard() {
     const fetchPredictions = async (ticker) => {
         try {
             setPredictedSymbol(ticker);
-            const prediction_data = await fetchPredictedPrice(ticker);
+            setConsoleLog("");
+            const prediction_data = await fetchPredictedPrice(ticker, (event) => {
+                setConsoleLog((log) => (log ? `${log}\n${event.message}` : event.message));
+            });
             setConsoleLog(prediction_data.console_output);
             setLSTMPredictedPrice(prediction_data.lstm_predicted_price);
             setTransformerPredictedPrice(prediction_data.transformer_predicted_price);